@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回填日记打卡统计表 diary_streaks
+
+为所有写过日记的用户从 diaries 表重算连续天数、最长连续天数和最近日期。
+可重复执行；上线 diary_streaks 后运行一次即可（缺失的统计行在读取时也会自动补齐）。
+
+用法（项目根目录）：
+    python scripts/backfill_diary_streaks.py [--batch-size 200]
+"""
+
+import argparse
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, os.path.abspath(SRC_DIR))
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(SRC_DIR, '.env'))
+
+from database import backfill_diary_streaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill diary_streaks for existing users')
+    parser.add_argument('--batch-size', type=int, default=200, help='users per commit')
+    args = parser.parse_args()
+
+    processed = backfill_diary_streaks(batch_size=args.batch_size)
+    print(f"已回填 {processed} 个用户的打卡统计")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
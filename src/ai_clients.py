@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+AI 服务客户端注册表 - DeepSeek / 豆包共享的 HTTP 连接池
+
+每个服务商只有一个 OpenAI 兼容客户端，底层是显式配置的 httpx 连接池：
+- 连接数上限、keep-alive 连接数和空闲保持时间可配置，连接被复用，TLS 握手不再出现在请求路径上
+- 安装了 h2 时使用 HTTP/2，多个流式回答复用同一条连接
+- 连接/读/写/取连接超时分开设置；读超时是两个数据块之间的最长间隔，深度思考需要较长
+- 单次调用需要不同超时（如健康探测）时用 client.with_options(timeout=...)，
+  得到的副本共享同一个连接池，不会重建客户端，也不会修改共享客户端的配置
+
+只有 API Key、base_url 或读超时变化时才重建客户端；旧客户端上进行中的流不受影响。
+async_client() 返回 AsyncOpenAI 客户端（ASGI 路径使用，见 asgi.py），连接池配置相同，
+但 httpx 异步连接绑定事件循环，只能在创建它的事件循环中使用：客户端记录创建时的事件循环，
+在另一个事件循环中调用时重建（与 asgi.py 中 AsyncSingleFlight 的处理相同）。
+
+配置（环境变量）：
+- AI_MAX_CONNECTIONS: 每个服务商的最大连接数，默认 64（ASGI 路径的默认值见 asgi.py）；
+  没有 h2 时每个流式调用独占一条连接，超过上限的调用等待 AI_POOL_TIMEOUT 后报错
+- AI_MAX_KEEPALIVE: 保持的空闲连接数，默认 32
+- AI_KEEPALIVE_EXPIRY: 空闲连接保持时间（秒），默认 60
+- AI_CONNECT_TIMEOUT: 建立连接（含 TLS）超时（秒），默认 10
+- AI_WRITE_TIMEOUT: 发送请求超时（秒），默认 60（图片请求体较大）
+- AI_POOL_TIMEOUT: 等待空闲连接的超时（秒），默认 30
+- AI_HTTP2: auto / true / false，默认 auto（安装了 h2 时启用）
+"""
+
+import os
+import asyncio
+import logging
+import threading
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+try:
+    import h2  # noqa: F401  仅用于检测是否可以启用 HTTP/2
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+
+class AIClientRegistry:
+    """服务商名称 -> 共享连接池的 OpenAI 兼容客户端"""
+
+    def __init__(
+        self,
+        max_connections=64,
+        max_keepalive=32,
+        keepalive_expiry=60.0,
+        connect_timeout=10.0,
+        write_timeout=60.0,
+        pool_timeout=30.0,
+        http2='auto',
+    ):
+        self.limits = httpx.Limits(
+            max_connections=int(max_connections),
+            max_keepalive_connections=int(max_keepalive),
+            keepalive_expiry=float(keepalive_expiry),
+        )
+        self.connect_timeout = float(connect_timeout)
+        self.write_timeout = float(write_timeout)
+        self.pool_timeout = float(pool_timeout)
+
+        http2 = str(http2).lower()
+        if http2 in ('1', 'true') and h2 is None:
+            logger.warning("AI_HTTP2 requested but the h2 package is not installed - using HTTP/1.1")
+        self.http2 = h2 is not None and http2 in ('auto', '1', 'true')
+
+        self._lock = threading.Lock()
+        self._clients = {}  # name -> {'signature', 'loop', 'client', 'http_client', 'stats', 'base_url'}
+
+    def timeout(self, read_timeout):
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=float(read_timeout),
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def client(self, name, api_key, base_url, read_timeout=600.0):
+        """返回服务商的共享客户端；配置未变化时总是同一个实例"""
+        return self._get(name, api_key, base_url, read_timeout, is_async=False)
+
+    def async_client(self, name, api_key, base_url, read_timeout=600.0):
+        """
+        返回服务商的共享 AsyncOpenAI 客户端（统计中名称为 <name>_async）
+
+        必须在事件循环中调用；同一个事件循环内总是同一个实例，换了事件循环时重建。
+        """
+        return self._get(f'{name}_async', api_key, base_url, read_timeout, is_async=True)
+
+    def _get(self, name, api_key, base_url, read_timeout, is_async):
+        signature = (api_key, base_url, float(read_timeout))
+        loop = asyncio.get_running_loop() if is_async else None
+        with self._lock:
+            entry = self._clients.get(name)
+            if entry is None or entry['signature'] != signature or entry['loop'] is not loop:
+                rebuilds = entry['stats']['rebuilds'] + 1 if entry else 0
+                if entry is not None and entry['signature'] != signature:
+                    logger.info(f"AI client '{name}' configuration changed - rebuilding connection pool")
+                elif entry is not None:
+                    logger.info(f"AI client '{name}' used from a new event loop - rebuilding connection pool")
+                entry = self._build(signature, rebuilds, is_async)
+                entry['loop'] = loop
+                self._clients[name] = entry
+            return entry['client']
+
+    def _build(self, signature, rebuilds, is_async):
+        api_key, base_url, read_timeout = signature
+        stats = {'requests': 0, 'connections_opened': 0, 'tls_handshakes': 0, 'rebuilds': rebuilds}
+        stats_lock = threading.Lock()
+
+        def count(event):
+            if event == 'connection.connect_tcp.complete':
+                key = 'connections_opened'
+            elif event == 'connection.start_tls.complete':
+                key = 'tls_handshakes'
+            else:
+                return
+            with stats_lock:
+                stats[key] += 1
+
+        def count_request(request, trace):
+            request.extensions['trace'] = trace
+            with stats_lock:
+                stats['requests'] += 1
+
+        timeout = self.timeout(read_timeout)
+        if is_async:
+            # httpx 异步客户端要求 trace 回调和事件钩子都是协程函数
+            async def trace(event, info):
+                count(event)
+
+            async def on_request(request):
+                count_request(request, trace)
+
+            http_client = DefaultAsyncHttpxClient(
+                http2=self.http2, limits=self.limits, timeout=timeout, event_hooks={'request': [on_request]}
+            )
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, http_client=http_client)
+        else:
+            def trace(event, info):
+                count(event)
+
+            def on_request(request):
+                count_request(request, trace)
+
+            http_client = DefaultHttpxClient(
+                http2=self.http2, limits=self.limits, timeout=timeout, event_hooks={'request': [on_request]}
+            )
+            client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, http_client=http_client)
+        return {
+            'signature': signature,
+            'client': client,
+            'http_client': http_client,
+            'stats': stats,
+            'stats_lock': stats_lock,
+            'base_url': base_url,
+        }
+
+    @staticmethod
+    def _pool_stats(http_client):
+        """连接池当前状态（读取 httpcore 内部结构，版本不兼容时返回空字典）"""
+        try:
+            pool = http_client._transport._pool
+            connections = list(pool.connections)
+            idle = sum(1 for connection in connections if connection.is_idle())
+            return {
+                'connections': len(connections),
+                'active': len(connections) - idle,
+                'idle': idle,
+                'http2': sum(1 for connection in connections if connection.info().startswith('HTTP/2')),
+                'queued_requests': len(getattr(pool, '_requests', ())),
+            }
+        except AttributeError:
+            return {}
+
+    def stats(self):
+        with self._lock:
+            entries = dict(self._clients)
+        data = {}
+        for name, entry in entries.items():
+            with entry['stats_lock']:
+                stats = dict(entry['stats'])
+            requests = stats['requests']
+            stats['connection_reuse_ratio'] = (
+                round(1 - stats['connections_opened'] / requests, 4) if requests else 0.0
+            )
+            stats['pool'] = self._pool_stats(entry['http_client'])
+            stats['base_url'] = entry['base_url']
+            stats['read_timeout'] = entry['signature'][2]
+            data[name] = stats
+        return {
+            'http2': self.http2,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive': self.limits.max_keepalive_connections,
+            'providers': data,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_ai_clients():
+    """进程级共享的 AI 客户端注册表（首次调用时按环境变量创建）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = AIClientRegistry(
+                    max_connections=int(os.getenv('AI_MAX_CONNECTIONS', 64)),
+                    max_keepalive=int(os.getenv('AI_MAX_KEEPALIVE', 32)),
+                    keepalive_expiry=float(os.getenv('AI_KEEPALIVE_EXPIRY', 60)),
+                    connect_timeout=float(os.getenv('AI_CONNECT_TIMEOUT', 10)),
+                    write_timeout=float(os.getenv('AI_WRITE_TIMEOUT', 60)),
+                    pool_timeout=float(os.getenv('AI_POOL_TIMEOUT', 30)),
+                    http2=os.getenv('AI_HTTP2', 'auto'),
+                )
+    return _registry
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+回答缓存 - 完全相同的问题直接回放已生成的回答
+
+同一道作业题每天会被提交很多次，每次都触发一次完整的 deepseek-reasoner / 豆包流式调用。
+这里按"问题 + 生成参数"计算缓存 key，保存完整的事件序列（思考过程、回答、深度思考的各阶段），
+命中时不调用模型，直接以 SSE 全速回放。
+
+缓存 key 包含：规范化后的问题文本、各上传图片原始字节的 SHA-256（upload_hashes）、
+学科、语言、level_effective、teaching_phase、查询类型（普通/深度思考）、提示词版本（PROMPT_VERSION）
+以及个性化学习画像的摘要。自评分数和手动层级只通过 level_effective 影响回答，不单独参与 key。
+
+配置（环境变量）：
+- ANSWER_CACHE_ENABLED: 是否启用，默认 true
+- ANSWER_CACHE_MAX_ENTRIES: 最多缓存的回答数，默认 2000（LRU 淘汰）
+- ANSWER_CACHE_TTL: 回答缓存时间（秒），默认 86400
+- SEMANTIC_CACHE_ENABLED: 是否启用语义近似匹配（见 semantic_cache.py），默认 false
+- SEMANTIC_CACHE_THRESHOLD: 视为同一问题的最低余弦相似度，默认 0.92
+- SEMANTIC_CACHE_MAX_ENTRIES: 语义索引最多保存的问题数，默认 20000
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+
+from personalization import PROMPT_VERSION
+from semantic_cache import SemanticQuestionIndex
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+# 回放时合并相邻的同类事件（逐 token 的事件合并为一段）
+_MERGEABLE_TYPES = frozenset({'thinking', 'answer', 'verify_thinking', 'verify_answer'})
+
+
+def normalize_question(text):
+    """NFKC（全角转半角等）+ 合并空白；不改变大小写，物理量的大小写有含义"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def generation_params(session_data, prompt_version=PROMPT_VERSION):
+    """除问题文本和图片外，决定回答内容的全部参数"""
+    profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else None
+    return {
+        'v': prompt_version,
+        'type': session_data.get('type', 'text'),
+        'subject': session_data.get('subject', 'physics'),
+        'lang': session_data.get('lang', 'zh-CN'),
+        'level': session_data.get('level_effective', 'standard'),
+        'phase': int(session_data.get('teaching_phase', 2)),
+        'profile': _digest(profile) if profile else '',
+    }
+
+
+def answer_cache_key(session_data, prompt_version=PROMPT_VERSION):
+    """
+    计算 session 对应的回答缓存 key；无法可靠判定"同一个问题"时返回 None（不缓存）
+
+    图片查询必须有上传图片的 SHA-256（旧 session 只有文件路径，无法判断图片是否相同）；
+    不使用感知哈希等近似匹配，两张只差一个数字的题目照片也必须得到不同的 key。
+    """
+    query_type = session_data.get('type', 'text')
+    question = normalize_question(session_data.get('question'))
+    image_hashes = list(session_data.get('upload_hashes') or [])
+    if query_type.startswith('image') and not image_hashes:
+        return None
+    if not question and not image_hashes:
+        return None
+
+    parts = generation_params(session_data, prompt_version)
+    parts.update(question=question, images=image_hashes)
+    return _digest(parts)
+
+
+def semantic_scope(session_data, prompt_version=PROMPT_VERSION):
+    """语义匹配的分区（生成参数摘要）；只用于不带图片的文本问题，图片问题由图片哈希决定是否相同"""
+    if session_data.get('type', 'text').startswith('image') or session_data.get('upload_hashes'):
+        return None
+    if not normalize_question(session_data.get('question')):
+        return None
+    return _digest(generation_params(session_data, prompt_version))
+
+
+def coalesce_events(events):
+    """合并相邻的同类内容事件，缩小缓存体积、加快回放"""
+    merged = []
+    for event in events:
+        if (
+            merged
+            and event.get('type') in _MERGEABLE_TYPES
+            and merged[-1].get('type') == event.get('type')
+            and set(event) == {'type', 'content'} == set(merged[-1])
+        ):
+            merged[-1] = {'type': event['type'], 'content': merged[-1]['content'] + event['content']}
+        else:
+            merged.append(dict(event))
+    return merged
+
+
+class AnswerCache:
+    """
+    进程内 LRU + TTL 回答缓存，值为 {'events': [...], 'response': {...}}
+
+    传入 semantic_index（见 semantic_cache.py）时，完全匹配未命中的文本问题再按语义近似查找。
+    """
+
+    def __init__(self, max_entries=2000, ttl=86400.0, semantic_index=None):
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.semantic_index = semantic_index
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'skipped': 0}
+
+    def _add(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        if key is None:
+            self._add('skipped')
+            return None
+        entry = self._cache.get(key)
+        self._add('hits' if entry is not None else 'misses')
+        return entry
+
+    def set(self, key, events, response):
+        """保存完整生成的回答；没有回答内容时不保存。返回是否已保存"""
+        if key is None or not any(event.get('content') for event in events):
+            return False
+        self._cache.set(key, {'events': coalesce_events(events), 'response': dict(response)})
+        self._add('stores')
+        return True
+
+    def lookup(self, session_data):
+        """
+        查找 session 对应的缓存回答：先完全匹配，再（启用时）语义近似匹配
+
+        Returns:
+            (key, entry, similarity)：key 为本次问题的缓存 key；未命中时 entry 为 None；
+            完全匹配时 similarity 为 1.0，语义命中时为余弦相似度
+        """
+        key = answer_cache_key(session_data)
+        if key is None:
+            self._add('skipped')
+            return None, None, None
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._add('hits')
+            return key, entry, 1.0
+
+        scope = semantic_scope(session_data) if self.semantic_index is not None else None
+        if scope is not None:
+            match = self.semantic_index.find(scope, session_data.get('question'))
+            if match is not None:
+                entry = self._cache.get(match[0])
+                if entry is not None:
+                    self._add('semantic_hits')
+                    return key, entry, match[1]
+                self.semantic_index.discard(match[0])  # 回答已过期
+        self._add('misses')
+        return key, None, None
+
+    def store(self, session_data, key, events, response):
+        """保存回答，并登记到语义索引"""
+        if not self.set(key, events, response):
+            return
+        scope = semantic_scope(session_data) if self.semantic_index is not None else None
+        if scope is not None:
+            self.semantic_index.add(scope, session_data.get('question'), key)
+
+    def invalidate(self, key):
+        self._cache.invalidate(key)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        hits = data['hits'] + data['semantic_hits']
+        lookups = hits + data['misses']
+        data['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        data['entries'] = len(self._cache)
+        if self.semantic_index is not None:
+            data['semantic_index'] = self.semantic_index.stats()
+        return data
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """进程级共享的回答缓存；ANSWER_CACHE_ENABLED=false 时返回 None"""
+    global _cache
+    if os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                semantic_index = None
+                if os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true':
+                    semantic_index = SemanticQuestionIndex(
+                        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+                        max_entries=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 20000)),
+                    )
+                _cache = AnswerCache(
+                    max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 2000)),
+                    ttl=float(os.getenv('ANSWER_CACHE_TTL', 86400)),
+                    semantic_index=semantic_index,
+                )
+    return _cache
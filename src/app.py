@@ -1,14 +1,11 @@
 from flask import Flask, request, jsonify, render_template, Response, session, redirect, url_for
 from flask_cors import CORS
 import os
-import time
-from werkzeug.utils import secure_filename
-import base64
+import binascii
 from datetime import datetime
 import json
 import logging
 from openai import (
-    OpenAI,
     AuthenticationError,
     RateLimitError,
     APIConnectionError,
@@ -21,15 +18,27 @@ from prompts import (
     get_subject_prompt_by_lang, get_competition_prompt_by_lang, get_verification_prompt_by_lang
 )
 from doubao_api import DoubaoClient
+from ai_clients import get_ai_clients
+from answer_cache import answer_cache_key, get_answer_cache
+from blob_store import get_blob_store
+from image_cache import get_image_cache
+from image_dedup import get_phash_index
+from image_processing import ImageValidationError, get_payload_stats, probe_image
+from llm_stream import Blocking, ChatStream, Coalesce, EventStream, Sleep
+from session_store import get_session_store, response_key
+from single_flight import get_single_flight
+from retention import start_retention_worker, get_retention_stats, retain_uploads
+from upload_ingest import UploadRejected, ingest_multipart
 from database import (
     init_database, register_user, login_user, check_account_exists, reset_password, get_user_by_id,
-    create_diary, update_diary_ai_response, get_diary_by_id, get_user_diaries,
-    get_diary_count, check_diary_today, get_diary_streak, delete_diary,
+    create_diary, update_diary_ai_response, get_diary_by_id, get_user_diaries, get_user_diaries_by_cursor,
+    get_diary_count, check_diary_today, get_diary_stats, delete_diary,
     # 目标相关
     create_goal, get_user_goals, get_goal_by_id, update_goal, delete_goal, get_goal_count,
     # 历史日记和目标分析
     get_recent_diaries, update_diary_goal_analysis,
-    update_user_scores, get_user_personalization, update_user_personalization, save_learning_profile
+    update_user_scores, get_user_personalization, update_user_personalization, save_learning_profile,
+    get_pool_stats, get_personalization_cache_stats, unit_of_work
 )
 
 from personalization import (
@@ -37,7 +46,6 @@ from personalization import (
     default_teaching_phase,
     get_subject_score,
     resolve_effective_level,
-    sanitize_learning_profile,
     score_to_level,
     build_system_prompt_deepseek,
     build_system_prompt_doubao,
@@ -105,10 +113,7 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-_DEEPSEEK_CLIENT_CACHE = {
-    "api_key": None,
-    "base_url": None,
-    "client": None,
+_DEEPSEEK_CLIENT_STATE = {
     "warned_missing": False,
 }
 
@@ -133,28 +138,43 @@ def get_deepseek_client(timeout: int | None = None):
     """
     Return an OpenAI-compatible client configured for DeepSeek, or None if not configured.
 
-    The client is cached but auto-refreshes if env values change.
+    The client comes from the shared registry (see ai_clients.py) and is only rebuilt if env
+    values change. `timeout` applies to the returned handle only; the shared client and its
+    connection pool are left untouched.
     """
+    settings = _deepseek_settings()
+    if settings is None:
+        return None
+
+    client = get_ai_clients().client("deepseek", **settings)
+    if timeout is not None:
+        return client.with_options(timeout=timeout)
+    return client
+
+
+def get_async_deepseek_client():
+    """AsyncOpenAI client for DeepSeek (ASGI event loop only, see asgi.py), or None if not configured."""
+    settings = _deepseek_settings()
+    if settings is None:
+        return None
+    return get_ai_clients().async_client("deepseek", **settings)
+
+
+def _deepseek_settings():
     api_key = (os.getenv("DEEPSEEK_API_KEY") or "").strip()
     base_url = (os.getenv("DEEPSEEK_BASE_URL") or "https://api.deepseek.com").strip()
 
     if _is_placeholder_api_key(api_key):
-        if not _DEEPSEEK_CLIENT_CACHE["warned_missing"]:
+        if not _DEEPSEEK_CLIENT_STATE["warned_missing"]:
             logger.warning("DEEPSEEK_API_KEY not set/placeholder - DeepSeek features will not work")
-            _DEEPSEEK_CLIENT_CACHE["warned_missing"] = True
+            _DEEPSEEK_CLIENT_STATE["warned_missing"] = True
         return None
 
-    cached = _DEEPSEEK_CLIENT_CACHE
-    if cached["client"] and cached["api_key"] == api_key and cached["base_url"] == base_url:
-        return cached["client"]
-
-    kwargs = {"api_key": api_key, "base_url": base_url}
-    if timeout is not None:
-        kwargs["timeout"] = timeout
-    cached["client"] = OpenAI(**kwargs)
-    cached["api_key"] = api_key
-    cached["base_url"] = base_url
-    return cached["client"]
+    return {
+        "api_key": api_key,
+        "base_url": base_url,
+        "read_timeout": float(os.getenv("DEEPSEEK_READ_TIMEOUT", 600)),
+    }
 
 
 def _msg(lang: str, zh: str, en: str) -> str:
@@ -168,7 +188,7 @@ def user_facing_ai_error_message(exc: Exception, *, lang: str = "zh-CN") -> str:
     """
     text = str(exc) if exc is not None else ""
 
-    if isinstance(exc, RuntimeError) and "DeepSeek is not configured" in text:
+    if isinstance(exc, RuntimeError) and " is not configured" in text:
         return _msg(
             lang,
             "AI 服务未配置（服务器缺少有效的 API Key），请联系管理员。",
@@ -231,25 +251,6 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def get_upload_file_size(file_storage) -> int:
-    if not file_storage:
-        return 0
-    if file_storage.content_length is not None:
-        try:
-            return int(file_storage.content_length)
-        except (TypeError, ValueError):
-            return 0
-    try:
-        stream = file_storage.stream
-        current_pos = stream.tell()
-        stream.seek(0, os.SEEK_END)
-        size = stream.tell()
-        stream.seek(current_pos)
-        return int(size)
-    except Exception:
-        return 0
-
-
 def get_current_language():
     """
     从 Cookie 获取当前语言设置
@@ -577,7 +578,7 @@ def api_get_user_personalization():
     personalization_enabled = bool(data.get('personalization_enabled', True))
     default_explain_level = data.get('default_explain_level') or 'auto'
     updated_at = data.get('learning_profile_updated_at')
-    profile = sanitize_learning_profile(data.get('learning_profile_json'))
+    profile = data.get('learning_profile') or {}
 
     session['personalization_enabled'] = personalization_enabled
     session['default_explain_level'] = default_explain_level
@@ -637,12 +638,13 @@ def api_refresh_learning_profile():
             return jsonify({'success': False, 'message': err}), 500
 
         profile_json_str = json.dumps(profile or {}, ensure_ascii=False)
-        save_result = save_learning_profile(session['user_id'], profile_json_str, updated_at=None)
-        if not save_result.get('success'):
-            return jsonify({'success': False, 'message': save_result.get('message', '保存失败')}), 500
+        with unit_of_work() as uow:
+            save_result = save_learning_profile(session['user_id'], profile_json_str, updated_at=None, uow=uow)
+            if not save_result.get('success'):
+                return jsonify({'success': False, 'message': save_result.get('message', '保存失败')}), 500
 
-        # Refresh updated_at from DB
-        refreshed = get_user_personalization(session['user_id'])
+            # Refresh updated_at from DB (same transaction, sees the write above)
+            refreshed = get_user_personalization(session['user_id'], uow=uow)
         updated_at = None
         if refreshed.get('success') and refreshed.get('data'):
             updated_at = refreshed['data'].get('learning_profile_updated_at')
@@ -732,9 +734,7 @@ def api_generate_ai_response(diary_id):
             'timestamp': str(datetime.now())
         }
 
-        os.makedirs('../data/sessions', exist_ok=True)
-        with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+        get_session_store().save(session_id, session_data)
 
         return jsonify({'success': True, 'session_id': session_id})
     except Exception as e:
@@ -744,17 +744,46 @@ def api_generate_ai_response(diary_id):
 
 @app.route('/api/diaries', methods=['GET'])
 def api_get_diaries():
-    """获取日记列表 API"""
+    """
+    获取日记列表 API
+
+    两种分页模式：
+    - offset 模式（兼容旧版）：?limit=20&offset=0，每次都返回 total
+    - 游标模式：?limit=20&cursor=<next_cursor>（第一页传空 cursor=），
+      返回 next_cursor/has_more；total 默认只在第一页计算，可用 include_total=0/1 覆盖
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': '请先登录'}), 401
 
     try:
         limit = request.args.get('limit', 20, type=int)
-        offset = request.args.get('offset', 0, type=int)
-        limit = min(limit, 50)
+        limit = max(1, min(limit, 50))
 
-        diaries = get_user_diaries(session['user_id'], limit, offset)
-        total = get_diary_count(session['user_id'])
+        if 'cursor' in request.args:
+            page_cursor = request.args.get('cursor') or None
+            include_total = request.args.get('include_total', '0' if page_cursor else '1') == '1'
+            with unit_of_work() as uow:
+                try:
+                    diaries, next_cursor = get_user_diaries_by_cursor(
+                        session['user_id'], limit, page_cursor, uow=uow
+                    )
+                except ValueError:
+                    return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+                total = get_diary_count(session['user_id'], uow=uow) if include_total else None
+
+            return jsonify({
+                'success': True,
+                'diaries': diaries,
+                'total': total,
+                'limit': limit,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            })
+
+        offset = request.args.get('offset', 0, type=int)
+        with unit_of_work() as uow:
+            diaries = get_user_diaries(session['user_id'], limit, offset, uow=uow)
+            total = get_diary_count(session['user_id'], uow=uow)
 
         return jsonify({
             'success': True,
@@ -807,8 +836,8 @@ def api_diary_streak():
     if 'user_id' not in session:
         return jsonify({'streak': 0})
 
-    streak = get_diary_streak(session['user_id'])
-    return jsonify({'streak': streak})
+    stats = get_diary_stats(session['user_id'])
+    return jsonify({'streak': stats['streak'], 'longest_streak': stats['longest_streak']})
 
 
 # ==================== 目标管理 API 路由 ====================
@@ -821,8 +850,9 @@ def api_get_goals():
 
     try:
         status = request.args.get('status', 'active')
-        goals = get_user_goals(session['user_id'], status)
-        total = get_goal_count(session['user_id'], status)
+        with unit_of_work() as uow:
+            goals = get_user_goals(session['user_id'], status, uow=uow)
+            total = get_goal_count(session['user_id'], status, uow=uow)
 
         return jsonify({
             'success': True,
@@ -964,7 +994,7 @@ def handle_text_query():
             prof_result = get_user_personalization(user_id)
             if prof_result.get('success') and prof_result.get('data'):
                 row = prof_result['data']
-                learning_profile = sanitize_learning_profile(row.get('learning_profile_json'))
+                learning_profile = row.get('learning_profile') or {}
                 learning_profile_updated_at = row.get('learning_profile_updated_at')
                 session['learning_profile_updated_at'] = (
                     learning_profile_updated_at.isoformat()
@@ -1001,10 +1031,8 @@ def handle_text_query():
             'type': 'text_deep' if deep_think else 'text'  # 区分查询类型
         }
 
-        # Save session data temporarily (in production, use Redis or database)
-        os.makedirs('../data/sessions', exist_ok=True)
-        with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+        # Save session data (backend configured by SESSION_STORE)
+        get_session_store().save(session_id, session_data)
 
         # Return session ID for streaming
         return jsonify({
@@ -1016,6 +1044,14 @@ def handle_text_query():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def validate_image_upload(path):
+    """上传时只解析文件头校验图片，无效图片和解压炸弹在读完请求体之前即被拒绝"""
+    try:
+        probe_image(path)
+    except ImageValidationError as e:
+        raise UploadRejected(str(e)) from e
+
+
 @app.route('/api/query/image', methods=['POST'])
 def handle_image_query():
     """
@@ -1023,16 +1059,35 @@ def handle_image_query():
     支持深度思考模式（交叉验证）和流式响应
     """
     try:
-        # Check if images are in the request
-        files = request.files.getlist('image')
-        files = [f for f in files if f and f.filename]
-        if not files:
+        if request.mimetype != 'multipart/form-data':
             return jsonify({'error': 'No image provided'}), 400
-        question = (request.form.get('question', '') or '').strip()
-        subject = request.form.get('subject', 'physics')
-        deep_think = request.form.get('deep_think', 'false').lower() == 'true'  # 深度思考模式
-        level_override = normalize_level(request.form.get('level_override'))
-        use_profile_requested = (request.form.get('use_profile', 'true').lower() != 'false')
+        if request.content_length and request.content_length > MAX_CONTENT_LENGTH:
+            return jsonify({'error': f'Request too large (max {MAX_CONTENT_LENGTH // (1024 * 1024)}MB)'}), 413
+
+        # 边读取边写入磁盘并校验限制，不经过 request.files（见 upload_ingest.py）
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        try:
+            form, uploads = ingest_multipart(
+                request.stream,
+                request.mimetype_params.get('boundary'),
+                app.config['UPLOAD_FOLDER'],
+                timestamp,
+                allowed_file=allowed_file,
+                max_files=MAX_IMAGE_COUNT,
+                max_file_size=MAX_IMAGE_SIZE,
+                max_total_size=MAX_CONTENT_LENGTH,
+                validate_file=validate_image_upload,
+            )
+        except UploadRejected as e:
+            return jsonify({'error': e.message}), e.status
+        if not uploads:
+            return jsonify({'error': 'No image provided'}), 400
+
+        question = (form.get('question', '') or '').strip()
+        subject = form.get('subject', 'physics')
+        deep_think = form.get('deep_think', 'false').lower() == 'true'  # 深度思考模式
+        level_override = normalize_level(form.get('level_override'))
+        use_profile_requested = (form.get('use_profile', 'true').lower() != 'false')
 
         user_id = session.get('user_id')
         physics_score = session.get('physics_score')
@@ -1056,7 +1111,7 @@ def handle_image_query():
             prof_result = get_user_personalization(user_id)
             if prof_result.get('success') and prof_result.get('data'):
                 row = prof_result['data']
-                learning_profile = sanitize_learning_profile(row.get('learning_profile_json'))
+                learning_profile = row.get('learning_profile') or {}
                 learning_profile_updated_at = row.get('learning_profile_updated_at')
                 session['learning_profile_updated_at'] = (
                     learning_profile_updated_at.isoformat()
@@ -1064,27 +1119,14 @@ def handle_image_query():
                     else learning_profile_updated_at
                 )
 
-        if len(files) > MAX_IMAGE_COUNT:
-            return jsonify({'error': f'Too many images (max {MAX_IMAGE_COUNT})'}), 400
-
-        for file in files:
-            if not allowed_file(file.filename):
-                return jsonify({'error': 'File type not allowed'}), 400
-            file_size = get_upload_file_size(file)
-            if file_size > MAX_IMAGE_SIZE:
-                return jsonify({'error': f'File too large (max {MAX_IMAGE_SIZE // (1024 * 1024)}MB each)'}), 400
-
-        # Save the uploaded files
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        image_paths = []
-        image_filepaths = []
+        # 上传文件移入内容寻址存储（见 blob_store.py），相同图片只保存一份
+        blob_store = get_blob_store()
+        image_paths = [upload.filename for upload in uploads]
+        image_filepaths = [blob_store.put_file(upload.path, upload.sha256) for upload in uploads]
+        upload_hashes = [upload.sha256 for upload in uploads]
 
-        for index, file in enumerate(files, start=1):
-            filename = f"{timestamp}_{index}_{secure_filename(file.filename)}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            image_paths.append(filename)
-            image_filepaths.append(filepath)
+        # 立即在后台开始压缩，/api/stream 只需取用结果
+        image_hashes = doubao_client.preprocess_images(image_filepaths, upload_hashes)
 
         # Create session ID
         session_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
@@ -1117,13 +1159,14 @@ def handle_image_query():
             'image_filepath': image_filepaths[0] if image_filepaths else None,
             'image_paths': image_paths,
             'image_filepaths': image_filepaths,  # ???????????????????????????API??????
+            'image_hashes': image_hashes,
+            'upload_hashes': upload_hashes,
             'timestamp': str(datetime.now()),
             'type': 'image_deep' if deep_think else 'image_stream'  # ??????????????????
         }
 
-        os.makedirs('../data/sessions', exist_ok=True)
-        with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+        get_session_store().save(session_id, session_data)
+        blob_store.add_refs(session_id, upload_hashes, get_session_store().ttl)
 
         # ??????session ID??????????????????SSE??????????????????
         return jsonify({
@@ -1164,59 +1207,39 @@ def handle_base64_query():
             'type': 'image_base64'
         }
 
-        os.makedirs('../data/sessions', exist_ok=True)
-        with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+        get_session_store().save(session_id, session_data)
 
-        # Process base64 image and save temporarily
-        # Extract mime type and base64 data
-        if ',' in image_data:
-            header, base64_str = image_data.split(',', 1)
-            mime_type = header.split(':')[1].split(';')[0]
-            ext = mime_type.split('/')[1]
-        else:
-            base64_str = image_data
-            ext = 'jpg'
-
-        # Create temporary image file
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        temp_filename = f"temp_{timestamp}.{ext}"
-        temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
+        # 图片直接在内存中交给豆包客户端：不写临时文件；已是小尺寸 JPEG 时原样发送
+        if not image_data.startswith('data:'):
+            image_data = f"data:image/jpeg;base64,{image_data}"
 
         try:
-            # Decode and save image
-            with open(temp_filepath, 'wb') as f:
-                f.write(base64.b64decode(base64_str))
-
-            # Call Doubao API
             response = doubao_client.solve_with_image(
                 text=question,
-                image_path=temp_filepath,
+                image_path=image_data,
                 subject=subject,
                 stream=False,
                 enable_search=True
             )
+        except binascii.Error:
+            return jsonify({'error': 'Invalid base64 image data'}), 400
+        except ImageValidationError as e:
+            return jsonify({'error': str(e)}), 400
 
-            # Update session with response
-            session_data['answer'] = response.get('content', '')
-            session_data['usage'] = response.get('usage', {})
-            session_data['model'] = response.get('model', 'doubao-seed-1-6-251015')
+        # Update session with response
+        session_data['answer'] = response.get('content', '')
+        session_data['usage'] = response.get('usage', {})
+        session_data['model'] = response.get('model', 'doubao-seed-1-6-251015')
 
-            # Save updated session
-            with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, ensure_ascii=False, indent=2)
+        # Save updated session
+        get_session_store().save(session_id, session_data)
 
-            return jsonify({
-                'status': 'success',
-                'type': 'image_base64',
-                'session_id': session_id,
-                'redirect_url': f'/result/{session_id}'
-            })
-
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
+        return jsonify({
+            'status': 'success',
+            'type': 'image_base64',
+            'session_id': session_id,
+            'redirect_url': f'/result/{session_id}'
+        })
 
     except Exception as e:
         logger.error(f"Handle base64 query error: {e}")
@@ -1235,13 +1258,10 @@ def api_query_reveal():
         if not parent_session_id:
             return jsonify({'success': False, 'message': 'parent_session_id 不能为空'}), 400
 
-        parent_path = f'../data/sessions/{parent_session_id}.json'
-        if not os.path.exists(parent_path):
+        parent_data = get_session_store().load(parent_session_id)
+        if parent_data is None:
             return jsonify({'success': False, 'message': 'Session not found'}), 404
 
-        with open(parent_path, 'r', encoding='utf-8') as f:
-            parent_data = json.load(f)
-
         if parent_data.get('user_id') != session['user_id']:
             return jsonify({'success': False, 'message': 'Forbidden'}), 403
 
@@ -1253,9 +1273,11 @@ def api_query_reveal():
         new_data['parent_session_id'] = parent_session_id
         new_data['teaching_phase'] = 2
 
-        os.makedirs('../data/sessions', exist_ok=True)
-        with open(f'../data/sessions/{session_id}.json', 'w', encoding='utf-8') as f:
-            json.dump(new_data, f, ensure_ascii=False, indent=2)
+        get_session_store().save(session_id, new_data)
+        if new_data.get('upload_hashes'):
+            get_blob_store().add_refs(session_id, new_data['upload_hashes'], get_session_store().ttl)
+        else:
+            retain_uploads(new_data.get('image_filepaths'))
 
         return jsonify({'success': True, 'session_id': session_id, 'redirect_url': f'/result/{session_id}'})
     except Exception as e:
@@ -1267,411 +1289,337 @@ def api_query_reveal():
 def result_page(session_id):
     """Render the result page"""
     # Load session data
-    try:
-        with open(f'../data/sessions/{session_id}.json', 'r', encoding='utf-8') as f:
-            session_data = json.load(f)
-        return render_template('result.html', session_id=session_id, data=session_data)
-    except FileNotFoundError:
+    session_data = get_session_store().load(session_id)
+    if session_data is None:
         return "Session not found", 404
+    return render_template('result.html', session_id=session_id, data=session_data)
+
+def session_image_filepaths(session_data):
+    """session 引用的图片本地路径；内容寻址存储中的图片在本地缺失时从远程后端取回"""
+    upload_hashes = session_data.get('upload_hashes')
+    if upload_hashes:
+        blob_store = get_blob_store()
+        return [blob_store.local_path(digest) for digest in upload_hashes]
+    image_filepaths = session_data.get('image_filepaths') or []
+    if not image_filepaths and session_data.get('image_filepath'):
+        image_filepaths = [session_data.get('image_filepath')]
+    return image_filepaths
 
-# Streaming endpoint for DeepSeek and Doubao response
-@app.route('/api/stream/<session_id>', methods=['GET'])
-def stream_response(session_id):
-    """Stream response for both DeepSeek and Doubao queries with thinking process"""
+def ai_client(provider):
+    """ChatStream 使用的同步客户端（未配置时报错，错误信息见 user_facing_ai_error_message）"""
+    client = get_deepseek_client() if provider == 'deepseek' else doubao_client.client
+    if client is None:
+        raise _not_configured(provider)
+    return client
 
-    def generate():
-        lang = 'zh-CN'
-        try:
-            # Load session data
-            with open(f'../data/sessions/{session_id}.json', 'r', encoding='utf-8') as f:
-                session_data = json.load(f)
 
-            lang = session_data.get('lang', 'zh-CN')
-            query_type = session_data.get('type', 'text')
+def async_ai_client(provider):
+    """ChatStream 使用的 AsyncOpenAI 客户端（ASGI 入口，见 asgi.py）"""
+    client = get_async_deepseek_client() if provider == 'deepseek' else doubao_client.get_async_client()
+    if client is None:
+        raise _not_configured(provider)
+    return client
 
-            # ==================== 日记AI回复模式 ====================
-            if query_type == 'diary_ai_response':
-                yield from generate_diary_ai_response(session_id, session_data)
-                return
 
-            question = session_data['question']
-            subject = session_data['subject']
-            deep_think = session_data.get('deep_think', False)
+def _not_configured(provider):
+    if provider == 'deepseek':
+        return RuntimeError("DeepSeek is not configured (missing/placeholder DEEPSEEK_API_KEY)")
+    return RuntimeError("Doubao is not configured (missing DOUBAO_API_KEY)")
 
-            thinking_content = ""
-            answer_content = ""
 
-            # ==================== 深度思考模式（交叉验证） ====================
-            if query_type in ['text_deep', 'image_deep']:
-                yield from generate_deep_think_response(session_id, session_data)
-                return
+def event_stream(producer):
+    """把 producer（见 llm_stream.py）包装为 SSE 响应；ASGI 入口会改为在事件循环中执行"""
+    return Response(
+        EventStream(producer, ai_client, get_single_flight()),
+        mimetype='text/event-stream',
+        direct_passthrough=True
+    )
 
-            # ==================== 普通模式 ====================
 
-            # 图片流式查询 - 使用豆包API with reasoning
-            if query_type == 'image_stream':
-                image_filepaths = session_data.get('image_filepaths') or []
-                if not image_filepaths and session_data.get('image_filepath'):
-                    image_filepaths = [session_data.get('image_filepath')]
-                lang = session_data.get('lang', 'zh-CN')
-                level_effective = session_data.get('level_effective', 'standard')
-                teaching_phase = int(session_data.get('teaching_phase', 2))
-                subject_score = session_data.get('subject_score')
-                user_pref_level = session_data.get('level_override', 'auto')
-                profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
-
-                subject_prompt = get_subject_prompt_by_lang(subject, lang)
-                ctx = PromptContext(
-                    subject=subject,
-                    lang=lang,
-                    level=level_effective,
-                    phase=teaching_phase,
-                    score=subject_score,
-                    user_pref_level=user_pref_level,
-                    profile=profile or {},
-                    deep_think=False,
-                    has_image=True
-                )
-                system_prompt = build_system_prompt_doubao(subject_prompt, ctx)
-
-                # 使用豆包的流式响应（包含思考过程）
-                for event in doubao_client.stream_with_reasoning(
-                    text=question,
-                    image_paths=image_filepaths,
-                    subject=subject,
-                    system_prompt=system_prompt
-                ):
-                    if event.get('type') == 'thinking':
-                        thinking_content += event.get('content', '')
-                        yield f"data: {json.dumps({'type': 'thinking', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                    elif event.get('type') == 'answer':
-                        answer_content += event.get('content', '')
-                        yield f"data: {json.dumps({'type': 'answer', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                    elif event.get('type') == 'done':
-                        break
-
-                # Send completion signal
-                yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-
-                # Save the complete response
-                response_data = {
-                    'thinking': thinking_content,
-                    'answer': answer_content,
-                    'completed_at': str(datetime.now())
-                }
-                with open(f'../data/sessions/{session_id}_response.json', 'w', encoding='utf-8') as f:
-                    json.dump(response_data, f, ensure_ascii=False, indent=2)
-                return
-
-            # 旧版图片查询（已有答案的情况）
-            if query_type == 'image' and 'answer' in session_data:
-                # Stream the already available answer
-                answer = session_data['answer']
-
-                # Simulate thinking process for image queries
-                subject_text = "物理" if subject == 'physics' else "化学"
-                thinking = f"正在分析{subject_text}问题...\n"
-                if question:
-                    thinking += f"问题描述：{question}\n"
-                thinking += "识别图片中的关键信息...\n"
-                thinking += "应用相关原理进行分析...\n"
-
-                # Send thinking
-                for char in thinking:
-                    yield f"data: {json.dumps({'type': 'thinking', 'content': char}, ensure_ascii=False)}\n\n"
-                    time.sleep(0.01)  # Small delay for streaming effect
-
-                # Send answer
-                for char in answer:
-                    yield f"data: {json.dumps({'type': 'answer', 'content': char}, ensure_ascii=False)}\n\n"
-                    time.sleep(0.01)  # Small delay for streaming effect
-
-                # Send completion signal
-                yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-                return
+def run_answer_stream(session_id, session_data, producer):
+    """
+    运行回答 producer 并保存响应，结合回答缓存（见 answer_cache.py）和 single-flight（见 single_flight.py）
 
-            # For text-only queries, use DeepSeek streaming
-            lang = session_data.get('lang', 'zh-CN')
-            level_effective = session_data.get('level_effective', 'standard')
-            teaching_phase = int(session_data.get('teaching_phase', 2))
-            subject_score = session_data.get('subject_score')
-            user_pref_level = session_data.get('level_override', 'auto')
-            profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
-
-            subject_prompt = get_subject_prompt_by_lang(subject, lang)
-            ctx = PromptContext(
-                subject=subject,
-                lang=lang,
-                level=level_effective,
-                phase=teaching_phase,
-                score=subject_score,
-                user_pref_level=user_pref_level,
-                profile=profile or {},
-                deep_think=False,
-                has_image=False
-            )
-            system_prompt = build_system_prompt_deepseek(subject_prompt, ctx)
-
-            # Create messages for DeepSeek API
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ]
-
-            # Call DeepSeek API with streaming
-            deepseek_client = get_deepseek_client()
-            if not deepseek_client:
-                raise RuntimeError("DeepSeek is not configured (missing/placeholder DEEPSEEK_API_KEY)")
-
-            stream = deepseek_client.chat.completions.create(
-                model=get_deepseek_model(),
-                messages=messages,
-                stream=True,
-                extra_body={"thinking": {"type": "enabled"}}
-            )
+    producer(session_data) 逐个产出事件字典，结束时返回要保存的完整响应。
+    缓存命中（完全匹配或语义近似）时不调用模型，直接全速回放已保存的事件；
+    未命中时相同问题的并发请求共享一次上游生成，完整生成后写入缓存。
+    """
+    cache = get_answer_cache()
+    if cache is not None:
+        cache_key, entry, similarity = yield Blocking(cache.lookup, session_data)
+    else:
+        cache_key, entry, similarity = answer_cache_key(session_data), None, None
+
+    if entry is not None:
+        logger.info(f"Answer cache hit for session {session_id} (similarity {similarity})")
+        for event in entry['events']:
+            yield event
+        response_data = dict(entry['response'], cached=True, cache_similarity=similarity,
+                             completed_at=str(datetime.now()))
+        yield Blocking(get_session_store().save, response_key(session_id), response_data)
+        yield {'type': 'done', 'cached': True, 'similarity': similarity}
+        return
+
+    on_complete = None
+    if cache is not None:
+        def on_complete(events, response):
+            cache.store(session_data, cache_key, events, response)
+
+    if cache_key is not None:
+        response_data = yield Coalesce(cache_key, lambda: producer(session_data), on_complete)
+    else:
+        # 没有缓存 key（如图片未完成预处理）：不合并也不缓存
+        response_data = yield from producer(session_data)
+
+    response_data = dict(response_data or {}, completed_at=str(datetime.now()))
+    yield Blocking(get_session_store().save, response_key(session_id), response_data)
+    yield {'type': 'done'}
+
+
+def _prompt_context(session_data, deep_think, has_image):
+    lang = session_data.get('lang', 'zh-CN')
+    profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
+    return PromptContext(
+        subject=session_data['subject'],
+        lang=lang,
+        level=session_data.get('level_effective', 'standard'),
+        phase=int(session_data.get('teaching_phase', 2)),
+        score=session_data.get('subject_score'),
+        user_pref_level=session_data.get('level_override', 'auto'),
+        profile=profile or {},
+        deep_think=deep_think,
+        has_image=has_image
+    )
 
-            for chunk in stream:
-                delta = chunk.choices[0].delta
-
-                # Check if we have reasoning_content (thinking process)
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                    thinking_chunk = delta.reasoning_content
-                    thinking_content += thinking_chunk
-                    # Send thinking chunk
-                    yield f"data: {json.dumps({'type': 'thinking', 'content': thinking_chunk}, ensure_ascii=False)}\n\n"
-
-                # Check if we have content (final answer)
-                if delta.content:
-                    answer_chunk = delta.content
-                    answer_content += answer_chunk
-                    # Send answer chunk
-                    yield f"data: {json.dumps({'type': 'answer', 'content': answer_chunk}, ensure_ascii=False)}\n\n"
-
-            # Send completion signal
-            yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-
-            # Save the complete response
-            response_data = {
-                'thinking': thinking_content,
-                'answer': answer_content,
-                'completed_at': str(datetime.now())
-            }
-            with open(f'../data/sessions/{session_id}_response.json', 'w', encoding='utf-8') as f:
-                json.dump(response_data, f, ensure_ascii=False, indent=2)
-
-        except Exception as e:
-            logger.exception("Stream response error")
-            yield (
-                "data: "
-                + json.dumps(
-                    {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)},
-                    ensure_ascii=False,
-                )
-                + "\n\n"
-            )
 
-    return Response(generate(), mimetype='text/event-stream')
+def _doubao_chat(messages, thinking_type='thinking', answer_type='answer', **params):
+    """豆包流式调用（reasoning_content 为思考过程）"""
+    return ChatStream('doubao', dict({'model': doubao_client.model, 'messages': messages}, **params),
+                      thinking_type, answer_type)
 
 
-def generate_deep_think_response(session_id, session_data):
-    """
-    深度思考模式的流式响应生成器
-    采用交叉验证：
-    - 文本问题：DeepSeek解答 → 豆包验证
-    - 图片问题：豆包解答 → DeepSeek验证
-    """
-    question = session_data['question']
-    subject = session_data['subject']
-    query_type = session_data.get('type', 'text_deep')
-    image_filepaths = session_data.get('image_filepaths') or []
-    if not image_filepaths and session_data.get('image_filepath'):
-        image_filepaths = [session_data.get('image_filepath')]
-    lang = session_data.get('lang', 'zh-CN')  # 获取语言设置
+def _deepseek_chat(messages, thinking_type='thinking', answer_type='answer'):
+    """DeepSeek 流式调用（reasoning_content 为思考过程）"""
+    return ChatStream('deepseek', {
+        'model': get_deepseek_model(),
+        'messages': messages,
+        'extra_body': {"thinking": {"type": "enabled"}},
+    }, thinking_type, answer_type)
 
-    level_effective = session_data.get('level_effective', 'standard')
-    teaching_phase = int(session_data.get('teaching_phase', 2))
-    subject_score = session_data.get('subject_score')
-    user_pref_level = session_data.get('level_override', 'auto')
-    profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
 
-    solve_thinking = ""
-    solve_answer = ""
-    verify_thinking = ""
-    verify_answer = ""
+def _doubao_messages(**kwargs):
+    """豆包消息（含图片时需要编码图片，作为阻塞操作执行）"""
+    return Blocking(doubao_client.build_stream_messages, **kwargs)
 
-    try:
-        # ==================== 阶段1：解答问题 ====================
-        solving_msg = 'Deep analyzing problem...' if lang == 'en-US' else '正在深度分析问题...'
-        yield f"data: {json.dumps({'type': 'stage', 'stage': 'solving', 'message': solving_msg}, ensure_ascii=False)}\n\n"
 
-        if query_type == 'image_deep':
-            # 图片问题：使用豆包解答
-            logger.info(f"Deep think image query - Stage 1: Doubao solving")
+def _build_doubao_image_messages(session_data, **kwargs):
+    """解析 session 的图片路径（可能读写 SQLite 或从远程后端下载）并构造豆包消息"""
+    return doubao_client.build_stream_messages(
+        image_paths=session_image_filepaths(session_data),
+        image_hashes=session_data.get('image_hashes'),
+        **kwargs
+    )
 
-            subject_prompt = get_subject_prompt_by_lang(subject, lang)
-            solve_ctx = PromptContext(
-                subject=subject,
-                lang=lang,
-                level=level_effective,
-                phase=teaching_phase,
-                score=subject_score,
-                user_pref_level=user_pref_level,
-                profile=profile or {},
-                deep_think=True,
-                has_image=True
-            )
-            solve_system_prompt = build_system_prompt_doubao(subject_prompt, solve_ctx)
 
-            for event in doubao_client.stream_with_reasoning(
-                text=question if question else "请分析这张图片中的题目并详细解答",
-                image_paths=image_filepaths,
-                subject=subject,
-                system_prompt=solve_system_prompt
-            ):
-                if event.get('type') == 'thinking':
-                    solve_thinking += event.get('content', '')
-                    yield f"data: {json.dumps({'type': 'thinking', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                elif event.get('type') == 'answer':
-                    solve_answer += event.get('content', '')
-                    yield f"data: {json.dumps({'type': 'answer', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                elif event.get('type') == 'done':
-                    break
+def _doubao_image_messages(session_data, **kwargs):
+    """带 session 图片的豆包消息；路径解析和图片编码都在阻塞调用中执行，不占用事件循环"""
+    return Blocking(_build_doubao_image_messages, session_data, **kwargs)
 
-        else:
-            # 文本问题：使用DeepSeek解答
-            logger.info(f"Deep think text query - Stage 1: DeepSeek solving")
 
-            subject_prompt = get_subject_prompt_by_lang(subject, lang)
-            solve_ctx = PromptContext(
-                subject=subject,
-                lang=lang,
-                level=level_effective,
-                phase=teaching_phase,
-                score=subject_score,
-                user_pref_level=user_pref_level,
-                profile=profile or {},
-                deep_think=True,
-                has_image=False
-            )
-            solve_system_prompt = build_system_prompt_deepseek(subject_prompt, solve_ctx)
-
-            messages = [
-                {"role": "system", "content": solve_system_prompt},
-                {"role": "user", "content": question}
-            ]
-
-            deepseek_client = get_deepseek_client()
-            if not deepseek_client:
-                raise RuntimeError("DeepSeek is not configured (missing/placeholder DEEPSEEK_API_KEY)")
-
-            stream = deepseek_client.chat.completions.create(
-                model=get_deepseek_model(),
-                messages=messages,
-                stream=True,
-                extra_body={"thinking": {"type": "enabled"}}
-            )
+def generate_image_stream_response(session_data):
+    """图片流式查询 - 使用豆包API with reasoning；返回完整响应"""
+    subject = session_data['subject']
+    lang = session_data.get('lang', 'zh-CN')
+    ctx = _prompt_context(session_data, deep_think=False, has_image=True)
+    system_prompt = build_system_prompt_doubao(get_subject_prompt_by_lang(subject, lang), ctx)
+
+    messages = yield _doubao_image_messages(
+        session_data,
+        text=session_data['question'],
+        subject=subject,
+        system_prompt=system_prompt
+    )
+    contents = yield _doubao_chat(messages, max_tokens=4096)
+    return {'thinking': contents['thinking'], 'answer': contents['answer']}
 
-            for chunk in stream:
-                delta = chunk.choices[0].delta
 
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                    solve_thinking += delta.reasoning_content
-                    yield f"data: {json.dumps({'type': 'thinking', 'content': delta.reasoning_content}, ensure_ascii=False)}\n\n"
+def generate_text_stream_response(session_data):
+    """文本查询 - 使用DeepSeek streaming；返回完整响应"""
+    subject = session_data['subject']
+    lang = session_data.get('lang', 'zh-CN')
+    ctx = _prompt_context(session_data, deep_think=False, has_image=False)
+    system_prompt = build_system_prompt_deepseek(get_subject_prompt_by_lang(subject, lang), ctx)
 
-                if delta.content:
-                    solve_answer += delta.content
-                    yield f"data: {json.dumps({'type': 'answer', 'content': delta.content}, ensure_ascii=False)}\n\n"
+    # Create messages for DeepSeek API
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": session_data['question']}
+    ]
 
-        # ==================== 阶段2：交叉验证答案 ====================
-        verifying_msg = 'Verifying answer...' if lang == 'en-US' else '正在验证答案...'
-        yield f"data: {json.dumps({'type': 'stage', 'stage': 'verifying', 'message': verifying_msg}, ensure_ascii=False)}\n\n"
+    contents = yield _deepseek_chat(messages)
+    return {'thinking': contents['thinking'], 'answer': contents['answer']}
 
-        # 构造验证提示词（支持多语言）
-        verification_prompt = get_verification_prompt_by_lang(subject, question, solve_answer, lang)
 
-        if query_type == 'image_deep':
-            # 图片问题：使用DeepSeek验证（交叉验证）
-            logger.info(f"Deep think image query - Stage 2: DeepSeek verifying")
+def generate_legacy_image_response(session_data):
+    """旧版图片查询（已有答案的情况）：模拟思考过程后逐字输出已有答案"""
+    question = session_data['question']
+    answer = session_data['answer']
+
+    # Simulate thinking process for image queries
+    subject_text = "物理" if session_data['subject'] == 'physics' else "化学"
+    thinking = f"正在分析{subject_text}问题...\n"
+    if question:
+        thinking += f"问题描述：{question}\n"
+    thinking += "识别图片中的关键信息...\n"
+    thinking += "应用相关原理进行分析...\n"
+
+    # Send thinking
+    for char in thinking:
+        yield {'type': 'thinking', 'content': char}
+        yield Sleep(0.01)  # Small delay for streaming effect
+
+    # Send answer
+    for char in answer:
+        yield {'type': 'answer', 'content': char}
+        yield Sleep(0.01)  # Small delay for streaming effect
+    return None
+
+
+def stream_session_answer(session_id):
+    """/api/stream/<session_id> 的 producer：按会话类型生成回答并保存"""
+    lang = 'zh-CN'
+    try:
+        # Load session data
+        session_data = yield Blocking(get_session_store().load, session_id)
+        if session_data is None:
+            yield {'type': 'error', 'message': 'Session not found'}
+            return
+
+        lang = session_data.get('lang', 'zh-CN')
+        query_type = session_data.get('type', 'text')
+
+        # ==================== 日记AI回复模式 ====================
+        if query_type == 'diary_ai_response':
+            response_data = yield from generate_diary_ai_response(session_data)
+            if response_data is not None:
+                # 保存到session文件
+                response_data['completed_at'] = str(datetime.now())
+                yield Blocking(get_session_store().save, response_key(session_id), response_data)
+            return
+
+        # 旧版图片查询（已有答案的情况），答案已保存，无需再次保存
+        if query_type == 'image' and 'answer' in session_data:
+            yield from generate_legacy_image_response(session_data)
+            yield {'type': 'done'}
+            return
+
+        if query_type in ['text_deep', 'image_deep']:
+            # 深度思考模式（交叉验证）
+            producer = generate_deep_think_response
+        elif query_type == 'image_stream':
+            # 图片流式查询 - 使用豆包API with reasoning
+            producer = generate_image_stream_response
+        else:
+            # For text-only queries, use DeepSeek streaming
+            producer = generate_text_stream_response
+        yield from run_answer_stream(session_id, session_data, producer)
 
-            verify_system_msg = "You are a rigorous science review expert. Please independently verify the correctness of the solution." if lang == 'en-US' else "你是一位严谨的理科审稿专家，请独立验证解答的正确性。"
-            messages = [
-                {"role": "system", "content": verify_system_msg},
-                {"role": "user", "content": verification_prompt}
-            ]
+    except Exception as e:
+        logger.exception("Stream response error")
+        yield {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)}
 
-            deepseek_client = get_deepseek_client()
-            if not deepseek_client:
-                raise RuntimeError("DeepSeek is not configured (missing/placeholder DEEPSEEK_API_KEY)")
 
-            stream = deepseek_client.chat.completions.create(
-                model=get_deepseek_model(),
-                messages=messages,
-                stream=True,
-                extra_body={"thinking": {"type": "enabled"}}
-            )
+# Streaming endpoint for DeepSeek and Doubao response
+@app.route('/api/stream/<session_id>', methods=['GET'])
+def stream_response(session_id):
+    """Stream response for both DeepSeek and Doubao queries with thinking process"""
+    return event_stream(stream_session_answer(session_id))
 
-            for chunk in stream:
-                delta = chunk.choices[0].delta
 
-                if hasattr(delta, 'reasoning_content') and delta.reasoning_content:
-                    verify_thinking += delta.reasoning_content
-                    yield f"data: {json.dumps({'type': 'verify_thinking', 'content': delta.reasoning_content}, ensure_ascii=False)}\n\n"
+def generate_deep_think_response(session_data):
+    """
+    深度思考模式的 producer，返回完整响应
+    采用交叉验证：
+    - 文本问题：DeepSeek解答 → 豆包验证
+    - 图片问题：豆包解答 → DeepSeek验证
+    """
+    question = session_data['question']
+    subject = session_data['subject']
+    query_type = session_data.get('type', 'text_deep')
+    lang = session_data.get('lang', 'zh-CN')  # 获取语言设置
 
-                if delta.content:
-                    verify_answer += delta.content
-                    yield f"data: {json.dumps({'type': 'verify_answer', 'content': delta.content}, ensure_ascii=False)}\n\n"
+    # ==================== 阶段1：解答问题 ====================
+    solving_msg = 'Deep analyzing problem...' if lang == 'en-US' else '正在深度分析问题...'
+    yield {'type': 'stage', 'stage': 'solving', 'message': solving_msg}
+
+    subject_prompt = get_subject_prompt_by_lang(subject, lang)
+    if query_type == 'image_deep':
+        # 图片问题：使用豆包解答
+        logger.info(f"Deep think image query - Stage 1: Doubao solving")
+
+        solve_ctx = _prompt_context(session_data, deep_think=True, has_image=True)
+        messages = yield _doubao_image_messages(
+            session_data,
+            text=question if question else "请分析这张图片中的题目并详细解答",
+            subject=subject,
+            system_prompt=build_system_prompt_doubao(subject_prompt, solve_ctx)
+        )
+        solved = yield _doubao_chat(messages, max_tokens=4096)
 
-        else:
-            # 文本问题：使用豆包验证（交叉验证）
-            logger.info(f"Deep think text query - Stage 2: Doubao verifying")
+    else:
+        # 文本问题：使用DeepSeek解答
+        logger.info(f"Deep think text query - Stage 1: DeepSeek solving")
 
-            verify_system_prompt = build_verifier_system_prompt(subject, lang)
+        solve_ctx = _prompt_context(session_data, deep_think=True, has_image=False)
+        messages = [
+            {"role": "system", "content": build_system_prompt_deepseek(subject_prompt, solve_ctx)},
+            {"role": "user", "content": question}
+        ]
+        solved = yield _deepseek_chat(messages)
 
-            for event in doubao_client.stream_with_reasoning(
-                text=verification_prompt,
-                image_paths=None,  # 验证阶段不需要图片
-                subject=subject,
-                system_prompt=verify_system_prompt
-            ):
-                if event.get('type') == 'thinking':
-                    verify_thinking += event.get('content', '')
-                    yield f"data: {json.dumps({'type': 'verify_thinking', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                elif event.get('type') == 'answer':
-                    verify_answer += event.get('content', '')
-                    yield f"data: {json.dumps({'type': 'verify_answer', 'content': event.get('content', '')}, ensure_ascii=False)}\n\n"
-                elif event.get('type') == 'done':
-                    break
+    # ==================== 阶段2：交叉验证答案 ====================
+    verifying_msg = 'Verifying answer...' if lang == 'en-US' else '正在验证答案...'
+    yield {'type': 'stage', 'stage': 'verifying', 'message': verifying_msg}
 
-        # ==================== 完成 ====================
-        yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
-
-        # 保存完整响应
-        response_data = {
-            'deep_think': True,
-            'solve_thinking': solve_thinking,
-            'solve_answer': solve_answer,
-            'verify_thinking': verify_thinking,
-            'verify_answer': verify_answer,
-            'completed_at': str(datetime.now())
-        }
-        with open(f'../data/sessions/{session_id}_response.json', 'w', encoding='utf-8') as f:
-            json.dump(response_data, f, ensure_ascii=False, indent=2)
+    # 构造验证提示词（支持多语言）
+    verification_prompt = get_verification_prompt_by_lang(subject, question, solved['answer'], lang)
 
-    except Exception as e:
-        logger.exception("Deep think stream error")
-        yield (
-            "data: "
-            + json.dumps(
-                {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)},
-                ensure_ascii=False,
-            )
-            + "\n\n"
+    if query_type == 'image_deep':
+        # 图片问题：使用DeepSeek验证（交叉验证）
+        logger.info(f"Deep think image query - Stage 2: DeepSeek verifying")
+
+        verify_system_msg = "You are a rigorous science review expert. Please independently verify the correctness of the solution." if lang == 'en-US' else "你是一位严谨的理科审稿专家，请独立验证解答的正确性。"
+        messages = [
+            {"role": "system", "content": verify_system_msg},
+            {"role": "user", "content": verification_prompt}
+        ]
+        verified = yield _deepseek_chat(messages, 'verify_thinking', 'verify_answer')
+
+    else:
+        # 文本问题：使用豆包验证（交叉验证）
+        logger.info(f"Deep think text query - Stage 2: Doubao verifying")
+
+        messages = yield _doubao_messages(
+            text=verification_prompt,
+            image_paths=None,  # 验证阶段不需要图片
+            subject=subject,
+            system_prompt=build_verifier_system_prompt(subject, lang)
         )
+        verified = yield _doubao_chat(messages, 'verify_thinking', 'verify_answer', max_tokens=4096)
+
+    # ==================== 完成 ====================
+    return {
+        'deep_think': True,
+        'solve_thinking': solved['thinking'],
+        'solve_answer': solved['answer'],
+        'verify_thinking': verified['thinking'],
+        'verify_answer': verified['answer'],
+    }
 
 
-def generate_diary_ai_response(session_id, session_data):
+def generate_diary_ai_response(session_data):
     """
-    日记AI回复的流式响应生成器 (使用豆包模型)
+    日记AI回复的 producer (使用豆包模型)，返回要保存的响应；出错时发送错误事件并返回 None
     支持双重回复：情感回复 + 目标进度分析（可选）
 
     SSE事件类型：
@@ -1688,14 +1636,13 @@ def generate_diary_ai_response(session_id, session_data):
     history_range = session_data.get('history_range')  # 7, 30, or None
     lang = session_data.get('lang', 'zh-CN')  # 获取语言设置
 
-    emotional_response = ""
     goal_analysis_response = ""
 
     try:
         # ==================== 获取历史日记（情感回复也需要） ====================
         recent_diaries = []
         if user_id:
-            recent_diaries = get_recent_diaries(user_id, days=history_range or 7, limit=10)
+            recent_diaries = yield Blocking(get_recent_diaries, user_id, days=history_range or 7, limit=10)
 
         # 构建历史日记摘要
         diary_summaries = []
@@ -1711,7 +1658,7 @@ def generate_diary_ai_response(session_id, session_data):
 
         # ==================== 阶段1：情感回复 ====================
         stage_message = 'Xiao Ke is thinking...' if lang == 'en-US' else '小柯正在思考回复...'
-        yield f"data: {json.dumps({'type': 'stage', 'stage': 'emotional', 'message': stage_message}, ensure_ascii=False)}\n\n"
+        yield {'type': 'stage', 'stage': 'emotional', 'message': stage_message}
 
         # 情感回复系统提示词（优化版 - 更自然，接入历史日记）
         if lang == 'en-US':
@@ -1789,29 +1736,19 @@ Please respond warmly to this entry."""
         ]
 
         # 使用豆包模型进行情感回复
-        stream = doubao_client.client.chat.completions.create(
-            model=doubao_client.model,
-            messages=messages,
-            stream=True,
-            max_tokens=500
-        )
-
-        for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                content_chunk = chunk.choices[0].delta.content
-                emotional_response += content_chunk
-                yield f"data: {json.dumps({'type': 'emotional', 'content': content_chunk}, ensure_ascii=False)}\n\n"
+        emotional = yield _doubao_chat(messages, None, 'emotional', max_tokens=500)
+        emotional_response = emotional['answer']
 
         # 保存情感回复到数据库
-        update_diary_ai_response(diary_id, emotional_response)
+        yield Blocking(update_diary_ai_response, diary_id, emotional_response)
 
         # ==================== 阶段2：目标进度分析（可选） ====================
         if enable_goal_analysis and user_id:
-            goals = get_user_goals(user_id, 'active')
+            goals = yield Blocking(get_user_goals, user_id, 'active')
 
             if goals:
                 stage_msg = 'Analyzing goal progress...' if lang == 'en-US' else '正在分析目标进度...'
-                yield f"data: {json.dumps({'type': 'stage', 'stage': 'goal_analysis', 'message': stage_msg}, ensure_ascii=False)}\n\n"
+                yield {'type': 'stage', 'stage': 'goal_analysis', 'message': stage_msg}
 
                 # 构建目标列表
                 goals_text = "\n".join([
@@ -1820,7 +1757,7 @@ Please respond warmly to this entry."""
                 ])
 
                 # 扩展历史日记范围用于目标分析
-                extended_diaries = get_recent_diaries(user_id, days=history_range, limit=30)
+                extended_diaries = yield Blocking(get_recent_diaries, user_id, days=history_range, limit=30)
                 extended_summaries = []
                 for d in extended_diaries:
                     if d['id'] != diary_id:
@@ -1916,44 +1853,25 @@ Keep each analysis under 80 words. Be specific, not generic."""
                 ]
 
                 # 使用豆包模型进行目标分析
-                stream = doubao_client.client.chat.completions.create(
-                    model=doubao_client.model,
-                    messages=messages,
-                    stream=True
-                )
-
-                for chunk in stream:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        content_chunk = chunk.choices[0].delta.content
-                        goal_analysis_response += content_chunk
-                        yield f"data: {json.dumps({'type': 'goal_analysis', 'content': content_chunk}, ensure_ascii=False)}\n\n"
+                analysis = yield _doubao_chat(messages, None, 'goal_analysis')
+                goal_analysis_response = analysis['answer']
 
                 # 保存目标分析到数据库
-                update_diary_goal_analysis(diary_id, goal_analysis_response)
+                yield Blocking(update_diary_goal_analysis, diary_id, goal_analysis_response)
 
         # ==================== 完成 ====================
-        yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
+        yield {'type': 'done'}
 
-        # 保存到session文件
-        response_data = {
+        return {
             'emotional_response': emotional_response,
             'goal_analysis_response': goal_analysis_response if goal_analysis_response else None,
             'ai_response': emotional_response,  # 兼容旧版
-            'completed_at': str(datetime.now())
         }
-        with open(f'../data/sessions/{session_id}_response.json', 'w', encoding='utf-8') as f:
-            json.dump(response_data, f, ensure_ascii=False, indent=2)
 
     except Exception as e:
         logger.exception("Diary AI response error")
-        yield (
-            "data: "
-            + json.dumps(
-                {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)},
-                ensure_ascii=False,
-            )
-            + "\n\n"
-        )
+        yield {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)}
+        return None
 
 
 # ==================== 追问对话API ====================
@@ -1971,127 +1889,105 @@ def chat_followup():
     if not session_id or not message:
         return jsonify({'success': False, 'message': '缺少必要参数'}), 400
 
-    def generate():
-        lang = 'zh-CN'
-        try:
-            # 读取原始会话数据
-            session_file = f'../data/sessions/{session_id}.json'
-            response_file = f'../data/sessions/{session_id}_response.json'
-
-            with open(session_file, 'r', encoding='utf-8') as f:
-                session_data = json.load(f)
+    # 流在请求上下文之外执行，登录用户需要在这里取出
+    return event_stream(followup_stream(session['user_id'], session_id, message, history))
 
-            if session_data.get('user_id') != session.get('user_id'):
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Forbidden'})}\n\n"
-                return
 
-            # 读取原始答案
-            original_answer = ''
-            try:
-                with open(response_file, 'r', encoding='utf-8') as f:
-                    response_data = json.load(f)
-                    original_answer = (
-                        response_data.get('answer')
-                        or response_data.get('solve_answer')
-                        or response_data.get('ai_response')
-                        or ''
-                    )
-            except FileNotFoundError:
-                pass
-
-            subject = session_data.get('subject', 'physics')
-            question = session_data.get('question', '')
-            lang = session_data.get('lang', 'zh-CN')
-            deep_think = bool(session_data.get('deep_think', False))
-            level_effective = session_data.get('level_effective', 'standard')
-            teaching_phase = int(session_data.get('teaching_phase', 2))
-            subject_score = session_data.get('subject_score')
-            user_pref_level = session_data.get('level_override', 'auto')
-            profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
-            has_image = str(session_data.get('type', '')).startswith('image')
-
-            subject_prompt = get_subject_prompt_by_lang(subject, lang)
-            ctx = PromptContext(
-                subject=subject,
-                lang=lang,
-                level=level_effective,
-                phase=teaching_phase,
-                score=subject_score,
-                user_pref_level=user_pref_level,
-                profile=profile or {},
-                deep_think=deep_think,
-                has_image=has_image
+def followup_stream(user_id, session_id, message, history):
+    """追问对话的 producer"""
+    lang = 'zh-CN'
+    try:
+        # 读取原始会话数据
+        store = get_session_store()
+        session_data = yield Blocking(store.load, session_id)
+        if session_data is None:
+            yield {'type': 'error', 'message': 'Session not found'}
+            return
+
+        if session_data.get('user_id') != user_id:
+            yield {'type': 'error', 'message': 'Forbidden'}
+            return
+
+        # 读取原始答案
+        original_answer = ''
+        response_data = yield Blocking(store.load, response_key(session_id))
+        if response_data:
+            original_answer = (
+                response_data.get('answer')
+                or response_data.get('solve_answer')
+                or response_data.get('ai_response')
+                or ''
             )
 
-            base_system_prompt = (
-                build_system_prompt_doubao(subject_prompt, ctx)
-                if has_image
-                else build_system_prompt_deepseek(subject_prompt, ctx)
-            )
-            followup_rules = (
-                "\n\n【追问规则】\n"
-                "1) 必须保持与当前 level/phase 一致。\n"
-                "2) 若 level=basic 且 phase=1：继续引导完成，禁止给最终答案/数值/选项。\n"
-                "3) 只回答追问所需部分，尽量简洁；公式用 LaTeX。\n"
-            ) if lang != 'en-US' else (
-                "\n\n[Follow-up rules]\n"
-                "1) Keep the same level/phase.\n"
-                "2) If level=basic and phase=1: keep guiding; do NOT reveal the final answer/value/option.\n"
-                "3) Answer only what is needed; keep it concise; use LaTeX.\n"
-            )
+        subject = session_data.get('subject', 'physics')
+        question = session_data.get('question', '')
+        lang = session_data.get('lang', 'zh-CN')
+        deep_think = bool(session_data.get('deep_think', False))
+        level_effective = session_data.get('level_effective', 'standard')
+        teaching_phase = int(session_data.get('teaching_phase', 2))
+        subject_score = session_data.get('subject_score')
+        user_pref_level = session_data.get('level_override', 'auto')
+        profile = session_data.get('learning_profile') if session_data.get('use_profile_effective') else {}
+        has_image = str(session_data.get('type', '')).startswith('image')
+
+        subject_prompt = get_subject_prompt_by_lang(subject, lang)
+        ctx = PromptContext(
+            subject=subject,
+            lang=lang,
+            level=level_effective,
+            phase=teaching_phase,
+            score=subject_score,
+            user_pref_level=user_pref_level,
+            profile=profile or {},
+            deep_think=deep_think,
+            has_image=has_image
+        )
 
-            system_prompt = (
-                base_system_prompt
-                + followup_rules
-                + (f"\n\n【原始问题】\n{question[:1200]}\n\n【你之前的输出】\n{original_answer[:2400]}\n"
-                   if lang != 'en-US'
-                   else f"\n\n[Original question]\n{question[:1200]}\n\n[Your prior output]\n{original_answer[:2400]}\n")
-            )
+        base_system_prompt = (
+            build_system_prompt_doubao(subject_prompt, ctx)
+            if has_image
+            else build_system_prompt_deepseek(subject_prompt, ctx)
+        )
+        followup_rules = (
+            "\n\n【追问规则】\n"
+            "1) 必须保持与当前 level/phase 一致。\n"
+            "2) 若 level=basic 且 phase=1：继续引导完成，禁止给最终答案/数值/选项。\n"
+            "3) 只回答追问所需部分，尽量简洁；公式用 LaTeX。\n"
+        ) if lang != 'en-US' else (
+            "\n\n[Follow-up rules]\n"
+            "1) Keep the same level/phase.\n"
+            "2) If level=basic and phase=1: keep guiding; do NOT reveal the final answer/value/option.\n"
+            "3) Answer only what is needed; keep it concise; use LaTeX.\n"
+        )
 
-            messages = [{"role": "system", "content": system_prompt}]
+        system_prompt = (
+            base_system_prompt
+            + followup_rules
+            + (f"\n\n【原始问题】\n{question[:1200]}\n\n【你之前的输出】\n{original_answer[:2400]}\n"
+               if lang != 'en-US'
+               else f"\n\n[Original question]\n{question[:1200]}\n\n[Your prior output]\n{original_answer[:2400]}\n")
+        )
 
-            # 添加历史对话（最近10轮）
-            for h in history[-10:]:
-                messages.append({"role": h.get("role", "user"), "content": h.get("content", "")})
+        messages = [{"role": "system", "content": system_prompt}]
 
-            # 添加当前追问
-            messages.append({"role": "user", "content": message})
+        # 添加历史对话（最近10轮）
+        for h in history[-10:]:
+            messages.append({"role": h.get("role", "user"), "content": h.get("content", "")})
 
-            # 优先使用 DeepSeek（文字题追问更一致），否则回退到豆包
-            deepseek_client = get_deepseek_client()
-            if not has_image and deepseek_client:
-                stream = deepseek_client.chat.completions.create(
-                    model=get_deepseek_model(),
-                    messages=messages,
-                    stream=True,
-                    extra_body={"thinking": {"type": "enabled"}}
-                )
-                for chunk in stream:
-                    delta = chunk.choices[0].delta
-                    if getattr(delta, 'content', None):
-                        yield f"data: {json.dumps({'type': 'content', 'content': delta.content}, ensure_ascii=False)}\n\n"
-            else:
-                stream = doubao_client.client.chat.completions.create(
-                    model=doubao_client.model,
-                    messages=messages,
-                    stream=True
-                )
-                for chunk in stream:
-                    if chunk.choices and chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        yield f"data: {json.dumps({'type': 'content', 'content': content}, ensure_ascii=False)}\n\n"
-
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-
-        except Exception as e:
-            logger.exception("Follow-up chat error")
-            yield (
-                "data: "
-                + json.dumps({'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)}, ensure_ascii=False)
-                + "\n\n"
-            )
+        # 添加当前追问
+        messages.append({"role": "user", "content": message})
 
-    return Response(generate(), mimetype='text/event-stream')
+        # 优先使用 DeepSeek（文字题追问更一致），否则回退到豆包（只转发答案，不转发思考过程）
+        if not has_image and get_deepseek_client():
+            yield _deepseek_chat(messages, None, 'content')
+        else:
+            yield _doubao_chat(messages, None, 'content')
+
+        yield {'type': 'done'}
+
+    except Exception as e:
+        logger.exception("Follow-up chat error")
+        yield {'type': 'error', 'message': user_facing_ai_error_message(e, lang=lang)}
 
 
 @app.route('/health', methods=['GET'])
@@ -2127,6 +2023,8 @@ def ai_health_check():
         }
     }
 
+    data['pools'] = get_ai_clients().stats()
+
     if probe:
         if not deepseek_client:
             data['deepseek']['probe'] = 'skipped'
@@ -2151,14 +2049,37 @@ def ai_health_check():
 
     return jsonify({'success': True, 'data': data})
 
+
+@app.route('/api/health/db', methods=['GET'])
+def db_health_check():
+    """Database connection pool and cache statistics (no secrets)."""
+    return jsonify({'success': True, 'data': {
+        'pool': get_pool_stats(),
+        'personalization_cache': get_personalization_cache_stats(),
+        'session_store': get_session_store().stats(),
+        'retention': get_retention_stats(),
+        'image_cache': get_image_cache().stats(),
+        'blob_store': get_blob_store().stats(),
+        'image_payload': get_payload_stats(),
+        'phash_index': get_phash_index().stats(),
+        'answer_cache': get_answer_cache().stats() if get_answer_cache() is not None else None,
+        'single_flight': get_single_flight().stats() if get_single_flight() is not None else None,
+    }})
+
+
+def start_background_workers():
+    """启动后台任务（由服务入口调用，导入 app 模块时不会启动）"""
+    start_retention_worker(get_session_store(), app.config['UPLOAD_FOLDER'], get_blob_store())
+
 if __name__ == '__main__':
-    # 初始化数据库
+    # 检查数据库结构版本
     try:
         init_database()
-        logger.info("Database initialized")
     except Exception as e:
         logger.warning(f"Database initialization skipped: {e}")
 
+    start_background_workers()
+
     # 生产环境通过环境变量控制 debug 模式
     debug_mode = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
     port = int(os.getenv('PORT', 5000))
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 入口 - 流式回答在事件循环中执行，其余路由仍由 Flask 处理
+
+waitress 每个 SSE 连接占用一个线程（THREADS=8），几个持续数分钟的深度思考流就会占满线程，
+登录等普通请求只能排队。这里把 Flask 应用包装为 ASGI 应用：
+- 每个请求先在线程池中交给 Flask 的 wsgi_app 处理，认证、session、CORS、after_request 等逻辑不变
+- 视图返回 EventStream（见 llm_stream.py）时，不再在线程中迭代，而是用 AsyncOpenAI 在事件循环中执行 producer，
+  线程立即归还；数千个并发 SSE 连接共享一个事件循环，只有数据库等阻塞操作短暂借用线程
+- 客户端断开时取消该连接的流；合并中的生成（AsyncSingleFlight）继续完成并写入回答缓存
+
+只依赖标准库，可由任意 ASGI 服务器运行（见 run_asgi.py，使用 uvicorn）：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+AsyncOpenAI 客户端和 AsyncSingleFlight 绑定事件循环，每个进程只运行一个事件循环（多进程时每个 worker 各自一份）。
+
+配置（环境变量）：
+- ASGI_WSGI_THREADS: 执行 Flask 视图和普通响应体的线程数，默认 32
+- ASGI_BODY_MEMORY_LIMIT: 请求体超过该字节数时写入临时文件，默认 1MB
+- ASGI_MAX_STREAMS: 每个服务商同时进行的上游流式调用上限，默认 1000
+
+连接池按 ASGI 路径的并发度设置默认值（见 configure_pool_defaults，只在未显式配置时生效）：
+- AI_MAX_CONNECTIONS 默认 ASGI_MAX_STREAMS：没有 h2 时每个 SSE 流独占一条 HTTP/1.1 连接，
+  超过上限的流等待 AI_POOL_TIMEOUT 后报错；AI_MAX_KEEPALIVE 默认取其四分之一
+- MYSQL_POOL_SIZE 默认 ASGI_WSGI_THREADS 加上 asyncio.to_thread 默认线程池的大小，
+  每个可能同时访问数据库的线程都能拿到连接（waitress 路径仍默认与 THREADS 相同）
+
+请求体上限取 Flask 的 MAX_CONTENT_LENGTH：Content-Length 超限或读取中超限时直接返回 413，
+不继续缓冲；请求体读完之前客户端断开时丢弃该请求，不把不完整的请求体交给视图。
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_stream import EventStream, adrive, sse_event
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class _RequestAborted(Exception):
+    """请求体读取中止：超过上限（status=413）或客户端断开（status=None）"""
+
+    def __init__(self, status=None):
+        super().__init__(status)
+        self.status = status
+
+
+class ASGIBridge:
+    """把 WSGI 应用包装为 ASGI 应用，EventStream 响应体在事件循环中执行"""
+
+    def __init__(self, wsgi_app, resolve_client, threads=32, flights_factory=None, body_memory_limit=1024 * 1024,
+                 max_body_size=None):
+        """
+        Args:
+            wsgi_app: WSGI 应用（Flask 的 app.wsgi_app）
+            resolve_client: provider 名称 -> AsyncOpenAI 兼容客户端
+            threads: 执行 WSGI 应用的线程数
+            flights_factory: 无参函数，返回 AsyncSingleFlight 或 None（在事件循环中首次使用时调用）
+            body_memory_limit: 请求体在内存中缓冲的最大字节数
+            max_body_size: 请求体最大字节数，超过时返回 413；None 表示不限
+        """
+        self.wsgi_app = wsgi_app
+        self.resolve_client = resolve_client
+        self.flights_factory = flights_factory
+        self.body_memory_limit = int(body_memory_limit)
+        self.max_body_size = int(max_body_size) if max_body_size else None
+        self.executor = ThreadPoolExecutor(max_workers=int(threads), thread_name_prefix='asgi-wsgi')
+        self._flights = (None, None)  # (事件循环, AsyncSingleFlight)
+        self._stats = {
+            'requests': 0, 'event_streams': 0, 'active_event_streams': 0, 'disconnects': 0,
+            'rejected_bodies': 0, 'aborted_requests': 0,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        self._stats['requests'] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            body = await self._read_body(scope, receive)
+        except _RequestAborted as e:
+            if e.status is None:
+                self._stats['aborted_requests'] += 1
+                return
+            self._stats['rejected_bodies'] += 1
+            await self._reject(send, e.status, f'Request too large (max {self.max_body_size} bytes)')
+            return
+        try:
+            environ = self._environ(scope, body)
+            started, body_iter, written = await loop.run_in_executor(self.executor, self._call_wsgi, environ)
+        finally:
+            body.close()
+
+        status, headers = started
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        for chunk in written:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        if isinstance(body_iter, EventStream):
+            await self._event_stream(body_iter, receive, send)
+        else:
+            await self._wsgi_body(loop, body_iter, send)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def _read_body(self, scope, receive):
+        """读取完整请求体；超过 max_body_size 或客户端中途断开时抛出 _RequestAborted"""
+        if self.max_body_size is not None:
+            for name, value in scope.get('headers', ()):
+                if name.lower() == b'content-length' and value.isdigit() and int(value) > self.max_body_size:
+                    raise _RequestAborted(413)
+
+        body = tempfile.SpooledTemporaryFile(max_size=self.body_memory_limit)
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise _RequestAborted()
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if self.max_body_size is not None and size > self.max_body_size:
+                    raise _RequestAborted(413)
+                body.write(chunk)
+                if not message.get('more_body', False):
+                    break
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+    @staticmethod
+    async def _reject(send, status, message):
+        payload = json.dumps({'error': message}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode('latin-1')),
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload, 'more_body': False})
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', ()):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                key = 'CONTENT_TYPE'
+            elif name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in environ:
+                value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+            environ[key] = value
+        return environ
+
+    def _call_wsgi(self, environ):
+        """在线程池中调用 WSGI 应用，返回 (status, headers)、响应体和 write() 写入的数据"""
+        started, written = [], []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+            return written.append
+
+        body_iter = self.wsgi_app(environ, start_response)
+        return started, body_iter, written
+
+    async def _wsgi_body(self, loop, body_iter, send):
+        """普通响应体：逐块在线程池中迭代（send_file 等响应可能读文件）"""
+        try:
+            iterator = iter(body_iter)
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+                if chunk is _END:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(body_iter, 'close'):
+                await loop.run_in_executor(self.executor, body_iter.close)
+
+    def _get_flights(self):
+        loop = asyncio.get_running_loop()
+        if self._flights[0] is not loop:
+            self._flights = (loop, self.flights_factory() if self.flights_factory else None)
+        return self._flights[1]
+
+    async def _event_stream(self, stream, receive, send):
+        """在事件循环中执行 EventStream 的 producer；客户端断开时取消"""
+        async def emit(event):
+            await send({'type': 'http.response.body', 'body': sse_event(event).encode('utf-8'), 'more_body': True})
+
+        self._stats['event_streams'] += 1
+        self._stats['active_event_streams'] += 1
+        task = asyncio.ensure_future(adrive(stream.producer, self.resolve_client, emit, self._get_flights()))
+        watcher = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                self._stats['disconnects'] += 1
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("Event stream failed")
+        finally:
+            watcher.cancel()
+            self._stats['active_event_streams'] -= 1
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def stats(self):
+        return dict(self._stats)
+
+
+def configure_pool_defaults():
+    """
+    按 ASGI 路径的并发度设置连接池默认大小（环境变量已配置时不覆盖）
+
+    连接池在首次使用时按环境变量创建，必须在导入 app.py 之前调用。
+    """
+    threads = int(os.getenv('ASGI_WSGI_THREADS', 32))
+    # asyncio.to_thread 使用事件循环的默认线程池，大小与 ThreadPoolExecutor 的默认值相同
+    blocking_threads = min(32, (os.cpu_count() or 1) + 4)
+    max_streams = int(os.getenv('ASGI_MAX_STREAMS', 1000))
+    os.environ.setdefault('MYSQL_POOL_SIZE', str(threads + blocking_threads))
+    os.environ.setdefault('AI_MAX_CONNECTIONS', str(max_streams))
+    os.environ.setdefault('AI_MAX_KEEPALIVE', str(max(32, max_streams // 4)))
+
+
+def create_application():
+    """用 app.py 中的 Flask 应用创建 ASGI 应用"""
+    configure_pool_defaults()
+    from app import app, async_ai_client
+    from single_flight import create_async_single_flight
+
+    return ASGIBridge(
+        app.wsgi_app,
+        async_ai_client,
+        threads=int(os.getenv('ASGI_WSGI_THREADS', 32)),
+        flights_factory=create_async_single_flight,
+        body_memory_limit=int(os.getenv('ASGI_BODY_MEMORY_LIMIT', 1024 * 1024)),
+        max_body_size=app.config.get('MAX_CONTENT_LENGTH'),
+    )
+
+
+application = create_application()
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+上传图片存储 - 按内容寻址的 blob 存储
+
+图片按原始字节的 SHA-256 保存为 {BLOB_DIR}/ab/cd/<sha256>（前两段哈希分片，避免单目录文件过多），
+同一内容只保存一份：写入时已存在则直接丢弃新文件。
+
+引用计数：session 引用图片时调用 add_refs() 记录 (sha256, session_id, 过期时间)，
+blob 的保留期限取所有引用中最晚的过期时间；新写入的 blob 至少保留 BLOB_GC_GRACE 秒，
+等待 session 引用。过期的 blob 由数据保留线程调用 collect_garbage() 分批删除（见 retention.py）。
+引用关系保存在 {BLOB_DIR}/refs.db（SQLite）。
+
+后端可插拔（BlobBackend）：
+- local: 只使用本地目录
+- s3: S3 兼容对象存储（AWS S3、MinIO 等，需要 boto3），本地目录作为热数据层，
+  本地缺失时从远程取回
+
+refs.db 只记录本实例的引用，多实例共用一个存储桶时不能据此判断远程对象是否还被引用，
+因此 collect_garbage() 只删除本地副本；远程对象由存储桶的生命周期规则按对象时间过期，
+过期天数须大于 SESSION_TTL + BLOB_GC_GRACE。已存在的远程对象在再次上传时会刷新修改时间
+（touch），被反复上传的图片不会在仍有 session 引用时过期。
+
+配置（环境变量）：
+- BLOB_STORE: local / s3，默认 local
+- BLOB_DIR: 本地目录，默认 ../data/blobs
+- BLOB_GC_GRACE: 新写入 blob 未被引用时的保留时间（秒），默认 86400
+- BLOB_S3_BUCKET / BLOB_S3_PREFIX（默认 uploads/）/ BLOB_S3_ENDPOINT（MinIO 等自建服务的地址）；
+  凭证使用 boto3 的标准配置（AWS_ACCESS_KEY_ID 等）
+"""
+
+import os
+import re
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+try:
+    import boto3
+except ImportError:  # 只有 BLOB_STORE=s3 时需要
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+DEFAULT_GC_GRACE = 24 * 3600
+
+
+def _check_key(key):
+    if not isinstance(key, str) or not _KEY_PATTERN.match(key):
+        raise ValueError(f"Invalid blob key: {key!r}")
+    return key
+
+
+def shard_path(key):
+    """sha256 -> ab/cd/<sha256>"""
+    return os.path.join(key[:2], key[2:4], key)
+
+
+class BlobBackend:
+    """blob 后端接口：key 为 sha256 十六进制字符串"""
+
+    name = 'base'
+
+    def put_file(self, key, path):
+        """上传文件内容；调用方保证同一 key 的内容相同"""
+        raise NotImplementedError
+
+    def get_file(self, key, dest_path):
+        """把内容写入 dest_path；不存在时抛出 FileNotFoundError"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def touch(self, key):
+        """刷新对象的修改时间（生命周期规则据此计算过期）；不存在时返回 False"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalBlobBackend(BlobBackend):
+    """本地目录：{root}/ab/cd/<sha256>"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, shard_path(_check_key(key)))
+
+    def adopt(self, key, path):
+        """
+        把已写好的文件移动到 key 对应的位置；已存在时删除传入的文件
+
+        Returns:
+            True 表示新写入，False 表示内容已存在（去重）
+        """
+        dest = self.path_for(key)
+        if os.path.exists(dest):
+            os.remove(path)
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.move(path, tmp_path)  # 跨文件系统时退化为复制
+        os.replace(tmp_path, dest)
+        return True
+
+    def put_file(self, key, path):
+        dest = self.path_for(key)
+        if os.path.exists(dest):
+            return
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dest)
+
+    def get_file(self, key, dest_path):
+        shutil.copyfile(self.path_for(key), dest_path)
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def touch(self, key):
+        try:
+            os.utime(self.path_for(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobBackend(BlobBackend):
+    """S3 兼容对象存储，对象名为 {prefix}ab/cd/<sha256>"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='uploads/', endpoint_url=None, client=None):
+        """
+        Args:
+            bucket: 存储桶
+            prefix: 对象名前缀
+            endpoint_url: S3 兼容服务地址（MinIO 等），None 表示 AWS S3
+            client: 已创建的 S3 客户端（boto3.client('s3') 兼容接口）；None 时用 boto3 创建
+        """
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("BLOB_STORE=s3 requires boto3 (pip install boto3)")
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _object_key(self, key):
+        return self.prefix + shard_path(_check_key(key)).replace(os.sep, '/')
+
+    @staticmethod
+    def _is_not_found(error):
+        code = str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def put_file(self, key, path):
+        with open(path, 'rb') as f:
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=f)
+
+    def get_file(self, key, dest_path):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: response['Body'].read(64 * 1024), b''):
+                    f.write(chunk)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+        return True
+
+    def touch(self, key):
+        # 复制到自身（替换元数据）会更新 LastModified，不需要重新上传内容
+        object_key = self._object_key(key)
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=object_key, CopySource={'Bucket': self.bucket, 'Key': object_key},
+                MetadataDirective='REPLACE',
+            )
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+class BlobStore:
+    """内容寻址的上传存储：本地目录 +（可选）远程后端，带 session 引用计数"""
+
+    def __init__(self, root, remote=None, gc_grace=DEFAULT_GC_GRACE):
+        """
+        Args:
+            root: 本地目录（remote 为 None 时即为唯一存储，否则为热数据层）
+            remote: 远程后端（BlobBackend），可选
+            gc_grace: 新写入 blob 未被引用时的保留时间（秒）
+        """
+        self.local = LocalBlobBackend(root)
+        self.remote = remote
+        self.gc_grace = float(gc_grace)
+        self.db_path = os.path.join(root, 'refs.db')
+
+        self._local = threading.local()
+        self._write_lock = threading.Lock()  # 写入与清理同一 blob 互斥，避免去重命中后文件被删除
+        self._stats_lock = threading.Lock()
+        self._stats = {'puts': 0, 'dedup_hits': 0, 'bytes_deduplicated': 0, 'remote_fetches': 0, 'errors': 0}
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            ' sha256 TEXT PRIMARY KEY,'
+            ' size INTEGER NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_expires_at ON blobs (expires_at)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS blob_refs ('
+            ' sha256 TEXT NOT NULL,'
+            ' owner TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' PRIMARY KEY (sha256, owner))'
+        )
+
+    @property
+    def backend(self):
+        return self.remote.name if self.remote is not None else self.local.name
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _add(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def put_file(self, path, sha256):
+        """
+        把已写入磁盘的上传文件存入 blob 存储（文件会被移走）；内容已存在时只删除传入的文件
+
+        Args:
+            path: 上传文件路径
+            sha256: 文件内容的 SHA-256
+
+        Returns:
+            blob 的本地路径
+        """
+        _check_key(sha256)
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._write_lock:
+            self._conn().execute(
+                'INSERT INTO blobs (sha256, size, created_at, expires_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(sha256) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)',
+                (sha256, size, now, now + self.gc_grace)
+            )
+            created = self.local.adopt(sha256, path)
+        # 保留期已延长，清理线程不会在上传过程中删除该 blob
+        if self.remote is not None and not self.remote.touch(sha256):
+            self.remote.put_file(sha256, self.local.path_for(sha256))
+
+        self._add('puts')
+        if not created:
+            self._add('dedup_hits')
+            self._add('bytes_deduplicated', size)
+        return self.local.path_for(sha256)
+
+    def local_path(self, sha256):
+        """blob 的本地路径；本地没有而远程有时先取回（取回的副本同样由 collect_garbage 清理）"""
+        path = self.local.path_for(sha256)
+        if self.remote is not None and not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            now = time.time()
+            with self._write_lock:
+                self._conn().execute(
+                    'INSERT INTO blobs (sha256, size, created_at, expires_at) VALUES (?, 0, ?, ?) '
+                    'ON CONFLICT(sha256) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)',
+                    (sha256, now, now + self.gc_grace)
+                )
+            self.remote.get_file(sha256, path)
+            self._conn().execute('UPDATE blobs SET size = ? WHERE sha256 = ?', (os.path.getsize(path), sha256))
+            self._add('remote_fetches')
+        return path
+
+    def add_refs(self, owner, sha256s, ttl):
+        """
+        记录 owner（session_id）在 ttl 秒内引用这些 blob
+
+        引用到期前 blob 不会被清理；同一 owner 重复引用时延长到期时间。
+        """
+        keys = [_check_key(key) for key in dict.fromkeys(sha256s or [])]
+        if not keys:
+            return
+        expires_at = time.time() + float(ttl)
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT INTO blob_refs (sha256, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(sha256, owner) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)',
+                [(key, owner, expires_at) for key in keys]
+            )
+            conn.executemany(
+                'UPDATE blobs SET expires_at = MAX(expires_at, ?) WHERE sha256 = ?',
+                [(expires_at, key) for key in keys]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def refcount(self, sha256):
+        """未过期的引用数"""
+        row = self._conn().execute(
+            'SELECT COUNT(*) FROM blob_refs WHERE sha256 = ? AND expires_at > ?', (sha256, time.time())
+        ).fetchone()
+        return row[0]
+
+    def collect_garbage(self, limit=None):
+        """
+        删除所有引用均已过期（且超过保留期）的 blob 的本地副本，最多处理 limit 个
+
+        远程对象不在这里删除：本地引用不代表其它实例的引用，远程对象由存储桶生命周期规则过期。
+
+        Returns:
+            {'removed': 删除数, 'bytes': 释放字节数, 'scanned': 检查数}
+        """
+        conn = self._conn()
+        now = time.time()
+        rows = conn.execute(
+            'SELECT sha256, size FROM blobs WHERE expires_at <= ? LIMIT ?',
+            (now, -1 if limit is None else int(limit))
+        ).fetchall()
+        removed = 0
+        reclaimed = 0
+        for sha256, size in rows:
+            with self._write_lock:
+                # 先删除记录再删除文件：查询之后被重新引用或重新上传的 blob 不会被误删
+                claimed = conn.execute(
+                    'DELETE FROM blobs WHERE sha256 = ? AND expires_at <= ?', (sha256, now)
+                ).rowcount
+                if not claimed:
+                    continue
+                conn.execute('DELETE FROM blob_refs WHERE sha256 = ?', (sha256,))
+                try:
+                    self.local.delete(sha256)
+                except Exception as e:
+                    logger.warning(f"Failed to delete blob {sha256}: {e}")
+                    self._add('errors')
+                    continue
+            removed += 1
+            reclaimed += size
+        return {'removed': removed, 'bytes': reclaimed, 'scanned': len(rows)}
+
+    def stats(self):
+        blobs, total_bytes = self._conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        with self._stats_lock:
+            data = dict(self._stats)
+        data.update(backend=self.backend, blobs=blobs, bytes=total_bytes, gc_grace=self.gc_grace)
+        return data
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_blob_store(backend=None):
+    """按环境变量创建 blob 存储"""
+    backend = (backend or os.getenv('BLOB_STORE', 'local')).lower()
+    root = os.getenv('BLOB_DIR', '../data/blobs')
+    gc_grace = float(os.getenv('BLOB_GC_GRACE', DEFAULT_GC_GRACE))
+
+    remote = None
+    if backend == 's3':
+        remote = S3BlobBackend(
+            bucket=os.environ['BLOB_S3_BUCKET'],
+            prefix=os.getenv('BLOB_S3_PREFIX', 'uploads/'),
+            endpoint_url=os.getenv('BLOB_S3_ENDPOINT') or None,
+        )
+    elif backend != 'local':
+        raise ValueError(f"Unknown BLOB_STORE backend: {backend}")
+
+    store = BlobStore(root, remote=remote, gc_grace=gc_grace)
+    logger.info(f"Blob store initialized (backend={store.backend}, dir={root})")
+    return store
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """进程级共享的 blob 存储（首次调用时按环境变量创建）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_blob_store()
+    return _store
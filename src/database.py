@@ -6,133 +6,254 @@
 import os
 import mysql.connector
 from mysql.connector import Error
+import base64
+import copy
 import hashlib
 import logging
+import re
+import threading
+from datetime import datetime, timedelta
+
+from db_pool import ConnectionPool, PoolTimeoutError
+from personalization import sanitize_learning_profile
+from ttl_cache import TTLCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_db_connection():
-    """获取数据库连接"""
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    """创建一个新的原始数据库连接（仅供连接池使用）"""
+    return mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST', 'sjc1.clusters.zeabur.com'),
+        port=int(os.getenv('MYSQL_PORT', 29007)),
+        user=os.getenv('MYSQL_USER', 'root'),
+        password=os.getenv('MYSQL_PASSWORD'),
+        database=os.getenv('MYSQL_DATABASE', 'zeabur'),
+        charset='utf8mb4'
+    )
+
+
+def get_pool():
+    """获取进程级共享的连接池（首次调用时按环境变量创建）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _connect,
+                    size=int(os.getenv('MYSQL_POOL_SIZE') or os.getenv('THREADS') or 8),
+                    timeout=float(os.getenv('MYSQL_POOL_TIMEOUT', 5)),
+                    max_lifetime=float(os.getenv('MYSQL_POOL_MAX_LIFETIME', 1800)),
+                    ping_interval=float(os.getenv('MYSQL_POOL_PING_INTERVAL', 30)),
+                )
+    return _pool
+
+
+def get_pool_stats():
+    """获取连接池统计信息"""
+    return get_pool().stats()
+
+
+def get_db_connection(uow=None):
+    """
+    获取数据库连接
+
+    Args:
+        uow: 可选的 UnitOfWork，传入时返回其共享连接，
+             该连接上的 commit()/close() 会推迟到工作单元结束时统一处理
+
+    Returns:
+        连接对象；连接失败时返回 None。不传 uow 时从连接池借出，
+        connection.close() 会将其归还
+    """
+    if uow is not None:
+        return uow.connection()
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST', 'sjc1.clusters.zeabur.com'),
-            port=int(os.getenv('MYSQL_PORT', 29007)),
-            user=os.getenv('MYSQL_USER', 'root'),
-            password=os.getenv('MYSQL_PASSWORD'),
-            database=os.getenv('MYSQL_DATABASE', 'zeabur'),
-            charset='utf8mb4'
-        )
-        return connection
-    except Error as e:
+        return get_pool().acquire()
+    except (Error, PoolTimeoutError) as e:
         logger.error(f"Database connection error: {e}")
         return None
 
 
-def init_database():
-    """初始化数据库表"""
-    connection = get_db_connection()
-    if not connection:
-        logger.error("Cannot initialize database - no connection")
-        return False
+class _UnitOfWorkCursor:
+    """工作单元内的游标：语句执行失败时把工作单元标记为失败（函数自己捕获异常也不例外）"""
 
-    try:
-        cursor = connection.cursor()
+    def __init__(self, uow, cursor):
+        self._uow = uow
+        self._cursor = cursor
 
-        # 创建用户表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                name VARCHAR(100) NOT NULL,
-                email VARCHAR(255) DEFAULT NULL,
-                phone VARCHAR(20) DEFAULT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                physics_score INT DEFAULT NULL,
-                chemistry_score INT DEFAULT NULL,
-                personalization_enabled TINYINT(1) NOT NULL DEFAULT 1,
-                default_explain_level ENUM('auto','basic','standard','advanced') NOT NULL DEFAULT 'auto',
-                learning_profile_json JSON DEFAULT NULL,
-                learning_profile_updated_at TIMESTAMP NULL DEFAULT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                UNIQUE KEY unique_email (email),
-                UNIQUE KEY unique_phone (phone)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        ''')
-
-        # Add personalization columns (if missing)
-        alter_users_statements = [
-            ("ALTER TABLE users ADD COLUMN personalization_enabled TINYINT(1) NOT NULL DEFAULT 1 AFTER chemistry_score", "personalization_enabled"),
-            ("ALTER TABLE users ADD COLUMN default_explain_level ENUM('auto','basic','standard','advanced') NOT NULL DEFAULT 'auto' AFTER personalization_enabled", "default_explain_level"),
-            ("ALTER TABLE users ADD COLUMN learning_profile_json JSON DEFAULT NULL AFTER default_explain_level", "learning_profile_json"),
-            ("ALTER TABLE users ADD COLUMN learning_profile_updated_at TIMESTAMP NULL DEFAULT NULL AFTER learning_profile_json", "learning_profile_updated_at"),
-        ]
-        for statement, column_name in alter_users_statements:
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, *args, **kwargs):
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        except Error:
+            self._uow._aborted = True
+            raise
+
+    def executemany(self, *args, **kwargs):
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        except Error:
+            self._uow._aborted = True
+            raise
+
+
+class _UnitOfWorkConnection:
+    """工作单元内借给各个函数的连接视图：commit/rollback/close 由工作单元统一处理"""
+
+    def __init__(self, uow, conn):
+        self._uow = uow
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return _UnitOfWorkCursor(self._uow, self._conn.cursor(*args, **kwargs))
+
+    def is_connected(self):
+        return True
+
+    def commit(self):
+        self._uow._commit_requested = True
+
+    def rollback(self):
+        # 函数在 except 中回滚时不能只撤销自己的语句，整个工作单元在结束时回滚
+        self._uow._aborted = True
+
+    def close(self):
+        pass
+
+
+class UnitOfWork:
+    """
+    请求级工作单元 - 多个数据库函数共享一个连接和一个事务
+
+    用法：
+        with unit_of_work() as uow:
+            diaries = get_user_diaries(user_id, limit, offset, uow=uow)
+            total = get_diary_count(user_id, uow=uow)
+
+    连接在第一次使用时才从连接池借出。with 块正常结束时，
+    如有函数请求过 commit 则统一提交一次；发生异常时回滚。
+    各函数捕获数据库异常后返回 {'success': False}，with 块本身不会抛出异常，
+    因此任一语句执行失败（或函数调用了 rollback）时工作单元标记为失败（failed），
+    结束时回滚全部写入，而不是提交失败之前的部分写入。
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._view = None
+        self._failed = False
+        self._aborted = False
+        self._commit_requested = False
+        self._on_commit = []
+
+    def connection(self):
+        """借出（或复用）本工作单元的连接，连接失败时返回 None"""
+        if self._view is not None:
+            return self._view
+        if self._failed:
+            return None
+        try:
+            self._conn = get_pool().acquire()
+        except (Error, PoolTimeoutError) as e:
+            logger.error(f"Database connection error: {e}")
+            self._failed = True
+            return None
+        self._view = _UnitOfWorkConnection(self, self._conn)
+        return self._view
+
+    @property
+    def failed(self):
+        """是否有语句执行失败（结束时将回滚）"""
+        return self._aborted
+
+    def on_commit(self, callback):
+        """注册提交成功后执行的回调（例如缓存失效）"""
+        self._on_commit.append(callback)
+
+    def commit(self):
+        """提交当前事务，并执行提交回调"""
+        if self._conn is not None:
+            self._conn.commit()
+        self._commit_requested = False
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
             try:
-                cursor.execute(statement)
-                logger.info(f"Added {column_name} column to users table")
-            except Error as e:
-                if 'Duplicate column name' in str(e):
-                    pass
-                else:
-                    logger.warning(f"ALTER TABLE users ({column_name}): {e}")
-
-        # 创建日记表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diaries (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                content TEXT NOT NULL,
-                ai_response TEXT DEFAULT NULL,
-                goal_analysis TEXT DEFAULT NULL COMMENT '目标进度分析',
-                mood_score INT DEFAULT NULL COMMENT '心情评分 1-5',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                INDEX idx_user_id (user_id),
-                INDEX idx_created_at (created_at)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        ''')
-
-        # 添加 goal_analysis 字段（如果不存在）
+                callback()
+            except Exception as e:
+                logger.warning(f"Unit of work on_commit callback failed: {e}")
+
+    def rollback(self):
+        """回滚当前事务，丢弃提交回调"""
+        self._commit_requested = False
+        self._aborted = False
+        self._on_commit = []
+        if self._conn is not None:
+            self._conn.rollback()
+
+    def close(self):
+        """归还连接（未提交的事务会被连接池回滚）"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._view = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
         try:
-            cursor.execute('''
-                ALTER TABLE diaries ADD COLUMN goal_analysis TEXT DEFAULT NULL COMMENT '目标进度分析' AFTER ai_response
-            ''')
-            logger.info("Added goal_analysis column to diaries table")
+            if exc_type is not None or self._aborted:
+                if self._aborted:
+                    logger.warning("Unit of work rolled back after a failed statement")
+                self.rollback()
+            elif self._commit_requested or self._on_commit:
+                self.commit()
         except Error as e:
-            if 'Duplicate column name' in str(e):
-                pass  # 字段已存在，忽略
-            else:
-                logger.warning(f"ALTER TABLE diaries: {e}")
+            logger.error(f"Unit of work finalize error: {e}")
+            if exc_type is None:
+                raise
+        finally:
+            self.close()
+        return False
 
-        # 创建用户目标表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_goals (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                title VARCHAR(255) NOT NULL COMMENT '目标标题',
-                description TEXT DEFAULT NULL COMMENT '目标描述',
-                status ENUM('active', 'completed', 'archived') DEFAULT 'active' COMMENT '状态',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                INDEX idx_user_status (user_id, status),
-                INDEX idx_created_at (created_at)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        ''')
 
-        connection.commit()
-        logger.info("Database initialized successfully")
-        return True
+def unit_of_work():
+    """打开一个请求级工作单元（上下文管理器）"""
+    return UnitOfWork()
+
+
+def init_database():
+    """
+    启动时检查数据库结构版本
+
+    只执行一次 SELECT schema_migrations，不再在每次启动时执行 DDL。
+    结构变更通过 migrations 显式执行：cd src && python -m migrations upgrade；
+    设置 DB_AUTO_MIGRATE=true 时（开发环境）启动时自动执行未应用的迁移。
+
+    Returns:
+        bool: 数据库结构是否为最新
+    """
+    from migrations import check_schema_version
+
+    auto_migrate = os.getenv('DB_AUTO_MIGRATE', 'false').lower() == 'true'
+    try:
+        return check_schema_version(auto_migrate=auto_migrate)
     except Error as e:
         logger.error(f"Database initialization error: {e}")
         return False
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 
 def hash_password(password):
@@ -140,7 +261,35 @@ def hash_password(password):
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
 
-def register_user(name, password, email=None, phone=None, physics_score=None, chemistry_score=None):
+_PHONE_PATTERN = re.compile(r'\+?\d[\d\- ]{4,19}')
+
+
+def classify_account(account):
+    """
+    判断账号标识的类型
+
+    Returns:
+        'email'（包含 @）、'phone'（数字/+/-/空格组成）或 'name'
+    """
+    account = account or ''
+    if '@' in account:
+        return 'email'
+    if _PHONE_PATTERN.fullmatch(account):
+        return 'phone'
+    return 'name'
+
+
+# 按账号类型决定探测的列，每一列都有索引（email/phone 唯一索引，name 普通索引）。
+# 姓名没有格式限制，邮箱/手机号形式的账号仍兜底探测一次 name；
+# 邮箱不会等于手机号形式的值（反之亦然），因此探测的列覆盖了所有可能匹配的列。
+_LOGIN_PROBES = {
+    'email': ('email', 'name'),
+    'phone': ('phone', 'name'),
+    'name': ('name', 'phone'),
+}
+
+
+def register_user(name, password, email=None, phone=None, physics_score=None, chemistry_score=None, uow=None):
     """
     注册新用户
 
@@ -150,7 +299,7 @@ def register_user(name, password, email=None, phone=None, physics_score=None, ch
     if not email and not phone:
         return {'success': False, 'message': '请提供邮箱或手机号'}
 
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -188,32 +337,38 @@ def register_user(name, password, email=None, phone=None, physics_score=None, ch
             connection.close()
 
 
-def login_user(account, password):
+def login_user(account, password, uow=None):
     """
     用户登录
 
     Args:
         account: 用户名、邮箱或手机号
         password: 密码
+        uow: 可选的 UnitOfWork，传入时复用其连接和事务
 
     Returns:
         dict: {'success': bool, 'message': str, 'user': dict or None}
     """
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
     try:
         cursor = connection.cursor(dictionary=True)
 
-        # 查找用户（通过用户名、邮箱或手机号）
-        cursor.execute('''
-            SELECT id, name, email, phone, password_hash,
-                   physics_score, chemistry_score,
-                   personalization_enabled, default_explain_level, learning_profile_updated_at
-            FROM users
-            WHERE name = %s OR email = %s OR phone = %s
-        ''', (account, account, account))
+        # 查找用户：按账号类型对有索引的列逐一探测（UNION ALL，一次往返），
+        # 避免 name/email/phone 三列 OR 导致的全表扫描。
+        # 账号同时匹配多行（如某人的姓名恰好是另一人的邮箱）时取 id 最小的一行，
+        # 与原 OR 查询一致（全表扫描和 index_merge 都按主键顺序返回）
+        probes = _LOGIN_PROBES[classify_account(account)]
+        query = ' UNION ALL '.join(
+            f'''(SELECT id, name, email, phone, password_hash,
+                        physics_score, chemistry_score,
+                        personalization_enabled, default_explain_level, learning_profile_updated_at
+                 FROM users WHERE {column} = %s ORDER BY id LIMIT 1)'''
+            for column in probes
+        )
+        cursor.execute(query + ' ORDER BY id LIMIT 1', (account,) * len(probes))
 
         user = cursor.fetchone()
 
@@ -236,23 +391,21 @@ def login_user(account, password):
             connection.close()
 
 
-def check_account_exists(account):
+def check_account_exists(account, uow=None):
     """
     检查账号（邮箱或手机号）是否存在
 
     Returns:
         dict: {'exists': bool, 'user_id': int or None, 'name': str or None}
     """
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'exists': False, 'user_id': None, 'name': None}
 
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute('''
-            SELECT id, name FROM users
-            WHERE email = %s OR phone = %s
-        ''', (account, account))
+        column = 'email' if classify_account(account) == 'email' else 'phone'
+        cursor.execute(f'SELECT id, name FROM users WHERE {column} = %s', (account,))
 
         user = cursor.fetchone()
 
@@ -268,18 +421,19 @@ def check_account_exists(account):
             connection.close()
 
 
-def reset_password(account, new_password):
+def reset_password(account, new_password, uow=None):
     """
     重置密码
 
     Args:
         account: 邮箱或手机号
         new_password: 新密码
+        uow: 可选的 UnitOfWork，传入时复用其连接和事务
 
     Returns:
         dict: {'success': bool, 'message': str}
     """
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -287,10 +441,11 @@ def reset_password(account, new_password):
         cursor = connection.cursor()
 
         password_hash = hash_password(new_password)
-        cursor.execute('''
+        column = 'email' if classify_account(account) == 'email' else 'phone'
+        cursor.execute(f'''
             UPDATE users SET password_hash = %s
-            WHERE email = %s OR phone = %s
-        ''', (password_hash, account, account))
+            WHERE {column} = %s
+        ''', (password_hash, account))
 
         if cursor.rowcount == 0:
             return {'success': False, 'message': '账号不存在'}
@@ -306,9 +461,9 @@ def reset_password(account, new_password):
             connection.close()
 
 
-def get_user_by_id(user_id):
+def get_user_by_id(user_id, uow=None):
     """根据ID获取用户信息"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return None
 
@@ -330,12 +485,12 @@ def get_user_by_id(user_id):
             connection.close()
 
 
-def update_user_scores(user_id, physics_score=None, chemistry_score=None):
+def update_user_scores(user_id, physics_score=None, chemistry_score=None, uow=None):
     """更新用户自评分（0-100）"""
     if physics_score is None and chemistry_score is None:
         return {'success': False, 'message': '没有需要更新的分数'}
 
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -356,6 +511,7 @@ def update_user_scores(user_id, physics_score=None, chemistry_score=None):
             WHERE id = %s
         ''', tuple(params))
         connection.commit()
+        _invalidate_personalization(user_id, uow)
         return {'success': True, 'message': '分数更新成功'}
     except Error as e:
         logger.error(f"Update user scores error: {e}")
@@ -366,9 +522,50 @@ def update_user_scores(user_id, physics_score=None, chemistry_score=None):
             connection.close()
 
 
-def get_user_personalization(user_id):
-    """获取用户个性化设置与画像"""
-    connection = get_db_connection()
+# 用户个性化设置/画像的进程内缓存：提问路径每次都要读取，热用户不再访问数据库。
+# 写入函数会在提交后失效对应条目；多实例部署下其它实例的修改最多延迟 TTL 秒可见。
+_personalization_cache = TTLCache(
+    max_entries=int(os.getenv('PERSONALIZATION_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('PERSONALIZATION_CACHE_TTL', 300)),
+)
+
+
+def _invalidate_personalization(user_id, uow=None):
+    """失效用户个性化缓存；在工作单元内时提交后再失效一次，避免并发读回填旧数据"""
+    _personalization_cache.invalidate(user_id)
+    if uow is not None:
+        uow.on_commit(lambda: _personalization_cache.invalidate(user_id))
+
+
+def get_personalization_cache_stats():
+    """获取个性化缓存的命中统计"""
+    return _personalization_cache.stats()
+
+
+def _personalization_data(row):
+    """缓存条目的副本；learning_profile 是嵌套的 dict，深拷贝后调用方修改不会影响缓存"""
+    data = dict(row)
+    data['learning_profile'] = copy.deepcopy(row.get('learning_profile'))
+    return data
+
+
+def get_user_personalization(user_id, uow=None):
+    """
+    获取用户个性化设置与画像
+
+    结果带缓存；data 中额外包含已清洗的画像 learning_profile（dict），
+    调用方无需再对 learning_profile_json 调用 sanitize_learning_profile。
+    在工作单元内既不读也不写缓存：同一事务中刚写入的设置必须读到最新值。
+    读取期间缓存被失效（并发写入已提交）时不回填，避免旧数据在缓存中保留整个 TTL。
+    """
+    generation = None
+    if uow is None:
+        cached = _personalization_cache.get(user_id)
+        if cached is not None:
+            return {'success': True, 'message': 'ok', 'data': _personalization_data(cached)}
+        generation = _personalization_cache.generation()
+
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败', 'data': None}
 
@@ -384,7 +581,11 @@ def get_user_personalization(user_id):
         row = cursor.fetchone()
         if not row:
             return {'success': False, 'message': '用户不存在', 'data': None}
-        return {'success': True, 'message': 'ok', 'data': row}
+        row['learning_profile'] = sanitize_learning_profile(row.get('learning_profile_json'))
+        # 工作单元内读到的可能是未提交的数据，不写入缓存
+        if uow is None:
+            _personalization_cache.set(user_id, row, generation=generation)
+        return {'success': True, 'message': 'ok', 'data': _personalization_data(row)}
     except Error as e:
         logger.error(f"Get user personalization error: {e}")
         return {'success': False, 'message': f'获取失败: {str(e)}', 'data': None}
@@ -394,12 +595,12 @@ def get_user_personalization(user_id):
             connection.close()
 
 
-def update_user_personalization(user_id, personalization_enabled=None, default_explain_level=None):
+def update_user_personalization(user_id, personalization_enabled=None, default_explain_level=None, uow=None):
     """更新用户个性化设置（不涉及画像刷新）"""
     if personalization_enabled is None and default_explain_level is None:
         return {'success': False, 'message': '没有需要更新的设置'}
 
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -420,6 +621,7 @@ def update_user_personalization(user_id, personalization_enabled=None, default_e
             WHERE id = %s
         ''', tuple(params))
         connection.commit()
+        _invalidate_personalization(user_id, uow)
         return {'success': True, 'message': '设置更新成功'}
     except Error as e:
         logger.error(f"Update user personalization error: {e}")
@@ -430,9 +632,9 @@ def update_user_personalization(user_id, personalization_enabled=None, default_e
             connection.close()
 
 
-def save_learning_profile(user_id, profile_json, updated_at=None):
+def save_learning_profile(user_id, profile_json, updated_at=None, uow=None):
     """保存学习画像（结构化 JSON）"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -445,6 +647,7 @@ def save_learning_profile(user_id, profile_json, updated_at=None):
             WHERE id = %s
         ''', (profile_json, updated_at, user_id))
         connection.commit()
+        _invalidate_personalization(user_id, uow)
         return {'success': True, 'message': '画像已保存'}
     except Error as e:
         logger.error(f"Save learning profile error: {e}")
@@ -457,9 +660,9 @@ def save_learning_profile(user_id, profile_json, updated_at=None):
 
 # ==================== 日记相关函数 ====================
 
-def create_diary(user_id, content, mood_score=None):
+def create_diary(user_id, content, mood_score=None, uow=None):
     """创建新日记"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败', 'diary_id': None}
 
@@ -469,9 +672,12 @@ def create_diary(user_id, content, mood_score=None):
             INSERT INTO diaries (user_id, content, mood_score)
             VALUES (%s, %s, %s)
         ''', (user_id, content, mood_score))
+        diary_id = cursor.lastrowid
+
+        # 同一事务内更新打卡统计
+        _record_diary_activity(connection, cursor, user_id, diary_id)
 
         connection.commit()
-        diary_id = cursor.lastrowid
 
         return {'success': True, 'message': '日记保存成功', 'diary_id': diary_id}
     except Error as e:
@@ -483,9 +689,9 @@ def create_diary(user_id, content, mood_score=None):
             connection.close()
 
 
-def update_diary_ai_response(diary_id, ai_response):
+def update_diary_ai_response(diary_id, ai_response, uow=None):
     """更新日记的AI回复"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -506,9 +712,9 @@ def update_diary_ai_response(diary_id, ai_response):
             connection.close()
 
 
-def get_diary_by_id(diary_id, user_id):
+def get_diary_by_id(diary_id, user_id, uow=None):
     """根据ID获取日记详情"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return None
 
@@ -533,9 +739,9 @@ def get_diary_by_id(diary_id, user_id):
             connection.close()
 
 
-def get_user_diaries(user_id, limit=20, offset=0):
+def get_user_diaries(user_id, limit=20, offset=0, uow=None):
     """获取用户的日记列表"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return []
 
@@ -550,7 +756,7 @@ def get_user_diaries(user_id, limit=20, offset=0):
                    created_at
             FROM diaries
             WHERE user_id = %s
-            ORDER BY created_at DESC
+            ORDER BY created_at DESC, id DESC
             LIMIT %s OFFSET %s
         ''', (user_id, limit, offset))
 
@@ -567,9 +773,103 @@ def get_user_diaries(user_id, limit=20, offset=0):
             connection.close()
 
 
-def get_diary_count(user_id):
+def encode_diary_cursor(created_at, diary_id):
+    """把 (created_at, id) 编码为不透明的分页游标"""
+    raw = f"{created_at.isoformat()}|{int(diary_id)}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_diary_cursor(token):
+    """
+    解析分页游标
+
+    Returns:
+        (created_at: datetime, diary_id: int)
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at_str, diary_id_str = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at_str), int(diary_id_str)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {token!r}") from e
+
+
+def get_user_diaries_by_cursor(user_id, limit=20, page_cursor=None, uow=None):
+    """
+    游标（keyset）分页获取用户日记列表
+
+    按 (created_at, id) 倒序，使用 idx_user_created_id 复合索引直接定位到
+    上一页末尾，不像 OFFSET 那样扫描并丢弃前面的行，因此第 N 页与第 1 页开销相同。
+
+    Args:
+        user_id: 用户ID
+        limit: 每页条数
+        page_cursor: 上一页返回的 next_cursor，None 表示第一页
+        uow: 可选的 UnitOfWork，传入时复用其连接和事务
+
+    Returns:
+        (diaries: list, next_cursor: str or None)
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    after = decode_diary_cursor(page_cursor) if page_cursor else None
+
+    connection = get_db_connection(uow)
+    if not connection:
+        return [], None
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        columns = '''
+            SELECT id,
+                   LEFT(content, 100) as content,
+                   LEFT(ai_response, 50) as ai_response,
+                   LEFT(goal_analysis, 80) as goal_analysis,
+                   mood_score,
+                   created_at
+            FROM diaries
+        '''
+        # 多取一条用于判断是否还有下一页
+        if after:
+            cursor.execute(columns + '''
+                WHERE user_id = %s
+                  AND (created_at < %s OR (created_at = %s AND id < %s))
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ''', (user_id, after[0], after[0], after[1], limit + 1))
+        else:
+            cursor.execute(columns + '''
+                WHERE user_id = %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ''', (user_id, limit + 1))
+
+        results = cursor.fetchall()
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            last = results[-1]
+            next_cursor = encode_diary_cursor(last['created_at'], last['id'])
+        for r in results:
+            r['created_at'] = r['created_at'].isoformat() if r['created_at'] else None
+        return results, next_cursor
+    except Error as e:
+        logger.error(f"Get user diaries by cursor error: {e}")
+        return [], None
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+
+def get_diary_count(user_id, uow=None):
     """获取用户日记总数"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return 0
 
@@ -587,82 +887,198 @@ def get_diary_count(user_id):
             connection.close()
 
 
-def check_diary_today(user_id):
-    """检查用户今天是否已写日记"""
-    connection = get_db_connection()
-    if not connection:
-        return {'has_diary': False, 'diary_id': None}
+def _record_diary_activity(connection, cursor, user_id, diary_id):
+    """
+    写日记后增量更新 diary_streaks（O(1)）
+
+    统计行不存在时（尚未回填的老用户的第一篇新日记）从 diaries 表全量重算，
+    不能直接写入 1，否则历史连续天数会被永久覆盖。
 
+    注意单表 UPDATE 按顺序求值：current_streak 先基于旧的
+    last_entry_date 计算，longest_streak 使用更新后的 current_streak，
+    最后才更新 last_entry_date。
+    """
+    cursor.execute('SELECT 1 FROM diary_streaks WHERE user_id = %s FOR UPDATE', (user_id,))
+    if cursor.fetchone() is None:
+        # 新插入的日记在同一事务内可见，重算结果已包含它
+        _rebuild_diary_streak(connection, user_id)
+        return
+
+    cursor.execute('''
+        UPDATE diary_streaks SET
+            current_streak = CASE
+                WHEN last_entry_date = CURDATE() THEN current_streak
+                WHEN last_entry_date = CURDATE() - INTERVAL 1 DAY THEN current_streak + 1
+                ELSE 1
+            END,
+            longest_streak = GREATEST(longest_streak, current_streak),
+            last_diary_id = %s,
+            last_entry_date = CURDATE()
+        WHERE user_id = %s
+    ''', (diary_id, user_id))
+
+
+def compute_streaks(dates):
+    """
+    根据按日期倒序排列的写日记日期计算打卡统计
+
+    Args:
+        dates: 去重后按倒序排列的 date 列表
+
+    Returns:
+        (current_streak, longest_streak)，current_streak 是截至 dates[0] 的连续天数
+    """
+    if not dates:
+        return 0, 0
+
+    current = None
+    run = longest = 1
+    for previous, diary_date in zip(dates, dates[1:]):
+        if diary_date == previous - timedelta(days=1):
+            run += 1
+        else:
+            if current is None:
+                current = run
+            run = 1
+        longest = max(longest, run)
+    return (run if current is None else current), longest
+
+
+def _rebuild_diary_streak(connection, user_id):
+    """从 diaries 表全量重算某个用户的打卡统计（删除日记、回填或统计行缺失时使用）"""
+    cursor = connection.cursor()
     try:
-        cursor = connection.cursor(dictionary=True)
         cursor.execute('''
-            SELECT id FROM diaries
-            WHERE user_id = %s AND DATE(created_at) = CURDATE()
-            ORDER BY created_at DESC LIMIT 1
+            SELECT DATE(created_at) AS diary_date, MAX(id) AS last_id
+            FROM diaries
+            WHERE user_id = %s
+            GROUP BY diary_date
+            ORDER BY diary_date DESC
         ''', (user_id,))
+        rows = cursor.fetchall()
 
-        result = cursor.fetchone()
-        if result:
-            return {'has_diary': True, 'diary_id': result['id']}
-        return {'has_diary': False, 'diary_id': None}
+        dates = [row[0] for row in rows]
+        current, longest = compute_streaks(dates)
+        last_entry_date = dates[0] if dates else None
+        last_diary_id = rows[0][1] if rows else None
+
+        cursor.execute('''
+            INSERT INTO diary_streaks (user_id, current_streak, longest_streak, last_entry_date, last_diary_id)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                current_streak = VALUES(current_streak),
+                longest_streak = VALUES(longest_streak),
+                last_entry_date = VALUES(last_entry_date),
+                last_diary_id = VALUES(last_diary_id)
+        ''', (user_id, current, longest, last_entry_date, last_diary_id))
+    finally:
+        cursor.close()
+
+
+def get_diary_stats(user_id, uow=None):
+    """
+    获取用户打卡统计（读取 diary_streaks 单行，O(1)）
+
+    Returns:
+        dict: {'streak': int, 'longest_streak': int, 'last_entry_date': str or None,
+               'has_diary_today': bool, 'today_diary_id': int or None}
+    """
+    empty = {'streak': 0, 'longest_streak': 0, 'last_entry_date': None,
+             'has_diary_today': False, 'today_diary_id': None}
+    connection = get_db_connection(uow)
+    if not connection:
+        return empty
+
+    query = '''
+        SELECT current_streak, longest_streak, last_entry_date, last_diary_id,
+               last_entry_date = CURDATE() AS wrote_today,
+               last_entry_date >= CURDATE() - INTERVAL 1 DAY AS streak_alive
+        FROM diary_streaks
+        WHERE user_id = %s
+    '''
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(query, (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            # 统计行缺失（尚未回填的老用户）：重算一次并保存
+            _rebuild_diary_streak(connection, user_id)
+            connection.commit()
+            cursor.execute(query, (user_id,))
+            row = cursor.fetchone()
+        if not row:
+            return empty
+
+        wrote_today = bool(row['wrote_today'])
+        last_entry_date = row['last_entry_date']
+        return {
+            'streak': row['current_streak'] if row['streak_alive'] else 0,
+            'longest_streak': row['longest_streak'],
+            'last_entry_date': last_entry_date.isoformat() if last_entry_date else None,
+            'has_diary_today': wrote_today,
+            'today_diary_id': row['last_diary_id'] if wrote_today else None,
+        }
     except Error as e:
-        logger.error(f"Check diary today error: {e}")
-        return {'has_diary': False, 'diary_id': None}
+        logger.error(f"Get diary stats error: {e}")
+        return empty
     finally:
         if connection.is_connected():
             cursor.close()
             connection.close()
 
 
-def get_diary_streak(user_id):
+def check_diary_today(user_id, uow=None):
+    """检查用户今天是否已写日记"""
+    stats = get_diary_stats(user_id, uow=uow)
+    return {'has_diary': stats['has_diary_today'], 'diary_id': stats['today_diary_id']}
+
+
+def get_diary_streak(user_id, uow=None):
     """获取用户连续写日记天数"""
+    return get_diary_stats(user_id, uow=uow)['streak']
+
+
+def backfill_diary_streaks(batch_size=200):
+    """
+    为所有写过日记的用户重算 diary_streaks
+
+    每 batch_size 个用户提交一次，可重复执行。
+
+    Returns:
+        int: 处理的用户数
+    """
     connection = get_db_connection()
     if not connection:
+        logger.error("Cannot backfill diary streaks - no connection")
         return 0
 
+    processed = 0
     try:
         cursor = connection.cursor()
-        cursor.execute('''
-            SELECT DISTINCT DATE(created_at) as diary_date
-            FROM diaries
-            WHERE user_id = %s
-            ORDER BY diary_date DESC
-        ''', (user_id,))
-
-        dates = [row[0] for row in cursor.fetchall()]
-        if not dates:
-            return 0
-
-        from datetime import date, timedelta
-        today = date.today()
-        streak = 0
-
-        # 检查今天或昨天是否有日记
-        if dates[0] != today and dates[0] != today - timedelta(days=1):
-            return 0
-
-        # 计算连续天数
-        expected_date = dates[0]
-        for diary_date in dates:
-            if diary_date == expected_date:
-                streak += 1
-                expected_date = diary_date - timedelta(days=1)
-            else:
-                break
-
-        return streak
+        cursor.execute('SELECT DISTINCT user_id FROM diaries ORDER BY user_id')
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+        for user_id in user_ids:
+            _rebuild_diary_streak(connection, user_id)
+            processed += 1
+            if processed % batch_size == 0:
+                connection.commit()
+                logger.info(f"Backfilled diary streaks for {processed}/{len(user_ids)} users")
+        connection.commit()
+        logger.info(f"Backfilled diary streaks for {processed} users")
+        return processed
     except Error as e:
-        logger.error(f"Get diary streak error: {e}")
-        return 0
+        logger.error(f"Backfill diary streaks error: {e}")
+        return processed
     finally:
         if connection.is_connected():
             cursor.close()
             connection.close()
 
 
-def delete_diary(diary_id, user_id):
+def delete_diary(diary_id, user_id, uow=None):
     """删除日记"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -675,6 +1091,9 @@ def delete_diary(diary_id, user_id):
         if cursor.rowcount == 0:
             return {'success': False, 'message': '日记不存在或无权删除'}
 
+        # 删除可能打断连续天数，同一事务内重算打卡统计
+        _rebuild_diary_streak(connection, user_id)
+
         connection.commit()
         return {'success': True, 'message': '日记已删除'}
     except Error as e:
@@ -686,9 +1105,9 @@ def delete_diary(diary_id, user_id):
             connection.close()
 
 
-def update_diary_goal_analysis(diary_id, goal_analysis):
+def update_diary_goal_analysis(diary_id, goal_analysis, uow=None):
     """更新日记的目标分析"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -709,7 +1128,7 @@ def update_diary_goal_analysis(diary_id, goal_analysis):
             connection.close()
 
 
-def get_recent_diaries(user_id, days=None, limit=50):
+def get_recent_diaries(user_id, days=None, limit=50, uow=None):
     """
     获取用户近期日记（用于AI分析）
 
@@ -717,11 +1136,12 @@ def get_recent_diaries(user_id, days=None, limit=50):
         user_id: 用户ID
         days: 天数（7, 30, None表示全部）
         limit: 最大返回条数
+        uow: 可选的 UnitOfWork，传入时复用其连接和事务
 
     Returns:
         日记列表，每条包含 id, content, mood_score, created_at
     """
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return []
 
@@ -760,9 +1180,9 @@ def get_recent_diaries(user_id, days=None, limit=50):
 
 # ==================== 目标相关函数 ====================
 
-def create_goal(user_id, title, description=None):
+def create_goal(user_id, title, description=None, uow=None):
     """创建新目标"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败', 'goal_id': None}
 
@@ -786,15 +1206,16 @@ def create_goal(user_id, title, description=None):
             connection.close()
 
 
-def get_user_goals(user_id, status='active'):
+def get_user_goals(user_id, status='active', uow=None):
     """
     获取用户目标列表
 
     Args:
         user_id: 用户ID
         status: 目标状态 ('active', 'completed', 'archived', 'all')
+        uow: 可选的 UnitOfWork，传入时复用其连接和事务
     """
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return []
 
@@ -830,9 +1251,9 @@ def get_user_goals(user_id, status='active'):
             connection.close()
 
 
-def get_goal_by_id(goal_id, user_id):
+def get_goal_by_id(goal_id, user_id, uow=None):
     """获取单个目标详情"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return None
 
@@ -858,9 +1279,9 @@ def get_goal_by_id(goal_id, user_id):
             connection.close()
 
 
-def update_goal(goal_id, user_id, title=None, description=None, status=None):
+def update_goal(goal_id, user_id, title=None, description=None, status=None, uow=None):
     """更新目标"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -905,9 +1326,9 @@ def update_goal(goal_id, user_id, title=None, description=None, status=None):
             connection.close()
 
 
-def delete_goal(goal_id, user_id):
+def delete_goal(goal_id, user_id, uow=None):
     """删除目标"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return {'success': False, 'message': '数据库连接失败'}
 
@@ -931,9 +1352,9 @@ def delete_goal(goal_id, user_id):
             connection.close()
 
 
-def get_goal_count(user_id, status='active'):
+def get_goal_count(user_id, status='active', uow=None):
     """获取用户目标数量"""
-    connection = get_db_connection()
+    connection = get_db_connection(uow)
     if not connection:
         return 0
 
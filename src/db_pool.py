@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+数据库连接池 - 进程级共享的 MySQL 连接池
+
+所有 database.py 中的函数通过 get_db_connection() 借出连接，
+调用 connection.close() 时连接会被归还到池中而不是真正断开，
+从而避免每次查询都重新进行 TCP + TLS + 认证握手。
+
+配置（环境变量）：
+- MYSQL_POOL_SIZE: 最大连接数，默认与 waitress 的 THREADS 相同
+- MYSQL_POOL_TIMEOUT: 借出连接的最长等待时间（秒），默认 5
+- MYSQL_POOL_MAX_LIFETIME: 连接最长存活时间（秒），超过后回收重建，默认 1800
+- MYSQL_POOL_PING_INTERVAL: 空闲超过该时间（秒）的连接在借出前做一次 ping 健康检查，默认 30
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """在 borrow 超时时间内没有可用连接"""
+
+
+class PooledConnection:
+    """
+    连接池中借出的连接代理
+
+    行为与原始连接一致，区别在于：
+    - close() 将连接归还给连接池
+    - is_connected() 只检查本地状态，不再向服务器发送 ping
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def is_connected(self):
+        return not self._released
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    """线程安全的 MySQL 连接池（LIFO 复用，懒创建）"""
+
+    def __init__(self, connect, size=8, timeout=5.0, max_lifetime=1800.0, ping_interval=30.0):
+        """
+        Args:
+            connect: 创建新原始连接的无参函数
+            size: 最大连接数
+            timeout: 借出连接的最长等待时间（秒）
+            max_lifetime: 连接最长存活时间（秒），<= 0 表示不限制
+            ping_interval: 空闲超过该时间（秒）的连接借出前先 ping，<= 0 表示每次都 ping
+        """
+        self._connect = connect
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.max_lifetime = float(max_lifetime)
+        self.ping_interval = float(ping_interval)
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw, created_at, last_used_at)
+        self._total = 0
+        self._stats = {
+            'borrowed': 0,
+            'created': 0,
+            'recycled': 0,
+            'broken': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def acquire(self):
+        """借出一个健康的连接，必要时等待或新建"""
+        wait_started = time.monotonic()
+        deadline = wait_started + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._total >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available within {self.timeout}s (pool size {self.size})"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+                if waited:
+                    self._stats['wait_time_total'] += time.monotonic() - wait_started
+                    waited = False
+                    wait_started = time.monotonic()
+
+                if self._idle:
+                    raw, created_at, last_used_at = self._idle.pop()
+                else:
+                    raw = None
+                    self._total += 1
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._stats['created'] += 1
+                    self._stats['borrowed'] += 1
+                return PooledConnection(self, raw, created_at)
+
+            if not self._is_usable(raw, created_at, last_used_at):
+                self._discard(raw)
+                continue
+
+            with self._cond:
+                self._stats['borrowed'] += 1
+            return PooledConnection(self, raw, created_at)
+
+    def _is_usable(self, raw, created_at, last_used_at):
+        now = time.monotonic()
+        if self.max_lifetime > 0 and now - created_at >= self.max_lifetime:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if now - last_used_at >= self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats['broken'] += 1
+                return False
+        return True
+
+    def _release(self, raw, created_at):
+        """归还连接：回滚未提交事务，保证下一个借用者看到干净的会话"""
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            with self._cond:
+                self._stats['broken'] += 1
+            self._discard(raw)
+            return
+
+        with self._cond:
+            self._idle.append((raw, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接在归还后仍会回到池中）"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for raw, _, _ in idle:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """连接池统计信息"""
+        with self._cond:
+            data = dict(self._stats)
+            data['size'] = self.size
+            data['open'] = self._total
+            data['idle'] = len(self._idle)
+            data['in_use'] = self._total - len(self._idle)
+        data['wait_time_total'] = round(data['wait_time_total'], 4)
+        return data
@@ -12,12 +12,30 @@
 """
 
 import os
+import time
 import base64
 import json
-from openai import OpenAI
 from typing import Optional, List, Dict, Any, Generator
 import logging
 
+from ai_clients import get_ai_clients
+from image_cache import ImageEncodingCache, content_hash, get_image_cache
+from image_dedup import PerceptualHashIndex, get_phash_index
+from image_processing import (
+    EncodingOptions,
+    ImageValidationError,
+    compress_many,
+    encoding_cache_key,
+    load_cached_payload,
+    passthrough_payload,
+    probe_image,
+    record_encode_batch,
+    record_raw_fallback,
+    preprocess_in_background,
+    record_request_payload,
+    wait_for_preprocessed,
+)
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,30 +43,66 @@ logger = logging.getLogger(__name__)
 class DoubaoClient:
     """豆包API客户端 - 支持深度思考（reasoning_content）"""
 
-    def __init__(self, api_key: str = None, timeout: int = 1800):
+    # 图片压缩参数（参与编码缓存 key，修改后旧缓存自动失效）；自适应编码时为上限
+    IMAGE_MAX_SIZE = 1024
+    IMAGE_JPEG_QUALITY = 85
+    # 生成回答时等待上传预处理结果的最长时间（秒），超时后同步压缩
+    IMAGE_PREPROCESS_WAIT = 30
+
+    def __init__(
+        self,
+        api_key: str = None,
+        timeout: int = 1800,
+        image_cache: ImageEncodingCache = None,
+        phash_index: PerceptualHashIndex = None
+    ):
         """
         初始化豆包客户端
 
         Args:
             api_key: 豆包API密钥，如果为None则从环境变量获取
-            timeout: 超时时间（秒），深度思考推荐1800秒以上
+            timeout: 读超时（秒），深度思考推荐1800秒以上
+            image_cache: 图片编码缓存，默认使用进程级共享缓存
+            phash_index: 感知哈希索引（近似图片去重），默认使用进程级共享索引
         """
+        self.image_cache = image_cache
+        self.phash_index = phash_index
+        # 自适应图片编码：IMAGE_ADAPTIVE=0 时固定 1024px / JPEG 85 / detail=low
+        self.image_adaptive = os.getenv('IMAGE_ADAPTIVE', '1') != '0'
+        self.image_format = os.getenv('IMAGE_FORMAT', 'jpeg').upper()
+        # 文字密集的图片使用 detail=high，默认关闭：high 把单图 token 上限从 1312 提高到 5120，
+        # 放大 IMAGE_MAX_SIZE 时视觉 token 随像素数增长（宽×高÷784）
+        self.image_detail_high = os.getenv('IMAGE_DETAIL_HIGH', '0') == '1'
+        # 单次请求中所有图片编码后的字节预算，按图片数均分；0 表示不限
+        self.image_request_byte_budget = int(os.getenv('IMAGE_REQUEST_BYTE_BUDGET', 2 * 1024 * 1024))
+        # 压缩失败时原样发送原图的大小上限，超过则报错，不把数 MB 的原图发给模型
+        self.image_raw_fallback_max_bytes = int(os.getenv('IMAGE_RAW_FALLBACK_MAX_BYTES', 1024 * 1024))
         self.api_key = api_key or os.getenv('DOUBAO_API_KEY')
         self.base_url = "https://ark.cn-beijing.volces.com/api/v3"
         self.model = "doubao-seed-1-6-251015"  # 深度思考模型
 
-        # 初始化OpenAI兼容客户端
+        # OpenAI兼容客户端，来自共享注册表（连接池与 DeepSeek 一致地配置，见 ai_clients.py）
         # 使用Chat API流式模式获取 reasoning_content（思考过程）
         self.client = None
+        self.timeout = timeout
         if self.api_key:
-            self.client = OpenAI(
+            self.client = get_ai_clients().client(
+                'doubao',
                 api_key=self.api_key,
                 base_url=self.base_url,
-                timeout=timeout  # 深度思考需要较长超时时间
+                read_timeout=timeout  # 深度思考需要较长的读超时（两个数据块之间的间隔）
             )
         else:
             logger.warning("DOUBAO_API_KEY not set - image queries will not work")
 
+    def get_async_client(self):
+        """ASGI 路径使用的 AsyncOpenAI 客户端（与同步客户端配置相同，只能在 ASGI 事件循环中使用）"""
+        if not self.api_key:
+            return None
+        return get_ai_clients().async_client(
+            'doubao', api_key=self.api_key, base_url=self.base_url, read_timeout=self.timeout
+        )
+
     def encode_image(self, image_path: str) -> str:
         """
         将图片转换为base64编码，并进行压缩优化
@@ -59,72 +113,209 @@ class DoubaoClient:
         Returns:
             base64编码的图片字符串
         """
-        try:
-            from PIL import Image
-            import io
-
-            # 获取图片扩展名以确定格式
-            ext = os.path.splitext(image_path)[1].lower()
-            mime_type = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.bmp': 'image/bmp'
-            }.get(ext, 'image/jpeg')
-
-            # 压缩图片
-            with Image.open(image_path) as img:
-                # 转换为RGB模式（如果需要）
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-
-                # 限制图片尺寸以提高处理速度
-                max_width = 1024
-                max_height = 1024
-
-                if img.width > max_width or img.height > max_height:
-                    # 计算缩放比例
-                    ratio = min(max_width / img.width, max_height / img.height)
-                    new_width = int(img.width * ratio)
-                    new_height = int(img.height * ratio)
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-                # 保存到内存
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=85)
-                buffer.seek(0)
-
-                # 编码为base64
-                encoded = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-            return f"data:{mime_type};base64,{encoded}"
+        return self.encode_images([image_path])[0]['url']
+
+    def _image_options(self, image_count: int = 1) -> EncodingOptions:
+        """按同一请求中的图片数量生成编码参数"""
+        image_count = max(1, image_count)
+        if not self.image_adaptive:
+            return EncodingOptions(max_size=self.IMAGE_MAX_SIZE, quality=self.IMAGE_JPEG_QUALITY)
+        return EncodingOptions(
+            max_size=self.IMAGE_MAX_SIZE,
+            quality=self.IMAGE_JPEG_QUALITY,
+            format=self.image_format,
+            adaptive=True,
+            image_count=image_count,
+            byte_budget=self.image_request_byte_budget // image_count,
+            high_detail=self.image_detail_high,
+        )
+
+    def _image_cache_key(self, digest: str, image_count: int = 1) -> str:
+        return encoding_cache_key(digest, self._image_options(image_count))
+
+    def preprocess_images(self, image_paths: List[str], image_hashes: List[str]) -> List[str]:
+        """
+        上传时在后台开始压缩图片，不等待结果
 
-        except Exception as e:
-            logger.error(f"编码图片失败: {e}")
-            # 如果PIL处理失败，使用原始方式
-            try:
-                with open(image_path, "rb") as image_file:
-                    encoded = base64.b64encode(image_file.read()).decode('utf-8')
-                    ext = os.path.splitext(image_path)[1].lower()
-                    mime_type = {
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.png': 'image/png',
-                        '.gif': 'image/gif',
-                        '.webp': 'image/webp',
-                        '.bmp': 'image/bmp'
-                    }.get(ext, 'image/jpeg')
-                    return f"data:{mime_type};base64,{encoded}"
-            except Exception as e2:
-                logger.error(f"备用编码方式也失败: {e2}")
-                raise
+        编码结果按各图片自身的 SHA-256 缓存；感知哈希由后台编码（encode_payload）一并算出，
+        编码完成后才登记到索引，只用于统计近似重复的上传（见 image_dedup.py），
+        不会让一张图片取用另一张图片的编码结果。上传请求本身不解码图片。
+
+        Args:
+            image_paths: 已保存的图片路径
+            image_hashes: 各图片原始字节的 SHA-256（上传时边写入边计算）
+
+        Returns:
+            图片哈希，记录到 session 中供 encode_images 使用
+        """
+        cache = self.image_cache or get_image_cache()
+        options = self._image_options(len(image_paths))
+        image_hashes = list(image_hashes)
+        for image_path, digest in zip(image_paths, image_hashes):
+            preprocess_in_background(
+                image_path, encoding_cache_key(digest, options), cache, options,
+                on_complete=lambda payload, digest=digest: self._record_near_duplicate(digest, payload.get('phash'))
+            )
+        return image_hashes
+
+    def _record_near_duplicate(self, digest: str, phash: str | None) -> None:
+        """按感知哈希查找近似图片并记录到索引统计和日志；新图片登记到索引中"""
+        if not phash:
+            return
+        index = self.phash_index or get_phash_index()
+        match = index.find(phash, digest)
+        if match is not None and match[0] != digest:
+            logger.info(f"Near-duplicate image {digest[:12]} ~ {match[0][:12]} (distance={match[1]})")
+        index.add(phash, digest)
+
+    def encode_images(self, images: List[Any], image_hashes: List[str] | None = None) -> List[Dict]:
+        """
+        批量压缩并编码图片，结果与输入顺序一致
+
+        压缩结果按原始字节的 SHA-256 缓存（见 image_cache.py），同一张图片重复编码时只需计算一次哈希；
+        未命中缓存的图片在进程池中并行压缩（见 image_processing.py）。
+        分辨率、质量和 detail 由自适应编码按图片内容和本次请求的图片数量决定。
+
+        内存中的图片（bytes、文件对象、data URL）不经过磁盘；其中已经符合尺寸和大小限制的 JPEG
+        原样发送，不再解码和重新编码。
+
+        Args:
+            images: 图片路径，或图片字节 / 文件对象 / data URL 字符串
+            image_hashes: 上传时 preprocess_images 返回的哈希（可选，仅用于图片路径）；提供时直接取用
+                预处理结果，不必重新读取和哈希文件
+
+        Returns:
+            编码结果列表：{"url": data URL, "detail": "low"|"high", ...}
+
+        Raises:
+            ValueError: data URL 不是合法的 base64
+            ImageValidationError: 图片无效、尺寸超限，或压缩失败且原图超过原样发送上限
+        """
+        cache = self.image_cache or get_image_cache()
+        options = self._image_options(len(images))
+        raws = [None] * len(images)
+        mime_types = [None] * len(images)
+
+        if image_hashes and len(image_hashes) == len(images):
+            digests = list(image_hashes)
+            keys = [encoding_cache_key(digest, options) for digest in image_hashes]
+            results = [load_cached_payload(cache.get(key)) for key in keys]
+            for index, key in enumerate(keys):
+                if results[index] is None:
+                    results[index] = wait_for_preprocessed(key, self.IMAGE_PREPROCESS_WAIT)
+        else:
+            keys = []
+            results = []
+            digests = []
+            for index, image in enumerate(images):
+                raws[index], mime_types[index], data_url = self._read_image(image)
+                probe_image(raws[index])
+                digests.append(content_hash(raws[index]))
+                keys.append(encoding_cache_key(digests[index], options))
+                result = None
+                if not self._is_path(image):
+                    result = passthrough_payload(raws[index], options, data_url)
+                results.append(result or load_cached_payload(cache.get(keys[index])))
+
+        # 同一请求中重复的图片只压缩一次
+        pending = {}
+        for index, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                pending.setdefault(key, index)
+
+        if pending:
+            indexes = list(pending.values())
+            for index in indexes:
+                if raws[index] is None:
+                    raws[index], mime_types[index], _ = self._read_image(images[index])
+            started = time.perf_counter()
+            encoded = compress_many([raws[i] for i in indexes], options=options)
+            failures = sum(isinstance(result, Exception) for result in encoded)
+            record_encode_batch(len(indexes), failures, time.perf_counter() - started)
+            by_key = {}
+            for index, result in zip(indexes, encoded):
+                if isinstance(result, Exception):
+                    logger.error(f"编码图片失败: {result}")
+                    # 压缩失败时只有较小的原图才原样发送
+                    size = len(raws[index])
+                    if isinstance(result, ImageValidationError) or size > self.image_raw_fallback_max_bytes:
+                        record_raw_fallback(size, sent=False)
+                        raise ImageValidationError(
+                            f'Image could not be processed ({size // 1024}KB, '
+                            f'raw fallback limit {self.image_raw_fallback_max_bytes // 1024}KB)'
+                        ) from result
+                    record_raw_fallback(size, sent=True)
+                    result = self._raw_payload(raws[index], mime_types[index])
+                else:
+                    cache.set(keys[index], json.dumps(result))
+                    if digests:
+                        # 登记到感知哈希索引，之后上传的近似图片计入统计
+                        self._record_near_duplicate(digests[index], result.get('phash'))
+                by_key[keys[index]] = result
+            results = [result if result is not None else by_key[key] for key, result in zip(keys, results)]
+
+        return results
+
+    @staticmethod
+    def _is_path(image: Any) -> bool:
+        return isinstance(image, os.PathLike) or (isinstance(image, str) and not image.startswith('data:'))
+
+    @classmethod
+    def _read_image(cls, image: Any) -> tuple:
+        """读取图片，返回 (原始字节, MIME 类型, 原始 data URL 或 None)"""
+        if cls._is_path(image):
+            with open(image, "rb") as image_file:
+                raw = image_file.read()
+            return raw, cls._mime_type_for_path(image), None
+        if isinstance(image, str):
+            header, _, encoded = image.partition(',')
+            raw = base64.b64decode(encoded)
+            mime_type = header[len('data:'):].split(';')[0] or 'image/jpeg'
+            return raw, mime_type, image
+        if hasattr(image, 'read'):
+            raw = image.read()
+        else:
+            raw = bytes(image)
+        return raw, cls._sniff_mime_type(raw), None
+
+    @staticmethod
+    def _mime_type_for_path(image_path: str) -> str:
+        ext = os.path.splitext(os.fspath(image_path))[1].lower()
+        return {
+            '.jpg': 'image/jpeg',
+            '.jpeg': 'image/jpeg',
+            '.png': 'image/png',
+            '.gif': 'image/gif',
+            '.webp': 'image/webp',
+            '.bmp': 'image/bmp'
+        }.get(ext, 'image/jpeg')
+
+    @staticmethod
+    def _sniff_mime_type(raw: bytes) -> str:
+        if raw.startswith(b'\x89PNG'):
+            return 'image/png'
+        if raw.startswith(b'GIF8'):
+            return 'image/gif'
+        if raw[:4] == b'RIFF' and raw[8:12] == b'WEBP':
+            return 'image/webp'
+        if raw.startswith(b'BM'):
+            return 'image/bmp'
+        return 'image/jpeg'
+
+    @staticmethod
+    def _raw_payload(raw: bytes, mime_type: str) -> Dict:
+        """不经压缩直接把原始字节编码为 data URL"""
+        return {
+            "url": f"data:{mime_type};base64,{base64.b64encode(raw).decode('utf-8')}",
+            "detail": "low",
+            "bytes": len(raw),
+            "format": "raw",
+        }
 
     def create_chat_message_with_image(
         self,
         text: str,
-        image_base64: str | List[str],
+        image_base64: str | Dict | List[str | Dict],
         subject: str,
         system_prompt: str = None
     ) -> List[Dict]:
@@ -133,7 +324,7 @@ class DoubaoClient:
 
         Args:
             text: 文本内容
-            image_base64: base64编码的图片
+            image_base64: base64编码的图片（data URL），或 encode_images 返回的编码结果（含 detail）
             subject: 学科（physics/chemistry）
 
         Returns:
@@ -143,15 +334,18 @@ class DoubaoClient:
         system_prompt = system_prompt or self._get_subject_prompt(subject)
 
         image_list = image_base64 if isinstance(image_base64, (list, tuple)) else [image_base64]
+        payloads = [
+            item if isinstance(item, dict) else {"url": item, "detail": "low", "format": "data_url"}
+            for item in image_list if item
+        ]
+        record_request_payload(payloads)
         content = []
-        for image_item in image_list:
-            if not image_item:
-                continue
+        for payload in payloads:
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": image_item,
-                    "detail": "low"  # ????????????????????????????????????
+                    "url": payload["url"],
+                    "detail": payload.get("detail", "low")
                 }
             })
         content.append({
@@ -192,7 +386,7 @@ class DoubaoClient:
     def solve_with_image(
         self,
         text: str,
-        image_path: str | List[str],
+        image_path: Any,
         subject: str,
         stream: bool = False,
         enable_search: bool = True,
@@ -203,7 +397,7 @@ class DoubaoClient:
 
         Args:
             text: 问题描述
-            image_path: 图片路径
+            image_path: 图片路径，或内存中的图片（bytes / 文件对象 / data URL），可以是列表
             subject: 学科（physics/chemistry）
             stream: 是否使用流式输出
             enable_search: 是否启用联网搜索
@@ -214,7 +408,7 @@ class DoubaoClient:
         try:
             # Encode image payloads
             image_paths = image_path if isinstance(image_path, (list, tuple)) else [image_path]
-            image_base64_list = [self.encode_image(path) for path in image_paths if path]
+            image_base64_list = self.encode_images([path for path in image_paths if path])
 
             # Build messages
             messages = self.create_chat_message_with_image(
@@ -291,12 +485,46 @@ class DoubaoClient:
                 logger.error(f"Doubao API retry failed: {e2}")
                 raise
 
+    def build_stream_messages(
+        self,
+        text: str,
+        image_paths: List[str] | None = None,
+        subject: str = "physics",
+        system_prompt: str = None,
+        image_hashes: List[str] | None = None
+    ) -> List[Dict]:
+        """
+        构建流式调用的消息列表（图片编码为阻塞操作，异步路径在线程池中调用）
+
+        Args 同 stream_with_reasoning
+
+        Returns:
+            list: chat.completions 的 messages
+        """
+        effective_system_prompt = system_prompt or self._get_subject_prompt(subject)
+
+        if image_paths:
+            path_list = image_paths if isinstance(image_paths, (list, tuple)) else [image_paths]
+            image_base64_list = self.encode_images([path for path in path_list if path], image_hashes)
+            return self.create_chat_message_with_image(
+                text if text else "请分析这张图片中的题目并解答",
+                image_base64_list,
+                subject,
+                system_prompt=effective_system_prompt
+            )
+        # 纯文本
+        return [
+            {"role": "system", "content": effective_system_prompt},
+            {"role": "user", "content": text}
+        ]
+
     def stream_with_reasoning(
         self,
         text: str,
         image_paths: List[str] | None = None,
         subject: str = "physics",
-        system_prompt: str = None
+        system_prompt: str = None,
+        image_hashes: List[str] | None = None
     ) -> Generator:
         """
         使用Chat API进行流式响应，包含深度思考过程（reasoning_content）
@@ -308,30 +536,13 @@ class DoubaoClient:
             text: 问题文本
             image_paths: 图片路径（可选）
             subject: 学科
+            image_hashes: 上传时预处理的图片哈希（可选，见 preprocess_images）
 
         Yields:
             dict: {"type": "thinking"|"answer"|"done", "content": str}
         """
         try:
-            effective_system_prompt = system_prompt or self._get_subject_prompt(subject)
-
-            # 构建消息
-            if image_paths:
-                # ??????
-                path_list = image_paths if isinstance(image_paths, (list, tuple)) else [image_paths]
-                image_base64_list = [self.encode_image(path) for path in path_list if path]
-                messages = self.create_chat_message_with_image(
-                    text if text else "请分析这张图片中的题目并解答",
-                    image_base64_list,
-                    subject,
-                    system_prompt=effective_system_prompt
-                )
-            else:
-                # 纯文本
-                messages = [
-                    {"role": "system", "content": effective_system_prompt},
-                    {"role": "user", "content": text}
-                ]
+            messages = self.build_stream_messages(text, image_paths, subject, system_prompt, image_hashes)
 
             # 使用Chat API流式调用（支持深度思考 reasoning_content）
             # 根据文档：豆包深度思考模型会自动返回 reasoning_content
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+图片编码缓存 - 按图片内容哈希缓存压缩后的 data URL
+
+同一张图片（原始字节相同）在深度思考的多个阶段、追问、以及学生重复上传时，
+只需计算一次 SHA-256 即可复用之前的缩放/JPEG 编码/base64 结果。
+
+两级缓存，均按字节数做 LRU 淘汰：
+- 内存：进程内，IMAGE_CACHE_MEMORY_MB，默认 64MB
+- 磁盘：IMAGE_CACHE_DIR（默认 ../data/image_cache），IMAGE_CACHE_DISK_MB，默认 512MB，设为 0 关闭
+
+缓存 key 由调用方决定，需包含原始字节哈希和编码参数（尺寸上限、质量等），参数变化时自然失效。
+"""
+
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,200}$')
+
+
+def content_hash(data):
+    """原始字节的 SHA-256（十六进制）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageEncodingCache:
+    """内存 + 磁盘两级 LRU 缓存，值为字符串（编码结果）"""
+
+    def __init__(self, memory_bytes=64 * 1024 * 1024, disk_dir=None, disk_bytes=512 * 1024 * 1024):
+        self.memory_bytes = int(memory_bytes)
+        self.disk_dir = disk_dir if disk_dir and disk_bytes > 0 else None
+        self.disk_bytes = int(disk_bytes)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> value
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> size，按最近使用排序
+        self._disk_size = 0
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.txt')
+
+    def _load_disk_index(self):
+        """启动时按修改时间重建磁盘 LRU 顺序"""
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if not entry.name.endswith('.txt'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return value
+            on_disk = self.disk_dir is not None and key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._disk_path(key), 'r', encoding='ascii') as f:
+                    value = f.read()
+                os.utime(self._disk_path(key))
+            except OSError:
+                value = None
+                with self._lock:
+                    self._disk_size -= self._disk.pop(key, 0)
+            if value:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._stats['disk_hits'] += 1
+                self._set_memory(key, value)
+                return value
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f'Invalid image cache key: {key!r}')
+        self._set_memory(key, value)
+        if self.disk_dir is None:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Image cache disk write failed: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._disk_size -= self._disk.pop(key, 0)
+            self._disk[key] = len(value)
+            self._disk_size += len(value)
+        self._evict_disk()
+
+    def _set_memory(self, key, value):
+        size = len(value)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = value
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+                self._stats['memory_evictions'] += 1
+
+    def _evict_disk(self):
+        victims = []
+        with self._lock:
+            while self._disk_size > self.disk_bytes and self._disk:
+                key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                self._stats['disk_evictions'] += 1
+                victims.append(key)
+        for key in victims:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['memory_entries'] = len(self._memory)
+            data['memory_bytes'] = self._memory_size
+            data['disk_entries'] = len(self._disk)
+            data['disk_bytes'] = self._disk_size
+        lookups = data['memory_hits'] + data['disk_hits'] + data['misses']
+        data['hit_rate'] = round((data['memory_hits'] + data['disk_hits']) / lookups, 4) if lookups else 0.0
+        return data
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """进程级共享的图片编码缓存（首次调用时按环境变量创建）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageEncodingCache(
+                    memory_bytes=float(os.getenv('IMAGE_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+                    disk_dir=os.getenv('IMAGE_CACHE_DIR', '../data/image_cache'),
+                    disk_bytes=float(os.getenv('IMAGE_CACHE_DISK_MB', 512)) * 1024 * 1024,
+                )
+    return _cache
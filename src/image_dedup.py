@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+图片近似去重 - 感知哈希（dHash）索引
+
+很多学生上传的是同一页教材、同一道考题的照片，拍摄角度、光线、压缩各不相同，
+原始字节的 SHA-256 无法匹配。这里对摆正后的图片计算 256 位 dHash，
+按 Hamming 距离查找已经处理过的近似图片，返回第一次出现时的 SHA-256 和距离。
+
+dHash 相近不代表内容相同（同一模板的两份试卷、只改了数字的题目距离可能很小），
+因此查找结果只用于统计和日志，图片编码缓存、回答缓存始终以上传内容的 SHA-256 为 key。
+
+查找使用分段索引：把哈希切成 max_distance + 1 段，距离不超过 max_distance 的两个哈希
+至少有一段完全相同（抽屉原理），只需比较共享某一段的候选。
+
+配置（环境变量）：
+- PHASH_INDEX_PATH: SQLite 文件路径，默认 ../data/phash_index.db；设为空字符串时只保存在内存中
+- PHASH_MAX_DISTANCE: 视为近似图片的最大 Hamming 距离（256 位中），默认 0（关闭近似匹配，只统计完全相同的图片）
+- PHASH_INDEX_MAX_ENTRIES: 内存中最多保存的条目数，默认 100000，超出后淘汰最早加入的条目
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 16  # 16x16 个相邻像素比较，共 256 位
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def perceptual_hash(img):
+    """
+    计算 dHash：灰度、自动对比度后缩小到 17x16，比较每行相邻像素的亮度
+
+    Args:
+        img: 已按 EXIF 方向摆正的 PIL 图片
+
+    Returns:
+        十六进制字符串（256 位，64 个字符）
+    """
+    from PIL import Image, ImageOps
+
+    gray = ImageOps.autocontrast(img.convert('L'))
+    gray = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f'{value:0{HASH_BITS // 4}x}'
+
+
+class PerceptualHashIndex:
+    """感知哈希 -> 第一次出现时 SHA-256 的索引，内存中查找，SQLite 持久化"""
+
+    def __init__(self, path=None, max_distance=0, max_entries=100000):
+        self.path = path or None
+        self.max_distance = int(max_distance)
+        self.max_entries = int(max_entries)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sha256 -> phash（int），按加入顺序
+        self._bands = {}  # (段序号, 段值) -> set(sha256)
+        self._band_slices = self._make_band_slices(self.max_distance)
+        self._stats = {'lookups': 0, 'exact_hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0}
+
+        self._conn = None
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS phashes ('
+                ' sha256 TEXT PRIMARY KEY,'
+                ' phash TEXT NOT NULL,'
+                ' created_at REAL NOT NULL)'
+            )
+            self._load()
+
+    @staticmethod
+    def _make_band_slices(max_distance):
+        bands = max(1, min(max_distance + 1, HASH_BITS))
+        width, extra = divmod(HASH_BITS, bands)
+        slices = []
+        start = 0
+        for band in range(bands):
+            size = width + (1 if band < extra else 0)
+            slices.append((start, (1 << size) - 1))
+            start += size
+        return slices
+
+    def _band_keys(self, value):
+        return [(band, (value >> shift) & mask) for band, (shift, mask) in enumerate(self._band_slices)]
+
+    def _load(self):
+        rows = self._conn.execute(
+            'SELECT sha256, phash FROM phashes ORDER BY created_at DESC LIMIT ?', (self.max_entries,)
+        ).fetchall()
+        with self._lock:
+            for sha256, phash in reversed(rows):
+                self._insert(sha256, int(phash, 16))
+        if rows:
+            logger.info(f"Perceptual hash index loaded ({len(rows)} entries)")
+
+    def _insert(self, sha256, value):
+        self._entries[sha256] = value
+        for band_key in self._band_keys(value):
+            self._bands.setdefault(band_key, set()).add(sha256)
+
+    def _remove(self, sha256):
+        value = self._entries.pop(sha256)
+        for band_key in self._band_keys(value):
+            members = self._bands.get(band_key)
+            if members is not None:
+                members.discard(sha256)
+                if not members:
+                    del self._bands[band_key]
+
+    def add(self, phash, sha256):
+        """登记图片；已存在的 sha256 不会被覆盖（保持第一次出现时的记录）"""
+        value = int(phash, 16)
+        evicted = []
+        with self._lock:
+            if sha256 in self._entries:
+                return
+            self._insert(sha256, value)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                evicted.append(oldest)
+                self._stats['evictions'] += 1
+        if self._conn is not None:
+            try:
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO phashes (sha256, phash, created_at) VALUES (?, ?, ?)',
+                    (sha256, phash, time.time())
+                )
+                if evicted:
+                    self._conn.executemany('DELETE FROM phashes WHERE sha256 = ?', [(key,) for key in evicted])
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist perceptual hash: {e}")
+
+    def find(self, phash, sha256=None):
+        """
+        查找近似图片
+
+        Args:
+            phash: 感知哈希
+            sha256: 图片自身的 SHA-256（可选）；已登记时直接返回自身
+
+        Returns:
+            (规范 sha256, Hamming 距离)；没有距离不超过 max_distance 的图片时返回 None
+        """
+        value = int(phash, 16)
+        with self._lock:
+            self._stats['lookups'] += 1
+            if sha256 is not None and sha256 in self._entries:
+                self._stats['exact_hits'] += 1
+                return sha256, 0
+            best = None
+            if self.max_distance > 0:
+                candidates = set()
+                for band_key in self._band_keys(value):
+                    candidates.update(self._bands.get(band_key, ()))
+                for candidate in candidates:
+                    distance = (self._entries[candidate] ^ value).bit_count()
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (candidate, distance)
+            self._stats['near_hits' if best else 'misses'] += 1
+            return best
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                max_distance=self.max_distance,
+                persistent=self._conn is not None,
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_phash_index():
+    """进程级共享的感知哈希索引（首次调用时按环境变量创建）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PerceptualHashIndex(
+                    path=os.getenv('PHASH_INDEX_PATH', '../data/phash_index.db'),
+                    max_distance=int(os.getenv('PHASH_MAX_DISTANCE', 0)),
+                    max_entries=int(os.getenv('PHASH_INDEX_MAX_ENTRIES', 100000)),
+                )
+    return _index
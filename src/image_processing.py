@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+图片预处理 - 在进程池中并行压缩图片
+
+Pillow 的解码/缩放/JPEG 编码是 CPU 密集操作，大部分时间持有 GIL，
+在请求线程中串行处理 9 张图片会直接推迟首个 token 的返回时间。
+这里把压缩放到进程池中并行执行，结果按输入顺序返回。
+
+配置（环境变量）：
+- IMAGE_WORKERS: 进程数，默认 CPU 核数；设为 0 时在调用线程中串行处理
+
+上传时可以通过 preprocess_in_background() 提前开始压缩，结果写入图片编码缓存，
+生成回答时 wait_for_preprocessed() 直接取用（仍在处理中则等待其完成）。
+
+自适应编码（EncodingOptions.adaptive）按图片内容和请求中的图片数量选择分辨率、质量和 detail，
+并把单张图片控制在字节预算内，减小上行请求体积和多图请求的视觉 token 数；
+record_request_payload() / get_payload_stats() 统计实际发送的图片数据量。
+"""
+
+import os
+import io
+import json
+import base64
+import atexit
+import logging
+import warnings
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+from image_dedup import perceptual_hash
+
+logger = logging.getLogger(__name__)
+
+# 压缩算法版本，参与缓存 key；压缩逻辑变化时递增，使旧缓存失效
+ENCODER_VERSION = 5
+
+# 自适应编码参数
+TEXT_DENSITY_THRESHOLD = 0.04  # 强边缘像素占比达到该值视为文字密集（题目、作业照片）
+DENSITY_SAMPLE_SIZE = 512  # 估计文字密度时使用的缩略图尺寸
+EDGE_THRESHOLD = 64
+MIN_TEXT_SIZE = 768  # 文字密集图片缩放下限，低于此 OCR 准确率明显下降
+MIN_PHOTO_SIZE = 512
+MIN_TEXT_QUALITY = 60
+MIN_PHOTO_QUALITY = 50
+PASSTHROUGH_MAX_BYTES = 512 * 1024  # 原样发送的 JPEG 大小上限
+
+# 图片校验：只解析文件头，不解码像素
+ALLOWED_FORMATS = frozenset({'JPEG', 'MPO', 'PNG', 'GIF', 'WEBP', 'BMP'})  # MPO 为部分手机拍摄的 JPEG
+MAX_IMAGE_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 64 * 1000 * 1000))
+MAX_IMAGE_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 16384))
+
+
+class ImageValidationError(ValueError):
+    """图片无法识别、格式不支持、尺寸超限（解压炸弹），或无法处理且不能原样发送"""
+
+
+def probe_image(source):
+    """
+    只解析文件头检查图片格式和尺寸，不解码像素，用于上传时快速拒绝无效图片和解压炸弹
+
+    Args:
+        source: 图片路径或原始字节
+
+    Returns:
+        {'format', 'width', 'height'}
+
+    Raises:
+        ImageValidationError
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(fp) as img:
+                image_format = img.format
+                width, height = img.size
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ImageValidationError('Image dimensions too large') from None
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError) as e:
+        raise ImageValidationError('Unrecognized or corrupt image') from e
+
+    if image_format not in ALLOWED_FORMATS:
+        raise ImageValidationError(f'Unsupported image format: {image_format}')
+    if width < 1 or height < 1 or width * height > MAX_IMAGE_PIXELS or max(width, height) > MAX_IMAGE_SIDE:
+        raise ImageValidationError(
+            f'Image dimensions too large ({width}x{height}, max {MAX_IMAGE_PIXELS // 1000000}MP)'
+        )
+    return {'format': image_format, 'width': width, 'height': height}
+
+
+@dataclass(frozen=True)
+class EncodingOptions:
+    """
+    图片编码参数
+
+    adaptive=False 时按 max_size/quality 固定编码（与旧版行为一致）；
+    adaptive=True 时 max_size/quality 为上限，实际分辨率、质量和 detail 由图片内容、
+    同一请求中的图片数量和单张字节预算决定（见 encode_payload）。
+    """
+    max_size: int = 1024
+    quality: int = 85
+    format: str = 'JPEG'  # JPEG / WEBP
+    adaptive: bool = False
+    image_count: int = 1
+    byte_budget: int = 0  # 单张图片编码后的字节上限，0 表示不限
+    high_detail: bool = False  # 文字密集的图片使用 detail=high，需显式开启
+
+    def cache_tag(self):
+        tag = f"{self.format.lower()}{self.max_size}q{self.quality}"
+        if self.adaptive:
+            tag += f"_a{self.image_count}b{self.byte_budget}"
+            if self.high_detail:
+                tag += "h"
+        return tag
+
+
+def encoding_cache_key(digest, options=None):
+    """图片编码缓存 key：原始字节哈希 + 编码参数"""
+    options = options or EncodingOptions()
+    return f"{digest}_v{ENCODER_VERSION}_{options.cache_tag()}"
+
+
+def webp_supported():
+    from PIL import features
+    return bool(features.check('webp'))
+
+
+def _fit_size(size, max_size):
+    """等比缩放到 max_size 以内后的尺寸；不需要缩小时返回 None"""
+    width, height = size
+    if width <= max_size and height <= max_size:
+        return None
+    ratio = min(max_size / width, max_size / height)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def text_density(img):
+    """
+    估计图片中文字/笔画的密集程度：缩略图上强边缘像素所占比例
+
+    作业和试卷照片通常在 0.05 以上，普通照片和简单示意图在 0.04 以下。
+    """
+    from PIL import ImageFilter
+
+    gray = img.convert('L')
+    gray.thumbnail((DENSITY_SAMPLE_SIZE, DENSITY_SAMPLE_SIZE))
+    histogram = gray.filter(ImageFilter.FIND_EDGES).histogram()
+    return sum(histogram[EDGE_THRESHOLD:]) / (gray.width * gray.height)
+
+
+def _adaptive_targets(density, options):
+    """根据文字密度和图片数量选择初始尺寸、质量下限和 detail
+
+    detail 默认为 low；只有 options.high_detail 开启时文字密集的图片才使用 high。
+    """
+    is_text = density >= TEXT_DENSITY_THRESHOLD
+    if is_text:
+        # 文字保持分辨率以保证识别，多图时适度缩小
+        size = options.max_size if options.image_count <= 3 else int(options.max_size * 0.85)
+        detail = 'high' if options.high_detail else 'low'
+        return max(size, min(MIN_TEXT_SIZE, options.max_size)), options.quality, MIN_TEXT_SIZE, MIN_TEXT_QUALITY, detail
+    # 照片、示意图不需要高分辨率，按图片数量进一步缩小
+    scale = 0.75 if options.image_count <= 3 else 0.6
+    size = max(int(options.max_size * scale), min(MIN_PHOTO_SIZE, options.max_size))
+    return size, max(options.quality - 10, MIN_PHOTO_QUALITY), MIN_PHOTO_SIZE, MIN_PHOTO_QUALITY, 'low'
+
+
+def _encode(img, size, quality, image_format):
+    from PIL import Image
+
+    target = _fit_size(img.size, size)
+    if target:
+        img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue(), img.size
+
+
+def encode_payload(raw, options=None):
+    """
+    把图片编码为发送给模型的 data URL（在子进程中执行，必须是模块级函数）
+
+    大尺寸照片的两处加速：
+    - JPEG 用 draft 模式在解码时直接按 1/2、1/4、1/8 缩小（DCT 域缩放），
+      不再完整解码 12-48MP 原图，CPU 时间和峰值内存都随之下降
+    - 缩放使用 reducing_gap：先按整数倍快速缩小，再做 LANCZOS 精细缩放
+
+    自适应模式下先估计文字密度：文字密集的图片保持分辨率（options.high_detail 开启时
+    使用 detail=high），照片和示意图降低分辨率和质量；其余情况均为 detail=low。
+    超出字节预算时先降质量、再缩小尺寸。
+
+    Args:
+        raw: 图片原始字节
+        options: EncodingOptions，默认 1024px / JPEG 85
+
+    Returns:
+        dict: {url, detail, bytes, width, height, quality, format, text_density, phash}
+    """
+    from PIL import Image, ImageOps
+
+    options = options or EncodingOptions()
+    image_format = 'WEBP' if options.format.upper() == 'WEBP' and webp_supported() else 'JPEG'
+
+    with Image.open(io.BytesIO(raw)) as img:
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise ImageValidationError(f'Image dimensions too large ({img.width}x{img.height})')
+
+        # draft 必须在解码前调用；目标尺寸按未经 EXIF 旋转的原始方向计算，与 draft 解码的方向一致
+        target = _fit_size(img.size, options.max_size)
+        if target and img.format == 'JPEG':
+            img.draft('RGB', target)
+
+        # 按 EXIF 方向信息摆正手机拍摄的照片
+        img = ImageOps.exif_transpose(img)
+
+        # 转换为RGB模式（如果需要）
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        phash = perceptual_hash(img)
+        density = None
+        detail = 'low'
+        size, quality = options.max_size, options.quality
+        if options.adaptive:
+            density = text_density(img)
+            size, quality, min_size, min_quality, detail = _adaptive_targets(density, options)
+
+        data, (width, height) = _encode(img, size, quality, image_format)
+        if options.adaptive and options.byte_budget:
+            while len(data) > options.byte_budget:
+                if quality > min_quality:
+                    quality = max(quality - 10, min_quality)
+                elif size > min_size:
+                    size = max(int(size * 0.85), min_size)
+                else:
+                    break
+                data, (width, height) = _encode(img, size, quality, image_format)
+
+    return {
+        'url': f"data:image/{image_format.lower()};base64,{base64.b64encode(data).decode('utf-8')}",
+        'detail': detail,
+        'bytes': len(data),
+        'width': width,
+        'height': height,
+        'quality': quality,
+        'format': image_format,
+        'text_density': None if density is None else round(density, 4),
+        'phash': phash,
+    }
+
+
+def encode_file_payload(path, options=None):
+    """从文件读取图片并编码（上传预处理时在子进程中读取，请求线程不持有图片内容）"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return encode_payload(raw, options)
+
+
+def passthrough_payload(raw, options=None, data_url=None):
+    """
+    图片已经是尺寸、字节数都在限制内的 JPEG 时原样发送，不再解码和重新编码
+
+    只解析文件头（自适应模式下另外以 draft 模式解码一张小灰度图估计文字密度）；
+    带 EXIF 旋转、CMYK 等需要处理的图片不适用。
+
+    Args:
+        raw: 图片原始字节
+        options: EncodingOptions
+        data_url: 客户端传来的原始 data URL（可选），原样发送时直接复用，省去再次 base64 编码
+
+    Returns:
+        与 encode_payload 相同格式的结果；不能原样发送时返回 None
+    """
+    from PIL import Image
+
+    options = options or EncodingOptions()
+    max_bytes = min(options.byte_budget or PASSTHROUGH_MAX_BYTES, PASSTHROUGH_MAX_BYTES)
+    if len(raw) > max_bytes or not raw.startswith(b'\xff\xd8\xff') or options.format.upper() != 'JPEG':
+        return None
+
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            if img.format != 'JPEG' or img.mode not in ('RGB', 'L'):
+                return None
+            if img.getexif().get(0x0112, 1) != 1:
+                return None
+            width, height = img.size
+            density = None
+            detail = 'low'
+            size_limit = options.max_size
+            if options.adaptive:
+                img.draft('L', (DENSITY_SAMPLE_SIZE, DENSITY_SAMPLE_SIZE))
+                density = text_density(img)
+                size_limit, _, _, _, detail = _adaptive_targets(density, options)
+    except Exception:
+        return None
+    if max(width, height) > size_limit:
+        return None
+
+    prefix = 'data:image/jpeg;base64,'
+    # 只有规范的 base64（无换行、空白）才能原样复用
+    if not (data_url and data_url.startswith(prefix) and len(data_url) - len(prefix) == 4 * ((len(raw) + 2) // 3)):
+        data_url = f"{prefix}{base64.b64encode(raw).decode('utf-8')}"
+    return {
+        'url': data_url,
+        'detail': detail,
+        'bytes': len(raw),
+        'width': width,
+        'height': height,
+        'quality': None,
+        'format': 'JPEG',
+        'text_density': None if density is None else round(density, 4),
+        'passthrough': True,
+    }
+
+
+def compress_to_data_url(raw, max_size=1024, quality=85):
+    """按固定尺寸上限和质量把图片压缩为 JPEG data URL"""
+    return encode_payload(raw, EncodingOptions(max_size=max_size, quality=quality))['url']
+
+
+_executor = None
+_background_threads = None  # IMAGE_WORKERS=0 时用于上传预处理的后台线程
+_executor_lock = threading.Lock()
+
+
+def get_image_executor():
+    """
+    进程级共享的图片处理进程池（首次调用时创建）；IMAGE_WORKERS=0 时返回 None
+
+    使用 spawn 方式创建子进程，避免在多线程的服务进程中 fork。
+    """
+    global _executor
+    workers = int(os.getenv('IMAGE_WORKERS', os.cpu_count() or 1))
+    if workers <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                logger.info(f"Image preprocessing pool started (workers={workers})")
+    return _executor
+
+
+def shutdown_image_executor():
+    global _executor, _background_threads
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+        if _background_threads is not None:
+            _background_threads.shutdown(wait=True, cancel_futures=True)
+            _background_threads = None
+
+
+atexit.register(shutdown_image_executor)
+
+
+def _call_or_error(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        return e
+
+
+def run_many(func, items, *args):
+    """
+    在图片进程池中对每个输入执行 func(item, *args)，按输入顺序返回结果列表
+
+    func 必须是模块级函数。单个输入失败时对应位置返回异常对象，由调用方决定如何降级。
+    只有一个输入时直接在当前线程处理，省去进程间传输的开销。
+    """
+    executor = get_image_executor() if len(items) > 1 else None
+    if executor is None:
+        return [_call_or_error(func, item, *args) for item in items]
+
+    try:
+        futures = [executor.submit(func, item, *args) for item in items]
+    except (BrokenProcessPool, RuntimeError):
+        logger.warning("Image preprocessing pool is unavailable; encoding in the request thread")
+        if executor is _executor:
+            shutdown_image_executor()
+        return [_call_or_error(func, item, *args) for item in items]
+
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append(future.result())
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，重建进程池，本次在当前线程处理
+            logger.warning("Image preprocessing pool is broken; recreating it")
+            if executor is _executor:
+                shutdown_image_executor()
+            results.append(_call_or_error(func, item, *args))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def compress_many(raws, max_size=1024, quality=85, options=None):
+    """
+    并行压缩多张图片，按输入顺序返回结果列表
+
+    未传 options 时返回 data URL 字符串；传入 EncodingOptions 时返回 encode_payload 的结果字典。
+    单张图片失败时对应位置返回异常对象。
+    """
+    if options:
+        return run_many(encode_payload, raws, options)
+    return run_many(compress_to_data_url, raws, max_size, quality)
+
+
+_pending = {}  # cache key -> Future
+_pending_lock = threading.Lock()
+
+
+def _background_executor():
+    global _background_threads
+    executor = get_image_executor()
+    if executor is not None:
+        return executor
+    with _executor_lock:
+        if _background_threads is None:
+            _background_threads = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-preprocess')
+        return _background_threads
+
+
+def preprocess_in_background(path, key, cache, options=None, on_complete=None):
+    """
+    在后台开始编码图片，完成后写入缓存；已缓存或正在处理中的图片不会重复提交
+
+    缓存值为 encode_payload 结果的 JSON（见 load_cached_payload）。
+
+    Args:
+        path: 已保存的图片路径
+        key: 缓存 key（encoding_cache_key 的返回值）
+        cache: 图片编码缓存（ImageEncodingCache）
+        options: EncodingOptions
+        on_complete: 编码成功后以结果字典调用（在后台线程中执行，异常只记录日志）
+    """
+    if cache.get(key) is not None:
+        return
+    with _pending_lock:
+        if key in _pending:
+            return
+        try:
+            future = _background_executor().submit(encode_file_payload, path, options)
+        except (BrokenProcessPool, RuntimeError) as e:
+            # 进程池不可用时放弃预处理，生成回答时会同步压缩
+            logger.warning(f"Image preprocessing not started: {e}")
+            return
+        _pending[key] = future
+
+    def _done(done_future):
+        try:
+            if not done_future.cancelled() and done_future.exception() is None:
+                cache.set(key, json.dumps(done_future.result()))
+                if on_complete is not None:
+                    on_complete(done_future.result())
+            elif not done_future.cancelled():
+                logger.warning(f"Background image preprocessing failed: {done_future.exception()}")
+        except Exception as e:
+            logger.warning(f"Background image preprocessing callback failed: {e}")
+        finally:
+            with _pending_lock:
+                _pending.pop(key, None)
+
+    future.add_done_callback(_done)
+
+
+def wait_for_preprocessed(key, timeout=None):
+    """等待后台编码结果（encode_payload 的返回值）；没有进行中的任务、失败或超时返回 None"""
+    with _pending_lock:
+        future = _pending.get(key)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        logger.warning(f"Timed out waiting for image preprocessing ({timeout}s)")
+    except Exception:
+        pass
+    return None
+
+
+def load_cached_payload(value):
+    """解析缓存中的编码结果；旧格式或损坏的值返回 None（按未命中处理）"""
+    if value is None:
+        return None
+    try:
+        payload = json.loads(value)
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) and 'url' in payload else None
+
+
+_payload_stats = {
+    'requests': 0,
+    'images': 0,
+    'bytes_sent': 0,  # data URL 字符数（即上行请求中图片部分的字节数）
+    'max_request_bytes': 0,
+    'detail_high': 0,
+    'detail_low': 0,
+    'formats': {},
+    # 压缩（缓存未命中时的慢路径）
+    'encoded': 0,
+    'encode_failures': 0,
+    'encode_seconds_total': 0.0,
+    'encode_seconds_max': 0.0,
+    # 压缩失败后原样发送原图
+    'raw_fallbacks': 0,
+    'raw_fallback_bytes': 0,
+    'raw_fallbacks_rejected': 0,
+}
+_payload_stats_lock = threading.Lock()
+
+
+def record_request_payload(payloads):
+    """记录一次请求发送给模型的图片数据量"""
+    if not payloads:
+        return
+    request_bytes = sum(len(payload['url']) for payload in payloads)
+    with _payload_stats_lock:
+        _payload_stats['requests'] += 1
+        _payload_stats['images'] += len(payloads)
+        _payload_stats['bytes_sent'] += request_bytes
+        _payload_stats['max_request_bytes'] = max(_payload_stats['max_request_bytes'], request_bytes)
+        for payload in payloads:
+            detail_key = 'detail_high' if payload.get('detail') == 'high' else 'detail_low'
+            _payload_stats[detail_key] += 1
+            image_format = payload.get('format', 'unknown')
+            _payload_stats['formats'][image_format] = _payload_stats['formats'].get(image_format, 0) + 1
+
+
+def record_encode_batch(images, failures, seconds):
+    """记录一批缓存未命中图片的压缩耗时"""
+    with _payload_stats_lock:
+        _payload_stats['encoded'] += images - failures
+        _payload_stats['encode_failures'] += failures
+        _payload_stats['encode_seconds_total'] += seconds
+        _payload_stats['encode_seconds_max'] = max(_payload_stats['encode_seconds_max'], seconds)
+
+
+def record_raw_fallback(size, sent):
+    """记录一次原图降级：sent=False 表示超过上限被拒绝"""
+    with _payload_stats_lock:
+        if sent:
+            _payload_stats['raw_fallbacks'] += 1
+            _payload_stats['raw_fallback_bytes'] += size
+        else:
+            _payload_stats['raw_fallbacks_rejected'] += 1
+
+
+def get_payload_stats():
+    with _payload_stats_lock:
+        stats = dict(_payload_stats, formats=dict(_payload_stats['formats']))
+    stats['avg_request_bytes'] = stats['bytes_sent'] // stats['requests'] if stats['requests'] else 0
+    stats['avg_image_bytes'] = stats['bytes_sent'] // stats['images'] if stats['images'] else 0
+    stats['encode_seconds_total'] = round(stats['encode_seconds_total'], 3)
+    stats['encode_seconds_max'] = round(stats['encode_seconds_max'], 3)
+    return stats
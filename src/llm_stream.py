@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+模型流式调用的执行协议 - 同一份 producer 代码既可在线程中（waitress）也可在事件循环中（ASGI）运行
+
+producer 是普通生成器，只描述要做什么，不直接做 I/O：
+- yield 事件字典：转发给客户端（SSE）
+- yield ChatStream(...)：执行一次 chat.completions 流式调用，增量作为事件转发，
+  producer 收到累积内容 {'thinking': ..., 'answer': ...}
+- yield Blocking(func, ...)：执行阻塞操作（数据库、session 存储、图片编码），producer 收到返回值
+- yield Sleep(seconds)：等待
+- yield Coalesce(key, factory, on_complete)：相同 key 的并发请求共享一次生成（见 single_flight.py），
+  producer 收到完整响应
+执行中的异常抛回 producer，producer 可以自行处理；producer 之间用 yield from 组合。
+
+drive() 在当前线程中用同步客户端执行；adrive() 在事件循环中用 AsyncOpenAI 执行，阻塞操作交给线程池，
+一个事件循环即可承载大量并发的长时间流式回答。
+EventStream 是 SSE 响应体：WSGI 服务器迭代它时同步执行，ASGI 入口（asgi.py）识别后改为异步执行。
+"""
+
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChatStream:
+    """一次 chat.completions 流式调用；thinking_type 为 None 时丢弃思考过程"""
+
+    __slots__ = ('provider', 'params', 'thinking_type', 'answer_type')
+
+    def __init__(self, provider, params, thinking_type='thinking', answer_type='answer'):
+        self.provider = provider
+        self.params = params
+        self.thinking_type = thinking_type
+        self.answer_type = answer_type
+
+
+class Blocking:
+    """阻塞操作：同步驱动直接调用，异步驱动在线程池中调用"""
+
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self):
+        return self.func(*self.args, **self.kwargs)
+
+
+class Sleep:
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Coalesce:
+    """合并相同 key 的并发生成；factory() 返回 producer，on_complete(events, response) 在生成成功后调用一次"""
+
+    __slots__ = ('key', 'factory', 'on_complete')
+
+    def __init__(self, key, factory, on_complete=None):
+        self.key = key
+        self.factory = factory
+        self.on_complete = on_complete
+
+
+def sse_event(event):
+    """把事件字典编码为一条 SSE 消息"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _chunk_events(chunk, call):
+    if not chunk.choices:
+        return []
+    delta = chunk.choices[0].delta
+    events = []
+    reasoning = getattr(delta, 'reasoning_content', None)
+    if reasoning and call.thinking_type:
+        events.append({'type': call.thinking_type, 'content': reasoning})
+    if getattr(delta, 'content', None):
+        events.append({'type': call.answer_type, 'content': delta.content})
+    return events
+
+
+def _accumulate(contents, event, call):
+    contents['answer' if event['type'] == call.answer_type else 'thinking'] += event['content']
+
+
+def stream_chat(client, call):
+    """同步执行 ChatStream，逐个产出事件；返回累积内容"""
+    contents = {'thinking': '', 'answer': ''}
+    stream = client.chat.completions.create(stream=True, **call.params)
+    with stream:
+        for chunk in stream:
+            for event in _chunk_events(chunk, call):
+                _accumulate(contents, event, call)
+                yield event
+    return contents
+
+
+async def astream_chat(client, call, emit):
+    """异步执行 ChatStream，事件交给 await emit(event)；返回累积内容"""
+    contents = {'thinking': '', 'answer': ''}
+    stream = await client.chat.completions.create(stream=True, **call.params)
+    async with stream:
+        async for chunk in stream:
+            for event in _chunk_events(chunk, call):
+                _accumulate(contents, event, call)
+                await emit(event)
+    return contents
+
+
+def drive(producer, resolve_client, flights=None):
+    """
+    在当前线程中执行 producer，逐个产出事件；返回 producer 的返回值
+
+    Args:
+        producer: producer 生成器
+        resolve_client: provider 名称 -> 同步 OpenAI 兼容客户端
+        flights: SingleFlight（可选）；None 时 Coalesce 直接在当前线程中执行
+    """
+    send, error = None, None
+    try:
+        while True:
+            try:
+                item = producer.throw(error) if error is not None else producer.send(send)
+            except StopIteration as stop:
+                return stop.value
+            send, error = None, None
+            if isinstance(item, dict):
+                yield item
+                continue
+            try:
+                if isinstance(item, ChatStream):
+                    send = yield from stream_chat(resolve_client(item.provider), item)
+                elif isinstance(item, Blocking):
+                    send = item()
+                elif isinstance(item, Sleep):
+                    time.sleep(item.seconds)
+                elif isinstance(item, Coalesce):
+                    send = yield from _coalesce(item, resolve_client, flights)
+                else:
+                    raise TypeError(f"Unsupported producer instruction: {item!r}")
+            except Exception as e:
+                error = e
+    finally:
+        producer.close()
+
+
+def _coalesce(item, resolve_client, flights):
+    if flights is not None:
+        return (yield from flights.subscribe(
+            item.key, lambda: drive(item.factory(), resolve_client), item.on_complete
+        ))
+    events = []
+    generator = drive(item.factory(), resolve_client)
+    while True:
+        try:
+            event = next(generator)
+        except StopIteration as stop:
+            response = stop.value
+            break
+        events.append(event)
+        yield event
+    if item.on_complete is not None:
+        item.on_complete(events, response)
+    return response
+
+
+async def adrive(producer, resolve_client, emit, flights=None):
+    """
+    在事件循环中执行 producer，事件交给 await emit(event)；返回 producer 的返回值
+
+    Args:
+        producer: producer 生成器
+        resolve_client: provider 名称 -> AsyncOpenAI 兼容客户端
+        emit: 协程函数，接收每个事件
+        flights: AsyncSingleFlight（可选）；None 时 Coalesce 直接执行
+    """
+    send, error = None, None
+    try:
+        while True:
+            try:
+                item = producer.throw(error) if error is not None else producer.send(send)
+            except StopIteration as stop:
+                return stop.value
+            send, error = None, None
+            if isinstance(item, dict):
+                await emit(item)
+                continue
+            try:
+                if isinstance(item, ChatStream):
+                    send = await astream_chat(resolve_client(item.provider), item, emit)
+                elif isinstance(item, Blocking):
+                    send = await asyncio.to_thread(item)
+                elif isinstance(item, Sleep):
+                    await asyncio.sleep(item.seconds)
+                elif isinstance(item, Coalesce):
+                    send = await _acoalesce(item, resolve_client, emit, flights)
+                else:
+                    raise TypeError(f"Unsupported producer instruction: {item!r}")
+            except Exception as e:
+                error = e
+    finally:
+        producer.close()
+
+
+async def _acoalesce(item, resolve_client, emit, flights):
+    if flights is not None:
+        return await flights.subscribe(
+            item.key, lambda flight_emit: adrive(item.factory(), resolve_client, flight_emit), emit,
+            item.on_complete
+        )
+    events = []
+
+    async def record(event):
+        events.append(event)
+        await emit(event)
+
+    response = await adrive(item.factory(), resolve_client, record)
+    if item.on_complete is not None:
+        item.on_complete(events, response)
+    return response
+
+
+class EventStream:
+    """
+    SSE 响应体（配合 Response(..., direct_passthrough=True) 使用）
+
+    WSGI 服务器迭代时用 resolve_client / flights 同步执行 producer；
+    asgi.py 识别到 EventStream 时改为在事件循环中执行 producer，不占用线程。
+    """
+
+    def __init__(self, producer, resolve_client, flights=None):
+        self.producer = producer
+        self.resolve_client = resolve_client
+        self.flights = flights
+        self._events = None
+
+    def __iter__(self):
+        self._events = drive(self.producer, self.resolve_client, self.flights)
+        for event in self._events:
+            yield sse_event(event).encode('utf-8')
+
+    def close(self):
+        """WSGI 服务器在响应结束或客户端断开时调用：关闭进行中的上游流和 producer"""
+        if self._events is not None:
+            self._events.close()
+        self.producer.close()
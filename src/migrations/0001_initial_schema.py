@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+初始结构：users / diaries / user_goals
+
+与旧版 init_database 创建的结构一致，可以在已有数据库上安全执行（作为基线）。
+"""
+
+from migrations import add_column_if_missing
+
+DESCRIPTION = 'users, diaries and user_goals tables'
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(255) DEFAULT NULL,
+            phone VARCHAR(20) DEFAULT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            physics_score INT DEFAULT NULL,
+            chemistry_score INT DEFAULT NULL,
+            personalization_enabled TINYINT(1) NOT NULL DEFAULT 1,
+            default_explain_level ENUM('auto','basic','standard','advanced') NOT NULL DEFAULT 'auto',
+            learning_profile_json JSON DEFAULT NULL,
+            learning_profile_updated_at TIMESTAMP NULL DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY unique_email (email),
+            UNIQUE KEY unique_phone (phone)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+
+    # 早期版本的 users 表缺少个性化字段
+    add_column_if_missing(cursor, 'users', 'personalization_enabled',
+                          "TINYINT(1) NOT NULL DEFAULT 1 AFTER chemistry_score")
+    add_column_if_missing(cursor, 'users', 'default_explain_level',
+                          "ENUM('auto','basic','standard','advanced') NOT NULL DEFAULT 'auto' AFTER personalization_enabled")
+    add_column_if_missing(cursor, 'users', 'learning_profile_json',
+                          "JSON DEFAULT NULL AFTER default_explain_level")
+    add_column_if_missing(cursor, 'users', 'learning_profile_updated_at',
+                          "TIMESTAMP NULL DEFAULT NULL AFTER learning_profile_json")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diaries (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            content TEXT NOT NULL,
+            ai_response TEXT DEFAULT NULL,
+            goal_analysis TEXT DEFAULT NULL COMMENT '目标进度分析',
+            mood_score INT DEFAULT NULL COMMENT '心情评分 1-5',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            INDEX idx_user_id (user_id),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+
+    add_column_if_missing(cursor, 'diaries', 'goal_analysis',
+                          "TEXT DEFAULT NULL COMMENT '目标进度分析' AFTER ai_response")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_goals (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title VARCHAR(255) NOT NULL COMMENT '目标标题',
+            description TEXT DEFAULT NULL COMMENT '目标描述',
+            status ENUM('active', 'completed', 'archived') DEFAULT 'active' COMMENT '状态',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            INDEX idx_user_status (user_id, status),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
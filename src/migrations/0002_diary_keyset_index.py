@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+日记列表游标分页 / 近期日记查询使用的复合索引
+
+get_user_diaries_by_cursor、get_user_diaries、get_recent_diaries 都按
+user_id 过滤并按 created_at 倒序，(user_id, created_at, id) 可以直接定位与排序。
+"""
+
+from migrations import create_index_if_missing
+
+DESCRIPTION = 'diaries (user_id, created_at, id) index for keyset pagination'
+
+
+def upgrade(cursor):
+    create_index_if_missing(cursor, 'diaries', 'idx_user_created_id', 'user_id, created_at, id')
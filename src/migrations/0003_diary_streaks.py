@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+日记打卡统计表
+
+由 create_diary / delete_diary 维护。已有用户的数据可以用
+scripts/backfill_diary_streaks.py 回填，未回填的用户会在第一次读取时自动补齐。
+"""
+
+DESCRIPTION = 'diary_streaks summary table'
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diary_streaks (
+            user_id INT PRIMARY KEY,
+            current_streak INT NOT NULL DEFAULT 0 COMMENT '截至 last_entry_date 的连续天数',
+            longest_streak INT NOT NULL DEFAULT 0 COMMENT '历史最长连续天数',
+            last_entry_date DATE DEFAULT NULL COMMENT '最近一次写日记的日期',
+            last_diary_id INT DEFAULT NULL COMMENT 'last_entry_date 当天最新的日记ID',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
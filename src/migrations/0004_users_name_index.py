@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""
+按用户名登录使用的索引
+
+login_user 对 name 列做单列探测，没有索引时每次登录都是全表扫描。
+"""
+
+from migrations import create_index_if_missing
+
+DESCRIPTION = 'users (name) index for login lookup'
+
+
+def upgrade(cursor):
+    create_index_if_missing(cursor, 'users', 'idx_users_name', 'name')
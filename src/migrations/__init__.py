@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+数据库结构迁移
+
+迁移文件放在本目录下，文件名以四位版本号开头（例如 0002_diary_keyset_index.py），
+每个文件提供 DESCRIPTION 和 upgrade(cursor)。已执行的版本记录在 schema_migrations 表中。
+
+- 启动时只做一次版本检查（check_schema_version）
+- 结构变更需显式执行：cd src && python -m migrations upgrade；
+  start.py（Docker 镜像的入口）在启动应用前执行这一步，失败时不启动应用
+- 生产入口（run_production.py / run_asgi.py）启动前调用 ensure_schema_current()，
+  结构版本落后时拒绝启动，而不是带着缺失的表运行
+"""
+
+import importlib
+import logging
+import os
+import pkgutil
+import re
+
+from mysql.connector import Error
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+_MIGRATION_NAME = re.compile(r'^(\d{4})_(\w+)$')
+_LOCK_NAME = 'schema_migrations'
+_LOCK_TIMEOUT = 60
+
+
+class SchemaOutdatedError(RuntimeError):
+    """数据库结构版本落后于代码中的最新迁移"""
+
+
+class Migration:
+    """一个迁移文件"""
+
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+
+    @property
+    def description(self):
+        return getattr(self.module, 'DESCRIPTION', self.name)
+
+    def upgrade(self, cursor):
+        self.module.upgrade(cursor)
+
+
+def discover_migrations():
+    """按版本号顺序返回本目录下的所有迁移"""
+    migrations = []
+    for info in pkgutil.iter_modules([os.path.dirname(__file__)]):
+        match = _MIGRATION_NAME.match(info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f'{__name__}.{info.name}')
+        migrations.append(Migration(int(match.group(1)), info.name, module))
+    migrations.sort(key=lambda m: m.version)
+
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+
+def latest_version():
+    migrations = discover_migrations()
+    return migrations[-1].version if migrations else 0
+
+
+# ==================== 迁移文件使用的工具函数 ====================
+
+def index_exists(cursor, table, index_name):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    ''', (table, index_name))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column_name):
+    cursor.execute('''
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    ''', (table, column_name))
+    return cursor.fetchone() is not None
+
+
+def create_index_if_missing(cursor, table, index_name, columns):
+    """为已有表补建索引；表是由旧版 init_database 创建时可能已经存在"""
+    if index_exists(cursor, table, index_name):
+        return False
+    cursor.execute(f'CREATE INDEX {index_name} ON {table} ({columns})')
+    logger.info(f"Created index {index_name} on {table}")
+    return True
+
+
+def add_column_if_missing(cursor, table, column_name, definition):
+    if column_exists(cursor, table, column_name):
+        return False
+    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column_name} {definition}')
+    logger.info(f"Added {column_name} column to {table} table")
+    return True
+
+
+# ==================== 版本表 ====================
+
+def _ensure_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    ''')
+
+
+def _current_version(cursor):
+    """读取当前版本；schema_migrations 不存在时返回 0"""
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_migrations')
+    except Error as e:
+        if getattr(e, 'errno', None) == 1146:  # ER_NO_SUCH_TABLE
+            return 0
+        raise
+    row = cursor.fetchone()
+    return (row[0] if row else None) or 0
+
+
+def get_current_version():
+    """
+    获取数据库当前结构版本（一次查询）
+
+    Returns:
+        int 版本号；连接失败时返回 None
+    """
+    connection = get_db_connection()
+    if not connection:
+        return None
+
+    try:
+        cursor = connection.cursor()
+        return _current_version(cursor)
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+
+def apply_migrations(target=None):
+    """
+    依次执行尚未应用的迁移
+
+    Args:
+        target: 目标版本，None 表示最新
+
+    Returns:
+        list: 本次执行的迁移版本号
+
+    Raises:
+        RuntimeError: 无法连接数据库或获取迁移锁
+    """
+    migrations = discover_migrations()
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError("Cannot apply migrations - no database connection")
+
+    applied = []
+    try:
+        cursor = connection.cursor()
+        # 多实例同时启动时只允许一个进程执行迁移
+        cursor.execute('SELECT GET_LOCK(%s, %s)', (_LOCK_NAME, _LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Could not acquire the schema migration lock")
+
+        try:
+            _ensure_version_table(cursor)
+            current = _current_version(cursor)
+            for migration in migrations:
+                if migration.version <= current:
+                    continue
+                if target is not None and migration.version > target:
+                    break
+                logger.info(f"Applying migration {migration.name}: {migration.description}")
+                migration.upgrade(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                    (migration.version, migration.name)
+                )
+                connection.commit()
+                applied.append(migration.version)
+        finally:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', (_LOCK_NAME,))
+            cursor.fetchone()
+
+        return applied
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+
+def check_schema_version(auto_migrate=False):
+    """
+    启动时检查结构版本：只执行一次 SELECT，不做任何 DDL
+
+    Args:
+        auto_migrate: 为 True 时自动执行未应用的迁移（开发环境使用）
+
+    Returns:
+        bool: 数据库结构是否为最新
+    """
+    current = get_current_version()
+    if current is None:
+        logger.error("Cannot check schema version - no database connection")
+        return False
+
+    latest = latest_version()
+    if current >= latest:
+        logger.info(f"Database schema is up to date (version {current})")
+        return True
+
+    if auto_migrate:
+        applied = apply_migrations()
+        logger.info(f"Applied migrations: {applied}")
+        return True
+
+    logger.warning(
+        f"Database schema version {current} is behind {latest}; "
+        f"run `cd src && python -m migrations upgrade`"
+    )
+    return False
+
+
+def ensure_schema_current(auto_migrate=False):
+    """
+    生产入口启动前调用：结构版本落后（且未开启自动迁移）时抛出 SchemaOutdatedError
+
+    无法连接数据库时只记录错误、不阻止启动（与 check_schema_version 相同）。
+
+    Raises:
+        SchemaOutdatedError: 数据库结构版本落后
+    """
+    current = get_current_version()
+    if current is None:
+        logger.error("Cannot check schema version - no database connection")
+        return
+    latest = latest_version()
+    if current >= latest:
+        return
+    if auto_migrate:
+        logger.info(f"Applied migrations: {apply_migrations()}")
+        return
+    raise SchemaOutdatedError(
+        f"Database schema version {current} is behind {latest}; "
+        f"run `cd src && python -m migrations upgrade` before starting the app"
+    )
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库迁移命令行
+
+用法（在 src 目录下）：
+    python -m migrations status            查看当前版本与待执行的迁移
+    python -m migrations upgrade           执行全部待执行的迁移
+    python -m migrations upgrade --to 3    迁移到指定版本
+"""
+
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与 app.py 相同的优先级：系统环境变量 > .env.production（生产环境）> .env
+if (os.getenv('FLASK_ENV') or '').lower() == 'production':
+    load_dotenv(os.path.join(SRC_DIR, '.env.production'))
+load_dotenv(os.path.join(SRC_DIR, '.env'))
+
+from migrations import apply_migrations, discover_migrations, get_current_version
+
+
+def cmd_status(_args):
+    current = get_current_version()
+    if current is None:
+        print("无法连接数据库")
+        return 1
+    print(f"当前版本: {current}")
+    for migration in discover_migrations():
+        mark = '✅' if migration.version <= current else '⏳'
+        print(f"  {mark} {migration.name} - {migration.description}")
+    return 0
+
+
+def cmd_upgrade(args):
+    applied = apply_migrations(target=args.to)
+    if applied:
+        print(f"已执行迁移: {', '.join(str(v) for v in applied)}")
+    else:
+        print("数据库结构已是最新")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m migrations', description='数据库结构迁移')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='查看迁移状态').set_defaults(func=cmd_status)
+    upgrade = sub.add_parser('upgrade', help='执行待执行的迁移')
+    upgrade.add_argument('--to', type=int, default=None, help='目标版本')
+    upgrade.set_defaults(func=cmd_upgrade)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
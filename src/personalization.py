@@ -25,6 +25,9 @@ LEVEL_VALUES = {LEVEL_AUTO, LEVEL_BASIC, LEVEL_STANDARD, LEVEL_ADVANCED}
 
 PACE_VALUES = {"slow", "medium", "fast"}
 
+# Bump whenever a prompt template below changes; cached answers are keyed on it.
+PROMPT_VERSION = 1
+
 
 def normalize_level(value: Optional[str]) -> str:
     if not value:
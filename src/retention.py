@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+数据保留 - 后台清理过期会话和上传图片
+
+后台线程每隔 RETENTION_INTERVAL 秒执行一轮清理：
+1. 调用会话存储的 purge_expired() 删除过期的 session 及其生成结果
+2. 删除上传目录中超过保留期的图片（内容寻址存储之前的平铺文件，以及残留的临时文件）；
+   只处理应用生成的文件名（见 UPLOAD_FILENAME），.gitkeep 或运维放入的其它文件不会被删除
+3. 调用 blob 存储的 collect_garbage() 删除所有引用均已过期的图片的本地副本
+   （远程对象由存储桶生命周期规则过期，见 blob_store.py）
+
+每轮按 RETENTION_BATCH_SIZE 分批处理，批次之间暂停 RETENTION_BATCH_PAUSE 秒，
+避免长时间占用磁盘 IO 而拖慢请求线程。
+
+平铺上传文件的引用关系：每次保存引用图片的 session 时调用 retain_uploads() 刷新图片的修改时间，
+保留期（RETENTION_UPLOAD_TTL）不短于 session 的过期时间，因此修改时间超过保留期的图片
+不会再被任何未过期的 session 引用。
+
+配置（环境变量）：
+- RETENTION_ENABLED: 是否启动后台清理，默认 true
+- RETENTION_INTERVAL: 两轮清理之间的间隔（秒），默认 600
+- RETENTION_BATCH_SIZE: 每批最多检查的条目数，默认 500
+- RETENTION_BATCH_PAUSE: 批次之间的暂停（秒），默认 0.05
+- RETENTION_UPLOAD_TTL: 上传图片最后一次被引用后的保留时间（秒），默认与 SESSION_TTL 相同
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 应用写入上传目录的文件名：{时间戳}_{序号}_{原文件名}（含接收中的 .part 文件，见 upload_ingest.py）
+# 和旧版 base64 接口的 temp_{时间戳}.{扩展名}；时间戳格式为 %Y%m%d_%H%M%S_%f
+UPLOAD_FILENAME = re.compile(r'^(?:\d{8}_\d{6}_\d{6}_\d+_[^/]*|temp_\d{8}_\d{6}_\d{6}\.\w+)$')
+
+
+def retain_uploads(filepaths):
+    """标记上传图片仍被引用（刷新修改时间），新 session 引用已有图片时调用"""
+    now = time.time()
+    for path in filepaths or []:
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            logger.warning(f"Referenced upload is missing: {path}")
+        except OSError as e:
+            logger.warning(f"Failed to retain upload {path}: {e}")
+
+
+class RetentionWorker:
+    """后台清理线程"""
+
+    def __init__(
+        self, store, upload_dir, upload_ttl, interval=600.0, batch_size=500, batch_pause=0.05, blob_store=None
+    ):
+        """
+        Args:
+            store: 会话存储（SessionStore）
+            upload_dir: 上传目录
+            upload_ttl: 上传图片最后一次被引用后的保留时间（秒），不会短于 session 的过期时间
+            interval: 两轮清理之间的间隔（秒）
+            batch_size: 每批最多检查的条目数
+            batch_pause: 批次之间的暂停（秒）
+            blob_store: 内容寻址的图片存储（BlobStore），可选
+        """
+        self.store = store
+        self.blob_store = blob_store
+        self.upload_dir = upload_dir
+        self.upload_ttl = max(float(upload_ttl), store.ttl)
+        self.interval = float(interval)
+        self.batch_size = max(1, int(batch_size))
+        self.batch_pause = float(batch_pause)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._upload_iter = None  # 跨批次保持目录扫描位置
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'errors': 0,
+            'sessions_removed': 0,
+            'session_bytes_reclaimed': 0,
+            'uploads_removed': 0,
+            'upload_bytes_reclaimed': 0,
+            'blobs_removed': 0,
+            'blob_bytes_reclaimed': 0,
+            'last_run_at': None,
+            'last_run_seconds': None,
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='retention-worker', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Retention worker started (interval={self.interval}s, batch_size={self.batch_size}, "
+            f"session_ttl={self.store.ttl}s, upload_ttl={self.upload_ttl}s)"
+        )
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention sweep failed")
+                self._add('errors', 1)
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        """执行一轮完整清理（分批进行）"""
+        started = time.monotonic()
+        self._sweep_sessions()
+        self._sweep_uploads()
+        self._sweep_blobs()
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run_at'] = datetime.now().isoformat(timespec='seconds')
+            self._stats['last_run_seconds'] = round(time.monotonic() - started, 3)
+
+    def _sweep_sessions(self):
+        while not self._stop.is_set():
+            result = self.store.purge_expired(self.batch_size)
+            self._add('sessions_removed', result['removed'])
+            self._add('session_bytes_reclaimed', result['bytes'])
+            if result['scanned'] < self.batch_size:
+                return
+            self._stop.wait(self.batch_pause)
+
+    def _sweep_blobs(self):
+        if self.blob_store is None:
+            return
+        while not self._stop.is_set():
+            result = self.blob_store.collect_garbage(self.batch_size)
+            self._add('blobs_removed', result['removed'])
+            self._add('blob_bytes_reclaimed', result['bytes'])
+            if result['scanned'] < self.batch_size:
+                return
+            self._stop.wait(self.batch_pause)
+
+    def _sweep_uploads(self):
+        if not os.path.isdir(self.upload_dir):
+            return
+        while not self._stop.is_set():
+            if self._sweep_uploads_batch() < self.batch_size:
+                return
+            self._stop.wait(self.batch_pause)
+
+    def _sweep_uploads_batch(self):
+        """检查最多 batch_size 个文件，返回实际检查的数量"""
+        cutoff = time.time() - self.upload_ttl
+        if self._upload_iter is None:
+            self._upload_iter = os.scandir(self.upload_dir)
+
+        scanned = 0
+        while scanned < self.batch_size:
+            entry = next(self._upload_iter, None)
+            if entry is None:
+                self._upload_iter.close()
+                self._upload_iter = None
+                break
+            scanned += 1
+            if not UPLOAD_FILENAME.match(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Failed to remove expired upload {entry.path}: {e}")
+                self._add('errors', 1)
+                continue
+            self._add('uploads_removed', 1)
+            self._add('upload_bytes_reclaimed', stat.st_size)
+        return scanned
+
+    def _add(self, name, value):
+        if value:
+            with self._lock:
+                self._stats[name] += value
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['enabled'] = True
+        data['interval'] = self.interval
+        data['batch_size'] = self.batch_size
+        data['session_ttl'] = self.store.ttl
+        data['upload_ttl'] = self.upload_ttl
+        return data
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_retention_worker(store, upload_dir, blob_store=None):
+    """按环境变量配置启动进程级唯一的清理线程；RETENTION_ENABLED=false 时不启动"""
+    global _worker
+    if os.getenv('RETENTION_ENABLED', 'true').lower() != 'true':
+        logger.info("Retention worker disabled (RETENTION_ENABLED=false)")
+        return None
+
+    with _worker_lock:
+        if _worker is None:
+            _worker = RetentionWorker(
+                store,
+                upload_dir,
+                upload_ttl=float(os.getenv('RETENTION_UPLOAD_TTL', store.ttl)),
+                interval=float(os.getenv('RETENTION_INTERVAL', 600)),
+                batch_size=int(os.getenv('RETENTION_BATCH_SIZE', 500)),
+                batch_pause=float(os.getenv('RETENTION_BATCH_PAUSE', 0.05)),
+                blob_store=blob_store,
+            )
+            _worker.start()
+    return _worker
+
+
+def get_retention_stats():
+    """清理线程统计信息（未启动时只返回 enabled=False）"""
+    if _worker is None:
+        return {'enabled': False}
+    return _worker.stats()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生产环境启动脚本（ASGI）
+使用uvicorn运行asgi.py：流式回答在事件循环中执行，大量并发SSE连接不再占满线程
+"""
+
+import os
+import sys
+from dotenv import load_dotenv
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# 加载环境变量
+load_dotenv('.env.production')
+
+# 导入ASGI应用（先于 app.py 导入，连接池按 ASGI 路径的默认大小创建）
+from asgi import application
+from app import start_background_workers
+from migrations import SchemaOutdatedError, ensure_schema_current
+
+if __name__ == '__main__':
+    if uvicorn is None:
+        sys.exit("uvicorn 未安装：pip install 'uvicorn>=0.23'（或继续使用 run_production.py）")
+
+    # 从环境变量获取配置
+    host = os.getenv('HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', 5000))
+
+    print(f"""
+    ========================================
+    言简意赅 - 生产环境启动（ASGI）
+    ========================================
+    服务器地址: http://{host}:{port}
+    环境模式: {os.getenv('FLASK_ENV', 'production')}
+    WSGI线程数: {os.getenv('ASGI_WSGI_THREADS', 32)}
+    AI连接数上限: {os.getenv('AI_MAX_CONNECTIONS')}
+    数据库连接池: {os.getenv('MYSQL_POOL_SIZE')}
+    ========================================
+    """)
+
+    # 数据库结构版本落后时拒绝启动（先执行 python -m migrations upgrade）
+    try:
+        ensure_schema_current(auto_migrate=os.getenv('DB_AUTO_MIGRATE', 'false').lower() == 'true')
+    except SchemaOutdatedError as e:
+        sys.exit(str(e))
+
+    # 启动后台清理等任务
+    start_background_workers()
+
+    # 单进程单事件循环（异步客户端和请求合并都绑定事件循环）
+    uvicorn.run(
+        application,
+        host=host,
+        port=port,
+        limit_concurrency=int(os.getenv('CONNECTION_LIMIT', 10000)),
+        timeout_keep_alive=int(os.getenv('KEEP_ALIVE_TIMEOUT', 5)),
+        proxy_headers=os.getenv('HTTPS', 'false').lower() == 'true',
+        log_level=os.getenv('LOG_LEVEL', 'info').lower(),
+    )
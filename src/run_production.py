@@ -14,7 +14,8 @@ from dotenv import load_dotenv
 load_dotenv('.env.production')
 
 # 导入Flask应用
-from app import app
+from app import app, start_background_workers
+from migrations import SchemaOutdatedError, ensure_schema_current
 
 if __name__ == '__main__':
     # 从环境变量获取配置
@@ -30,6 +31,15 @@ if __name__ == '__main__':
     ========================================
     """)
 
+    # 数据库结构版本落后时拒绝启动（先执行 python -m migrations upgrade）
+    try:
+        ensure_schema_current(auto_migrate=os.getenv('DB_AUTO_MIGRATE', 'false').lower() == 'true')
+    except SchemaOutdatedError as e:
+        sys.exit(str(e))
+
+    # 启动后台清理等任务
+    start_background_workers()
+
     # 使用Waitress WSGI服务器运行
     serve(
         app,
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+语义近似问题索引 - 回答缓存的第二级
+
+完全匹配（answer_cache.py）无法命中同一道题的不同说法、OCR/输入法造成的错字和标点差异。
+这里把问题文本表示为字符 n-gram（2~3 字）的稀疏向量（次线性词频，L2 归一化），
+在进程内倒排索引中计算余弦相似度，超过阈值即视为同一个问题，复用已缓存的回答。
+
+为避免"换了数字的同一类题"被误判为同一题，题目中出现的数字（按出现顺序）必须完全一致：
+数字序列和生成参数（scope：学科、语言、层级、教学阶段、提示词版本等）一起构成分区，
+只在同一分区内比较。向量本身不含数字。
+单个拉丁字母（物理量符号和单位，m/M、v/V、s/S 含义不同）同样区分大小写、按出现顺序进入分区；
+向量只对三个字母以上的单词忽略大小写。
+
+不依赖 numpy / 模型文件：倒排索引只比较至少共享一个 n-gram 的候选，
+每个分区通常只有几十到几百道题，纯 Python 即可在毫秒级完成查找。
+阈值的精确率/召回率权衡可用 tests/benchmarks/eval_semantic_cache.py 离线评估。
+"""
+
+import math
+import re
+import logging
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZES = (2, 3)
+
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+_NON_WORD = re.compile(r'[\W_]+')
+# 只保留两个拉丁字母之间的空格；中文、数字前后的空格只是输入习惯差异
+_LOOSE_SPACE = re.compile(r'(?<![a-zA-Z]) | (?![a-zA-Z])')
+_SYMBOL = re.compile(r'(?<![a-zA-Z])[a-zA-Z](?![a-zA-Z])')
+_LATIN_WORD = re.compile(r'[a-zA-Z]{3,}')
+
+
+def question_numbers(text):
+    """题目中的数字，按出现顺序；2、2.0、2.00 视为相同"""
+    numbers = []
+    for match in _NUMBER.findall(unicodedata.normalize('NFKC', text or '')):
+        value = match.rstrip('0').rstrip('.') if '.' in match else match
+        numbers.append(value.lstrip('0') or '0')
+    return tuple(numbers)
+
+
+def question_symbols(text):
+    """题目中的单字母符号（物理量、单位），按出现顺序，区分大小写"""
+    return tuple(_SYMBOL.findall(unicodedata.normalize('NFKC', text or '')))
+
+
+def question_vector(text):
+    """字符 n-gram 稀疏向量 {n-gram: 权重}，L2 归一化；数字统一替换为占位符，只有单词忽略大小写"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _LATIN_WORD.sub(lambda match: match.group().lower(), text)
+    text = _NUMBER.sub('#', text)
+    text = _LOOSE_SPACE.sub('', _NON_WORD.sub(' ', text).strip())
+    counts = Counter()
+    for size in NGRAM_SIZES:
+        for start in range(len(text) - size + 1):
+            counts[text[start:start + size]] += 1
+    vector = {gram: 1.0 + math.log(count) for gram, count in counts.items()}
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {gram: weight / norm for gram, weight in vector.items()} if norm else {}
+
+
+def cosine_similarity(a, b):
+    """两个已归一化稀疏向量的余弦相似度"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+class SemanticQuestionIndex:
+    """问题文本 -> 回答缓存 key 的近似索引；按分区倒排，超过 max_entries 淘汰最早加入的条目"""
+
+    def __init__(self, threshold=0.9, max_entries=20000):
+        self.threshold = float(threshold)
+        self.max_entries = int(max_entries)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cache key -> (分区, 向量)
+        self._postings = {}  # (分区, n-gram) -> {cache key: 权重}
+        self._partitions = Counter()
+        self._stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _remove(self, key):
+        partition, vector = self._entries.pop(key)
+        for gram in vector:
+            posting = self._postings.get((partition, gram))
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[(partition, gram)]
+        self._partitions[partition] -= 1
+        if not self._partitions[partition]:
+            del self._partitions[partition]
+
+    def add(self, scope, question, key):
+        """登记问题；scope 为生成参数摘要，只有 scope、数字序列和符号序列都相同的问题才会互相匹配"""
+        vector = question_vector(question)
+        if not vector:
+            return
+        partition = (scope, question_numbers(question), question_symbols(question))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (partition, vector)
+            self._partitions[partition] += 1
+            for gram, weight in vector.items():
+                self._postings.setdefault((partition, gram), {})[key] = weight
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def find(self, scope, question):
+        """
+        查找最相似的已登记问题
+
+        Returns:
+            (cache key, 相似度)；同分区内没有相似度不低于 threshold 的问题时返回 None
+        """
+        vector = question_vector(question)
+        partition = (scope, question_numbers(question), question_symbols(question))
+        with self._lock:
+            self._stats['lookups'] += 1
+            scores = Counter()
+            for gram, weight in vector.items():
+                for key, other in self._postings.get((partition, gram), {}).items():
+                    scores[key] += weight * other
+            best = scores.most_common(1)
+            if best and best[0][1] >= self.threshold:
+                self._stats['hits'] += 1
+                return best[0][0], round(min(best[0][1], 1.0), 4)
+            self._stats['misses'] += 1
+            return None
+
+    def discard(self, key):
+        """移除条目（对应的回答已过期或被淘汰）"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                partitions=len(self._partitions),
+                threshold=self.threshold,
+            )
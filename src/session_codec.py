@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+会话序列化 - session 数据的编码/解码
+
+SESSION_CODEC 环境变量选择编码格式：
+- auto: 安装了 orjson 时使用 orjson，否则使用标准库 json（默认）
+- json: 标准库 json，紧凑格式（无缩进、无多余空格）
+- orjson: orjson（需要安装 orjson）
+- msgpack: MessagePack 二进制格式（需要安装 msgpack）
+
+解码时按首字节自动识别 JSON 或 MessagePack，切换编码格式后旧数据仍可读取。
+"""
+
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 可选依赖
+    msgpack = None
+
+_JSON_WHITESPACE = b' \t\r\n'
+
+
+class JsonCodec:
+    """标准库 json，紧凑输出"""
+
+    name = 'json'
+    extension = '.json'
+
+    def encode(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonCodec:
+    """orjson，输出与 JsonCodec 兼容的 UTF-8 JSON"""
+
+    name = 'orjson'
+    extension = '.json'
+
+    def encode(self, data):
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MsgpackCodec:
+    """MessagePack 二进制格式"""
+
+    name = 'msgpack'
+    extension = '.msgpack'
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+
+def decode(payload):
+    """解码任意 codec 产生的数据（按首字节识别格式）"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    head = payload[:1]
+    if head in _JSON_WHITESPACE:
+        head = payload.lstrip(_JSON_WHITESPACE)[:1]
+
+    if head in (b'{', b'[', b'"'):
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+    if msgpack is None:
+        raise ValueError('Payload is not JSON and msgpack is not installed')
+    return msgpack.unpackb(payload, raw=False)
+
+
+def get_codec(name=None):
+    """按名称（默认读取 SESSION_CODEC）创建 codec"""
+    name = (name or os.getenv('SESSION_CODEC') or 'auto').strip().lower()
+    if name == 'auto':
+        return OrjsonCodec() if orjson is not None else JsonCodec()
+    if name == 'json':
+        return JsonCodec()
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('SESSION_CODEC=orjson requires the orjson package')
+        return OrjsonCodec()
+    if name == 'msgpack':
+        if msgpack is None:
+            raise ValueError('SESSION_CODEC=msgpack requires the msgpack package')
+        return MsgpackCodec()
+    raise ValueError(f'Unknown SESSION_CODEC: {name!r}')
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+会话存储 - 问答 session 及其生成结果的持久化
+
+app.py 中所有 session 读写都通过 get_session_store() 返回的存储对象完成，
+而不是直接读写 ../data/sessions/*.json，以便多实例部署共享同一存储，并对数据设置过期时间。
+
+后端（环境变量 SESSION_STORE）：
+- file: 每个 key 一个 JSON 文件（默认，兼容旧版文件）
+- sqlite: 单个 SQLite 数据库（WAL 模式），适合单机多进程
+- memory: 进程内 LRU，仅适合开发和测试
+- redis: Redis 协议服务器（REDIS_URL），适合多实例部署
+
+其他配置：
+- SESSION_TTL: 默认过期时间（秒），默认 7 天
+- SESSION_DIR: file 后端目录，默认 ../data/sessions
+- SESSION_SQLITE_PATH: sqlite 后端文件，默认 ../data/sessions.db
+- SESSION_MEMORY_MAX_ENTRIES: memory 后端最大条目数，默认 10000
+- REDIS_URL: redis://[:password@]host[:port][/db]，默认 redis://localhost:6379/0
+- SESSION_REDIS_PREFIX: redis key 前缀，默认 session:
+- SESSION_CODEC: 序列化格式，见 session_codec.py
+"""
+
+import os
+import re
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlsplit, unquote
+
+from session_codec import decode, get_codec
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 7 * 24 * 3600
+
+# session id 由时间戳生成，结果 key 为 "{session_id}_response"
+_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+def is_valid_key(key):
+    return isinstance(key, str) and bool(_KEY_PATTERN.match(key))
+
+
+def response_key(session_id):
+    """session 生成结果对应的 key"""
+    return f'{session_id}_response'
+
+
+class SessionStore:
+    """
+    会话存储接口
+
+    - load(key) 返回 dict，不存在、已过期或 key 非法时返回 None
+    - save(key, data, ttl=None) 覆盖写入，ttl 为空时使用存储的默认过期时间
+    - delete(key) 删除，不存在时静默
+    - purge_expired(limit=None) 清理最多 limit 条已过期数据，返回 {'removed', 'bytes', 'scanned'}；
+      自带过期机制的后端不需要清理
+    """
+
+    backend = 'base'
+
+    def __init__(self, ttl=DEFAULT_TTL, codec=None):
+        self.ttl = float(ttl)
+        self.codec = codec or get_codec()
+        self._lock = threading.Lock()
+        self._stats = {'loads': 0, 'hits': 0, 'saves': 0, 'deletes': 0, 'errors': 0}
+
+    def load(self, key):
+        if not is_valid_key(key):
+            return None
+        try:
+            data = self._load(key)
+        except Exception:
+            self._count('errors')
+            raise
+        self._count('loads')
+        if data is not None:
+            self._count('hits')
+        return data
+
+    def save(self, key, data, ttl=None):
+        if not is_valid_key(key):
+            raise ValueError(f'Invalid session key: {key!r}')
+        ttl = self.ttl if ttl is None else float(ttl)
+        try:
+            self._save(key, data, ttl)
+        except Exception:
+            self._count('errors')
+            raise
+        self._count('saves')
+
+    def delete(self, key):
+        if not is_valid_key(key):
+            return
+        self._delete(key)
+        self._count('deletes')
+
+    def purge_expired(self, limit=None):
+        return {'removed': 0, 'bytes': 0, 'scanned': 0}
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['backend'] = self.backend
+        data['codec'] = self.codec.name
+        data['ttl'] = self.ttl
+        return data
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def _save(self, key, data, ttl):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    """
+    每个 key 一个文件，内容为 {"v": 1, "expires_at": ..., "data": {...}}
+
+    写入先落到同目录的临时文件再 os.replace() 到目标路径，并发读取方不会读到写了一半的文件。
+    """
+
+    backend = 'file'
+    _EXTENSIONS = ('.json', '.msgpack')
+    _STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, codec=None):
+        super().__init__(ttl, codec)
+        self.directory = directory
+        self._purge_iter = None  # 跨批次保持目录扫描位置
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, extension=None):
+        return os.path.join(self.directory, key + (extension or self.codec.extension))
+
+    def _read(self, path):
+        """读取并解析文件，返回 (data, expires_at, size)；文件不存在时返回 None"""
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        try:
+            raw = decode(payload)
+        except ValueError:
+            logger.warning(f"Corrupt session file ignored: {path}")
+            return None
+
+        if isinstance(raw, dict) and raw.get('v') == 1 and 'data' in raw:
+            return raw['data'], raw.get('expires_at'), stat.st_size
+        # 旧版文件直接保存 session 数据，按修改时间计算过期
+        return raw, stat.st_mtime + self.ttl, stat.st_size
+
+    def _load(self, key):
+        # 先找当前 codec 的扩展名，切换 codec 后仍能读到旧格式的文件
+        extensions = sorted(self._EXTENSIONS, key=lambda ext: ext != self.codec.extension)
+        for extension in extensions:
+            path = self._path(key, extension)
+            result = self._read(path)
+            if result is None:
+                continue
+            data, expires_at, _ = result
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(path)
+                return None
+            return data
+        return None
+
+    def _save(self, key, data, ttl):
+        payload = self.codec.encode({'v': 1, 'expires_at': time.time() + ttl, 'data': data})
+        tmp_path = os.path.join(self.directory, f'.{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    def _delete(self, key):
+        for extension in self._EXTENSIONS:
+            self._remove(self._path(key, extension))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self, limit=None):
+        """
+        增量清理：每次最多检查 limit 个文件，下次调用从上次停止的位置继续，
+        扫描到目录末尾后下一次调用重新开始。写入中断遗留的临时文件一并清理。
+        """
+        result = {'removed': 0, 'bytes': 0, 'scanned': 0}
+        now = time.time()
+        if self._purge_iter is None:
+            self._purge_iter = os.scandir(self.directory)
+
+        while limit is None or result['scanned'] < limit:
+            entry = next(self._purge_iter, None)
+            if entry is None:
+                self._purge_iter.close()
+                self._purge_iter = None
+                break
+
+            if entry.name.endswith('.tmp'):
+                result['scanned'] += 1
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime + self._STALE_TEMP_SECONDS <= now:
+                    self._remove(entry.path)
+                    result['removed'] += 1
+                    result['bytes'] += stat.st_size
+                continue
+
+            if not entry.name.endswith(self._EXTENSIONS):
+                continue
+            result['scanned'] += 1
+            read = self._read(entry.path)
+            if read is None:
+                continue
+            _, expires_at, size = read
+            if expires_at is not None and expires_at <= now:
+                self._remove(entry.path)
+                result['removed'] += 1
+                result['bytes'] += size
+        return result
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite（WAL）存储，每个线程持有独立连接"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path, ttl=DEFAULT_TTL, codec=None):
+        super().__init__(ttl, codec)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' key TEXT PRIMARY KEY,'
+            ' value BLOB NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _load(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM sessions WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        return decode(row[0]) if row else None
+
+    def _save(self, key, data, ttl):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO sessions (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, self.codec.encode(data), time.time() + ttl)
+        )
+
+    def _delete(self, key):
+        self._conn().execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def purge_expired(self, limit=None):
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT key, LENGTH(CAST(value AS BLOB)) FROM sessions WHERE expires_at <= ? LIMIT ?',
+            (time.time(), -1 if limit is None else int(limit))
+        ).fetchall()
+        if rows:
+            conn.executemany('DELETE FROM sessions WHERE key = ?', [(key,) for key, _ in rows])
+        return {
+            'removed': len(rows),
+            'bytes': sum(size or 0 for _, size in rows),
+            'scanned': len(rows),
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class MemorySessionStore(SessionStore):
+    """进程内 LRU 存储（多进程/多实例之间不共享）"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries=10000, ttl=DEFAULT_TTL, codec=None):
+        super().__init__(ttl, codec)
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def _load(self, key):
+        value = self._cache.get(key)
+        return decode(value) if value is not None else None
+
+    def _save(self, key, data, ttl):
+        # 保存序列化后的副本，避免调用方修改已保存的数据
+        self._cache.set(key, self.codec.encode(data), ttl=ttl)
+
+    def _delete(self, key):
+        self._cache.invalidate(key)
+
+    def purge_expired(self, limit=None):
+        removed = self._cache.purge_expired(limit)
+        return {'removed': removed, 'bytes': 0, 'scanned': removed}
+
+    def stats(self):
+        data = super().stats()
+        data['entries'] = len(self._cache)
+        return data
+
+
+class RedisError(Exception):
+    """Redis 服务器返回的错误回复"""
+
+
+class _RedisConnection:
+    """最小化的 RESP 协议客户端，仅支持本模块用到的命令"""
+
+    def __init__(self, host, port, db=0, password=None, timeout=5.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    def execute(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('ascii')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by Redis server')
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b'+':
+            return body.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(body.decode('utf-8', 'replace'))
+        if prefix == b':':
+            return int(body)
+        if prefix == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError('Connection closed by Redis server')
+            return data[:-2]
+        if prefix == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f'Unexpected Redis reply: {line!r}')
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class RedisSessionStore(SessionStore):
+    """Redis 存储，过期由服务器通过 SET ... EX 负责"""
+
+    backend = 'redis'
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=DEFAULT_TTL, prefix='session:', timeout=5.0, codec=None):
+        super().__init__(ttl, codec)
+        parts = urlsplit(url)
+        if parts.scheme != 'redis':
+            raise ValueError(f'Unsupported Redis URL scheme: {parts.scheme!r}')
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.db = int(parts.path.lstrip('/') or 0)
+        self.password = unquote(parts.password) if parts.password else None
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _execute(self, *args):
+        """执行命令；连接断开时重建连接并重试一次"""
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = _RedisConnection(self.host, self.port, self.db, self.password, self.timeout)
+                self._local.conn = conn
+            try:
+                return conn.execute(*args)
+            except (OSError, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def _load(self, key):
+        value = self._execute('GET', self.prefix + key)
+        return decode(value) if value is not None else None
+
+    def _save(self, key, data, ttl):
+        self._execute(
+            'SET', self.prefix + key, self.codec.encode(data),
+            'EX', max(1, int(ttl))
+        )
+
+    def _delete(self, key):
+        self._execute('DEL', self.prefix + key)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_session_store(backend=None):
+    """根据环境变量创建会话存储"""
+    backend = (backend or os.getenv('SESSION_STORE') or 'file').strip().lower()
+    ttl = float(os.getenv('SESSION_TTL', DEFAULT_TTL))
+
+    if backend == 'file':
+        return FileSessionStore(os.getenv('SESSION_DIR', '../data/sessions'), ttl=ttl)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_SQLITE_PATH', '../data/sessions.db'), ttl=ttl)
+    if backend == 'memory':
+        return MemorySessionStore(int(os.getenv('SESSION_MEMORY_MAX_ENTRIES', 10000)), ttl=ttl)
+    if backend == 'redis':
+        return RedisSessionStore(
+            os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            ttl=ttl,
+            prefix=os.getenv('SESSION_REDIS_PREFIX', 'session:'),
+        )
+    raise ValueError(f'Unknown SESSION_STORE backend: {backend!r}')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """获取进程级共享的会话存储（首次调用时创建）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_session_store()
+                logger.info(f"Session store initialized (backend={_store.backend})")
+    return _store
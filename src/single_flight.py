@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight - 合并并发的相同模型请求
+
+全班布置同一道题时，几十个学生会在几秒内用相同的问题打开 /api/stream/<id>，
+回答缓存（answer_cache.py）只有在第一份回答完整生成后才能命中，在此之前每个请求都会各自调用一次上游。
+这里按回答缓存 key 合并正在进行的生成：第一个请求在后台线程中运行上游流式调用，
+事件追加到共享的事件日志；同一 key 的所有 SSE 客户端（包括第一个）都从日志读取，
+中途加入的客户端先一次性收到已生成的前缀，再继续实时接收后续增量。
+
+生成在后台线程中进行，与发起请求的客户端解耦：客户端断开后生成继续完成，结果写入回答缓存。
+ASGI 入口（asgi.py）使用 AsyncSingleFlight：生成作为事件循环中的独立任务运行，语义相同。
+
+配置（环境变量）：
+- SINGLE_FLIGHT_ENABLED: 是否启用，默认 true
+- SINGLE_FLIGHT_WAIT_TIMEOUT: 等待上游下一个事件的最长时间（秒），默认 300，超时该客户端报错
+"""
+
+import os
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次进行中的生成：事件日志 + 完成状态"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.response = None
+        self.error = None
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """按 key 合并并发生成，事件扇出给所有订阅者"""
+
+    def __init__(self, wait_timeout=300.0):
+        self.wait_timeout = float(wait_timeout)
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {'flights': 0, 'coalesced': 0, 'late_joins': 0, 'errors': 0}
+
+    def subscribe(self, key, producer, on_complete=None):
+        """
+        订阅 key 对应的生成；没有进行中的生成时在后台线程中启动 producer
+
+        Args:
+            key: 合并依据（相同 key 视为相同请求）
+            producer: 无参函数，返回事件生成器，生成器的返回值为完整响应
+            on_complete: 生成成功后调用一次 on_complete(events, response)（如写入回答缓存）
+
+        Returns:
+            事件生成器，返回值为完整响应；上游出错时在所有订阅者中抛出同一个异常
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats['flights'] += 1
+            else:
+                self._stats['coalesced'] += 1
+                if flight.events:
+                    self._stats['late_joins'] += 1
+        if leader:
+            threading.Thread(
+                target=self._run, args=(key, flight, producer, on_complete),
+                name='single-flight', daemon=True
+            ).start()
+        return self._follow(flight)
+
+    def _run(self, key, flight, producer, on_complete):
+        response, error = None, None
+        try:
+            generator = producer()
+            while True:
+                try:
+                    event = next(generator)
+                except StopIteration as stop:
+                    response = stop.value or {}
+                    break
+                with flight.cond:
+                    flight.events.append(event)
+                    flight.cond.notify_all()
+            if on_complete is not None:
+                try:
+                    on_complete(list(flight.events), response)
+                except Exception:
+                    logger.exception("Single-flight completion callback failed")
+        except Exception as e:
+            error = e
+            with self._lock:
+                self._stats['errors'] += 1
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.response, flight.error, flight.done = response, error, True
+                flight.cond.notify_all()
+
+    def _follow(self, flight):
+        index = 0
+        while True:
+            with flight.cond:
+                while index >= len(flight.events) and not flight.done:
+                    if not flight.cond.wait(self.wait_timeout):
+                        raise TimeoutError(f"No upstream event within {self.wait_timeout:.0f}s")
+                pending = flight.events[index:]
+                done = flight.done
+            index += len(pending)
+            yield from pending
+            if done:
+                break
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.response = None
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的事件循环版本（只在一个事件循环中使用）"""
+
+    def __init__(self, wait_timeout=300.0):
+        self.wait_timeout = float(wait_timeout)
+        self._flights = {}
+        self._tasks = set()
+        self._stats = {'flights': 0, 'coalesced': 0, 'late_joins': 0, 'errors': 0}
+
+    async def subscribe(self, key, run, emit, on_complete=None):
+        """
+        订阅 key 对应的生成；没有进行中的生成时以独立任务启动 run
+
+        Args:
+            key: 合并依据
+            run: 协程函数 run(emit)，把事件交给 emit 并返回完整响应
+            emit: 协程函数，接收本订阅者的每个事件（订阅者取消不影响生成任务）
+            on_complete: 生成成功后调用一次 on_complete(events, response)
+
+        Returns:
+            完整响应；上游出错时在所有订阅者中抛出同一个异常
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            self._stats['flights'] += 1
+            task = asyncio.ensure_future(self._run(key, flight, run, on_complete))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._stats['coalesced'] += 1
+            if flight.events:
+                self._stats['late_joins'] += 1
+
+        index = 0
+        while True:
+            while index < len(flight.events):
+                event = flight.events[index]
+                index += 1
+                await emit(event)
+            if flight.done:
+                break
+            try:
+                await asyncio.wait_for(flight.changed.wait(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No upstream event within {self.wait_timeout:.0f}s") from None
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    async def _run(self, key, flight, run, on_complete):
+        async def append(event):
+            flight.events.append(event)
+            flight.notify()
+
+        try:
+            flight.response = (await run(append)) or {}
+            if on_complete is not None:
+                try:
+                    on_complete(list(flight.events), flight.response)
+                except Exception:
+                    logger.exception("Single-flight completion callback failed")
+        except Exception as e:
+            flight.error = e
+            self._stats['errors'] += 1
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            flight.notify()
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._flights))
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """进程级共享的 single-flight；SINGLE_FLIGHT_ENABLED=false 时返回 None"""
+    global _single_flight
+    if os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() != 'true':
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(wait_timeout=float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', 300)))
+    return _single_flight
+
+
+def create_async_single_flight():
+    """为 ASGI 事件循环创建 AsyncSingleFlight；SINGLE_FLIGHT_ENABLED=false 时返回 None"""
+    if os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() != 'true':
+        return None
+    return AsyncSingleFlight(wait_timeout=float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', 300)))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+进程内 TTL + LRU 缓存
+
+线程安全；超过 max_entries 时淘汰最久未使用的条目，条目超过 ttl 秒后视为过期。
+
+读穿（read-through）回填：读数据源之前取 generation()，回填时传给 set(generation=...)；
+期间发生过 invalidate() 时放弃回填，避免在写入方失效之后把读到的旧数据写回缓存。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """带过期时间和容量上限的 LRU 缓存，附带命中率统计"""
+
+    def __init__(self, max_entries=1024, ttl=300.0):
+        """
+        Args:
+            max_entries: 最大条目数，<= 0 表示禁用缓存
+            ttl: 过期时间（秒）
+        """
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._generation = 0  # 每次 invalidate() 递增
+        self._stale_sets = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._data[key]
+            self._misses += 1
+            return default
+
+    def generation(self):
+        """当前失效代数；与 set(generation=...) 配合使用"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, generation=None):
+        """
+        写入条目
+
+        generation 为读数据源之前取得的 generation()；之后发生过失效时不写入（返回 False）。
+        """
+        if self.max_entries <= 0:
+            return False
+        expires_at = time.monotonic() + (self.ttl if ttl is None else float(ttl))
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._stale_sets += 1
+                return False
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._evictions += 1
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self._invalidations += 1
+
+    def purge_expired(self, limit=None):
+        """删除最多 limit 个已过期条目，返回删除数量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+            if limit is not None:
+                expired = expired[:limit]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'stale_sets': self._stale_sets,
+            }
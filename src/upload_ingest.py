@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+上传接收 - 流式解析 multipart/form-data
+
+直接从请求体按块读取（不经过 request.files），每块边计算 SHA-256 边写入磁盘，
+单个请求占用的内存只有一个读取块加上表单文本字段，与图片大小无关。
+读取过程中即检查文件数量、扩展名、单文件大小和请求总大小，超限立即停止读取并删除已写入的文件。
+
+注意：调用前不能访问 request.form / request.files，否则 Flask 会先完整解析请求体。
+"""
+
+import os
+import hashlib
+import logging
+from dataclasses import dataclass
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """上传不符合限制；status 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@dataclass(frozen=True)
+class IngestedFile:
+    field_name: str
+    original_filename: str
+    filename: str  # 保存到上传目录中的文件名
+    path: str
+    size: int
+    sha256: str
+
+
+class _PartialFile:
+    """正在写入的上传文件：先写到 .part 临时文件，完整接收后再改名"""
+
+    def __init__(self, path, original_filename):
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.original_filename = original_filename
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.file = open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        self.hasher.update(data)
+        self.file.write(data)
+
+    def finish(self, field_name):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        return IngestedFile(
+            field_name=field_name,
+            original_filename=self.original_filename,
+            filename=os.path.basename(self.path),
+            path=self.path,
+            size=self.size,
+            sha256=self.hasher.hexdigest(),
+        )
+
+    def abort(self):
+        self.file.close()
+        _remove(self.tmp_path)
+
+
+def ingest_multipart(
+    stream,
+    boundary,
+    upload_dir,
+    filename_prefix,
+    *,
+    allowed_file,
+    validate_file=None,
+    file_field='image',
+    max_files=9,
+    max_file_size=5 * 1024 * 1024,
+    max_total_size=50 * 1024 * 1024,
+    max_field_size=64 * 1024,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    流式解析 multipart 请求体，把 file_field 字段的文件写入 upload_dir
+
+    Args:
+        stream: 请求体（request.stream）
+        boundary: multipart boundary（request.mimetype_params['boundary']）
+        upload_dir: 上传目录
+        filename_prefix: 保存文件名前缀，文件保存为 {prefix}_{序号}_{安全文件名}
+        allowed_file: 判断原始文件名是否允许的函数
+        validate_file: 校验已写入文件的函数（可选），参数为文件路径，不通过时抛出 UploadRejected
+        file_field: 图片字段名，其他文件字段会被读取并丢弃
+        max_files: 最多文件数
+        max_file_size: 单个文件最大字节数
+        max_total_size: 请求体最大字节数
+        max_field_size: 所有文本字段合计最大字节数
+
+    Returns:
+        (fields, files)：fields 为 {字段名: 文本值}（同名字段取第一个），files 为 IngestedFile 列表
+
+    Raises:
+        UploadRejected: 超出限制或文件类型不允许；已写入的文件会被删除
+    """
+    if not boundary:
+        raise UploadRejected('Missing multipart boundary')
+
+    decoder = MultipartDecoder(
+        boundary.encode('latin-1') if isinstance(boundary, str) else boundary,
+        max_form_memory_size=max_field_size,
+    )
+    fields = {}
+    files = []
+    field_bytes = 0
+    total_read = 0
+
+    part = None
+    field_chunks = None
+    out = None  # 当前正在写入的 _PartialFile
+
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            total_read += len(chunk)
+            if total_read > max_total_size:
+                raise UploadRejected(
+                    f'Request too large (max {max_total_size // (1024 * 1024)}MB)', status=413
+                )
+            decoder.receive_data(chunk or None)
+
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part = event
+                    field_chunks = []
+                elif isinstance(event, File):
+                    part = event
+                    out = None
+                    if event.name == file_field and event.filename:
+                        if len(files) >= max_files:
+                            raise UploadRejected(f'Too many images (max {max_files})')
+                        if not allowed_file(event.filename):
+                            raise UploadRejected('File type not allowed')
+                        filename = f"{filename_prefix}_{len(files) + 1}_{secure_filename(event.filename)}"
+                        out = _PartialFile(os.path.join(upload_dir, filename), event.filename)
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        field_bytes += len(event.data)
+                        if field_bytes > max_field_size:
+                            raise UploadRejected('Form fields too large', status=413)
+                        field_chunks.append(event.data)
+                        if not event.more_data:
+                            value = b''.join(field_chunks).decode('utf-8', 'replace')
+                            fields.setdefault(part.name, value)
+                    elif out is not None:
+                        if out.size + len(event.data) > max_file_size:
+                            raise UploadRejected(
+                                f'File too large (max {max_file_size // (1024 * 1024)}MB each)'
+                            )
+                        out.write(event.data)
+                        if not event.more_data:
+                            files.append(out.finish(part.name))
+                            out = None
+                            if validate_file is not None:
+                                validate_file(files[-1].path)
+                event = decoder.next_event()
+
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except BaseException as e:
+        if out is not None:
+            out.abort()
+        for ingested in files:
+            _remove(ingested.path)
+        if isinstance(e, RequestEntityTooLarge):
+            raise UploadRejected('Form fields too large', status=413) from e
+        if isinstance(e, ValueError):
+            # MultipartDecoder 对格式错误或超过 max_form_memory_size 的请求抛出 ValueError 子类
+            raise UploadRejected(f'Malformed multipart request: {e}') from e
+        raise
+
+    if out is not None:
+        out.abort()
+        for ingested in files:
+            _remove(ingested.path)
+        raise UploadRejected('Truncated multipart request')
+
+    return fields, files
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove rejected upload {path}: {e}")
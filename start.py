@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 启动脚本 - 从项目根目录运行
+
+启动应用前先执行数据库迁移（python -m migrations upgrade），迁移失败时不启动应用；
+迁移由部署流程单独执行时可设置 DB_MIGRATE_ON_START=false 跳过。
 """
 
 import subprocess
@@ -11,5 +14,11 @@ import os
 src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
 os.chdir(src_dir)
 
+# 执行数据库迁移
+if os.getenv('DB_MIGRATE_ON_START', 'true').lower() == 'true':
+    result = subprocess.run([sys.executable, '-m', 'migrations', 'upgrade'])
+    if result.returncode != 0:
+        sys.exit(f"数据库迁移失败（退出码 {result.returncode}），应用未启动")
+
 # 运行Flask应用
-subprocess.run([sys.executable, 'app.py'])
\ No newline at end of file
+subprocess.run([sys.executable, 'app.py'])
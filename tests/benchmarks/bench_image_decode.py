@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Image decode benchmark: full decode + LANCZOS (the previous encoder) vs. the
+draft-mode decode + reducing_gap resample in image_processing.compress_to_data_url.
+
+For every photo it reports per-image CPU time, and for each pipeline the peak
+RSS of a fresh worker process that compresses the whole corpus. Quality is the
+PSNR of the fast output against the previous output (both at the final size).
+
+Run against a directory of real homework photos (JPEG/PNG, any size):
+    python tests/benchmarks/bench_image_decode.py --corpus ~/homework-photos
+Without --corpus, synthetic 12 MP and 48 MP photos are generated.
+"""
+
+import argparse
+import base64
+import io
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+sys.path.insert(0, SRC)
+
+from PIL import Image, ImageChops, ImageDraw, ImageOps
+
+from image_processing import compress_to_data_url
+
+
+def legacy_compress(raw, max_size=1024, quality=85):
+    """The encoder before draft decoding: full decode, single-pass LANCZOS."""
+    with Image.open(io.BytesIO(raw)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
+        if img.width > max_size or img.height > max_size:
+            ratio = min(max_size / img.width, max_size / img.height)
+            img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+PIPELINES = {"legacy": legacy_compress, "draft": compress_to_data_url}
+
+
+def synthetic_photo(width, height, seed):
+    img = Image.effect_noise((width, height), 25).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    step = max(40, height // 60)
+    for row, y in enumerate(range(step, height - step, step)):
+        # handwriting-like strokes on ruled paper
+        draw.line((0, y, width, y), fill=(120, 140, 200), width=3)
+        x = (seed * 97 + row * 31) % (width // 10)
+        while x < width - step:
+            draw.text((x, y - step // 2), "F=ma", fill=(20, 20, 20))
+            draw.line((x, y - 5, x + step, y - step // 3), fill=(10, 10, 10), width=6)
+            x += step * 2
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def write_synthetic_corpus(directory):
+    for name, (width, height, seed) in {"synthetic-12MP.jpg": (4032, 3024, 1),
+                                        "synthetic-48MP.jpg": (8064, 6048, 2)}.items():
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(synthetic_photo(width, height, seed))
+
+
+def corpus_paths(directory):
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+             if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))]
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    return paths
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_data_url(data_url):
+    raw = base64.b64decode(data_url.split(",", 1)[1])
+    return Image.open(io.BytesIO(raw)).convert("RGB")
+
+
+def psnr(a, b):
+    if a.size != b.size:
+        b = b.resize(a.size, Image.Resampling.LANCZOS)
+    histogram = ImageChops.difference(a, b).histogram()
+    squares = sum(count * ((index % 256) ** 2) for index, count in enumerate(histogram))
+    mse = squares / (a.size[0] * a.size[1] * 3)
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def peak_rss_worker(name, paths, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for path in paths:
+        PIPELINES[name](read(path))
+    queue.put((before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_in_child(target, *args):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=target, args=args + (queue,))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def write_corpus_worker(directory, queue):
+    write_synthetic_corpus(directory)
+    queue.put(None)
+
+
+def peak_rss_mb(name, paths):
+    """
+    Peak RSS growth (MB) of a fresh process compressing the corpus.
+
+    ru_maxrss is inherited from the parent, so this must run before the parent
+    itself decodes any large image.
+    """
+    before, after = run_in_child(peak_rss_worker, name, paths)
+    return (after - before) / 1024  # ru_maxrss is KB on Linux
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of real photos")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    directory = args.corpus
+    if not directory:
+        directory = tempfile.mkdtemp(prefix="bench-image-decode-")
+        run_in_child(write_corpus_worker, directory)
+    paths = corpus_paths(directory)
+
+    rss = {name: peak_rss_mb(name, paths) for name in PIPELINES}
+    photos = [(os.path.basename(path), read(path)) for path in paths]
+
+    print(f"{'photo':<28}{'legacy ms':>12}{'draft ms':>12}{'speedup':>10}{'PSNR dB':>10}")
+    speedups = []
+    for name, raw in photos:
+        times = {}
+        for pipeline, func in PIPELINES.items():
+            samples = []
+            for _ in range(args.rounds):
+                started = time.process_time()
+                func(raw)
+                samples.append(time.process_time() - started)
+            times[pipeline] = statistics.median(samples)
+        quality = psnr(decode_data_url(legacy_compress(raw)), decode_data_url(compress_to_data_url(raw)))
+        speedups.append(times["legacy"] / times["draft"])
+        print(f"{name[:27]:<28}{times['legacy'] * 1000:>12.1f}{times['draft'] * 1000:>12.1f}"
+              f"{speedups[-1]:>9.1f}x{quality:>10.1f}")
+
+    print(f"median CPU speedup: {statistics.median(speedups):.1f}x")
+    print(f"peak RSS growth: legacy {rss['legacy']:.0f} MB, draft {rss['draft']:.0f} MB")
+    if not args.corpus:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
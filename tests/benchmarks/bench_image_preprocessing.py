@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-image preprocessing benchmark: serial encoding on the request thread
+vs. the image preprocessing process pool.
+
+Everything before the first streamed token of an image query is dominated by
+compressing the uploads, so the preprocessing wall time of a 9-image request
+is the time-to-first-token floor this change moves. The encoding cache is
+bypassed so every round pays the full decode/resize/encode cost.
+
+Run:
+    python tests/benchmarks/bench_image_preprocessing.py --images 9 --rounds 5
+    IMAGE_WORKERS=4 python tests/benchmarks/bench_image_preprocessing.py
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from PIL import Image, ImageDraw
+
+import image_processing
+from image_processing import compress_many, compress_to_data_url, get_image_executor
+
+
+def make_photo(seed, width=3024, height=4032):
+    """A phone-camera sized JPEG with enough detail to make encoding realistic."""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.line((x, y, x + rng.randrange(-400, 400), y + rng.randrange(-50, 50)), fill=(0, 0, 0), width=4)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def run(label, func, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    median = statistics.median(samples)
+    print(f"{label:<28}{median * 1000:>10.1f} ms")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=9)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    raws = [make_photo(seed) for seed in range(args.images)]
+    print(f"{args.images} images, {sum(map(len, raws)) / 1e6:.1f} MB total, cpu_count={os.cpu_count()}, "
+          f"IMAGE_WORKERS={os.getenv('IMAGE_WORKERS', os.cpu_count())}")
+
+    serial = run("serial (request thread)", lambda: [compress_to_data_url(raw) for raw in raws], args.rounds)
+
+    executor = get_image_executor()
+    if executor is None:
+        raise SystemExit("IMAGE_WORKERS=0 disables the pool; nothing to compare")
+    # Warm the workers so spawn/import cost is not counted against a request.
+    workers = int(os.getenv("IMAGE_WORKERS", os.cpu_count() or 1))
+    list(executor.map(compress_to_data_url, raws[:workers]))
+
+    pooled = run("process pool", lambda: compress_many(raws), args.rounds)
+    print(f"{'speedup':<28}{serial / pooled:>10.2f} x")
+    image_processing.shutdown_image_executor()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Login lookup benchmark: OR across name/email/phone vs. classified indexed probes.
+
+Seeds a scratch table (`bench_login_users`, same columns/indexes as `users`)
+to increasing sizes and measures lookup latency for each account type.
+The legacy query is run with `IGNORE INDEX (idx_users_name)` to reproduce the
+schema before the name index existed.
+
+NEVER point this at production: it creates, fills and drops its own table.
+
+Run:
+    BENCH_MYSQL_DATABASE=scratch python tests/benchmarks/bench_login_lookup.py --sizes 10000,100000,1000000
+Connection settings fall back to MYSQL_HOST/MYSQL_PORT/MYSQL_USER/MYSQL_PASSWORD.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import mysql.connector
+
+from database import _LOGIN_PROBES, classify_account
+
+TABLE = "bench_login_users"
+COLUMNS = "id, name, email, phone, password_hash"
+
+
+def connect():
+    database = os.getenv("BENCH_MYSQL_DATABASE")
+    if not database:
+        raise SystemExit("Set BENCH_MYSQL_DATABASE to a scratch database")
+    return mysql.connector.connect(
+        host=os.getenv("BENCH_MYSQL_HOST", os.getenv("MYSQL_HOST", "127.0.0.1")),
+        port=int(os.getenv("BENCH_MYSQL_PORT", os.getenv("MYSQL_PORT", 3306))),
+        user=os.getenv("BENCH_MYSQL_USER", os.getenv("MYSQL_USER", "root")),
+        password=os.getenv("BENCH_MYSQL_PASSWORD", os.getenv("MYSQL_PASSWORD")),
+        database=database,
+        charset="utf8mb4",
+    )
+
+
+def create_table(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {TABLE} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(255) DEFAULT NULL,
+            phone VARCHAR(20) DEFAULT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            UNIQUE KEY unique_email (email),
+            UNIQUE KEY unique_phone (phone),
+            INDEX idx_users_name (name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+def seed(connection, cursor, start, stop, batch=5000):
+    for lo in range(start, stop, batch):
+        rows = [
+            (f"user{i}", f"user{i}@example.com", f"1{i:010d}", "x" * 64)
+            for i in range(lo, min(stop, lo + batch))
+        ]
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (name, email, phone, password_hash) VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+        connection.commit()
+
+
+def legacy_lookup(cursor, account):
+    cursor.execute(
+        f"SELECT {COLUMNS} FROM {TABLE} IGNORE INDEX (idx_users_name) "
+        f"WHERE name = %s OR email = %s OR phone = %s",
+        (account, account, account),
+    )
+    return cursor.fetchall()
+
+
+def probe_lookup(cursor, account):
+    probes = _LOGIN_PROBES[classify_account(account)]
+    query = " UNION ALL ".join(
+        f"(SELECT {COLUMNS} FROM {TABLE} WHERE {column} = %s ORDER BY id LIMIT 1)"
+        for column in probes
+    )
+    cursor.execute(query + " ORDER BY id LIMIT 1", (account,) * len(probes))
+    return cursor.fetchall()
+
+
+def measure(fn, cursor, accounts, repeat):
+    samples = []
+    for _ in range(repeat):
+        for account in accounts:
+            t0 = time.perf_counter()
+            fn(cursor, account)
+            samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-legacy-above", type=int, default=1000000,
+                        help="skip the full-scan query above this many rows")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    connection = connect()
+    cursor = connection.cursor()
+    create_table(cursor)
+
+    print(f"{'rows':>10} {'kind':>6} {'legacy p50/p95 ms':>20} {'probe p50/p95 ms':>20}")
+    seeded = 0
+    try:
+        for size in sizes:
+            seed(connection, cursor, seeded, size)
+            seeded = size
+            cursor.execute(f"ANALYZE TABLE {TABLE}")
+            cursor.fetchall()
+            mid = size // 2
+            for kind, account in (
+                ("email", f"user{mid}@example.com"),
+                ("phone", f"1{mid:010d}"),
+                ("name", f"user{mid}"),
+            ):
+                if size <= args.skip_legacy_above:
+                    p50, p95 = measure(legacy_lookup, cursor, [account], args.repeat)
+                    legacy = f"{p50:8.2f}/{p95:8.2f}"
+                else:
+                    legacy = "skipped"
+                p50, p95 = measure(probe_lookup, cursor, [account], args.repeat)
+                print(f"{size:>10} {kind:>6} {legacy:>20} {p50:8.2f}/{p95:8.2f}")
+
+        cursor.execute(
+            f"EXPLAIN (SELECT {COLUMNS} FROM {TABLE} WHERE name = %s LIMIT 1)", ("user1",)
+        )
+        print("\nEXPLAIN name probe:", cursor.fetchall())
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.close()
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Session codec benchmark: encode/decode time and on-disk size of a deep-think
+response (`solve_thinking` / `verify_thinking` of tens of KB) for the legacy
+`json.dump(indent=2)` format and every codec available in this environment.
+
+Run:
+    python tests/benchmarks/bench_session_codec.py --thinking-kb 40 --iterations 500
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import session_codec
+from session_codec import JsonCodec, MsgpackCodec, OrjsonCodec, decode
+from session_store import FileSessionStore
+
+SAMPLE_SENTENCES = [
+    "首先分析物体的受力情况，重力 mg 竖直向下，支持力 N 垂直斜面向上。",
+    "由牛顿第二定律 F = ma 可得沿斜面方向的加速度 a = g(sinθ - μcosθ)。",
+    "Let me double-check the sign convention for the friction term before continuing.",
+    "代入数据 m = 2 kg，θ = 30°，μ = 0.2，得到 a ≈ 3.2 m/s²。",
+    "验证：能量守恒 mgh = ½mv² + μmgcosθ·s，两种方法结果一致。",
+    "$$v^2 = v_0^2 + 2as$$ 因此末速度 v = \\sqrt{2as}。",
+]
+
+
+def make_text(kb, rng):
+    parts = []
+    size = 0
+    while size < kb * 1024:
+        sentence = rng.choice(SAMPLE_SENTENCES)
+        parts.append(sentence)
+        size += len(sentence.encode("utf-8"))
+    return "\n".join(parts)
+
+
+def make_response(kb, rng):
+    return {
+        "deep_think": True,
+        "solve_thinking": make_text(kb, rng),
+        "solve_answer": make_text(max(1, kb // 4), rng),
+        "verify_thinking": make_text(kb, rng),
+        "verify_answer": make_text(max(1, kb // 8), rng),
+        "completed_at": "2024-05-01 12:00:00.000000",
+    }
+
+
+class LegacyIndentCodec:
+    """The format used before the codec layer: json.dump(..., indent=2)."""
+
+    name = "json-indent2 (legacy)"
+    extension = ".json"
+
+    def encode(self, data):
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def time_call(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thinking-kb", type=int, default=40, help="size of each *_thinking field in KB")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    response = make_response(args.thinking_kb, random.Random(args.seed))
+    codecs = [LegacyIndentCodec(), JsonCodec()]
+    if session_codec.orjson is not None:
+        codecs.append(OrjsonCodec())
+    if session_codec.msgpack is not None:
+        codecs.append(MsgpackCodec())
+
+    print(f"payload: thinking fields {args.thinking_kb} KB each, {args.iterations} iterations (median)")
+    print(f"{'codec':<24}{'encode us':>12}{'decode us':>12}{'save us':>12}{'bytes':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in codecs:
+            encoded = codec.encode(response)
+            assert decode(encoded) == response
+            store = FileSessionStore(os.path.join(directory, codec.name.split()[0]), codec=codec)
+            encode_us = time_call(lambda: codec.encode(response), args.iterations)
+            decode_us = time_call(lambda: decode(encoded), args.iterations)
+            save_us = time_call(lambda: store.save("bench", response), args.iterations)
+            print(f"{codec.name:<24}{encode_us:>12.1f}{decode_us:>12.1f}{save_us:>12.1f}{len(encoded):>12}")
+
+
+if __name__ == "__main__":
+    main()
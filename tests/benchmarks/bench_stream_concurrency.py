@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent SSE load test: waitress (thread per stream) vs. the ASGI entry point.
+
+Starts a local OpenAI-compatible upstream whose streams last `--chunks * --delay`
+seconds (a stand-in for multi-minute reasoning), seeds `--streams` distinct text
+sessions, then opens all `/api/stream/<id>` connections at once while a probe
+polls `/health` (stand-in for logins and other JSON routes). Reported per server:
+wall time for all streams, time to first event, and /health latency under load.
+
+The answer cache and single-flight are disabled so every stream reaches the
+upstream. Connection pools keep the shipped defaults (AI_MAX_CONNECTIONS=64 for
+waitress, ASGI_MAX_STREAMS for the ASGI entry point; see asgi.configure_pool_defaults)
+unless --ai-max-connections is given; streams beyond the pool wait AI_POOL_TIMEOUT. The ASGI side runs under uvicorn when it is installed; otherwise the
+ASGI application is called in-process (same event-loop execution, no sockets).
+
+Run:
+    python tests/benchmarks/bench_stream_concurrency.py --streams 64 --chunks 20 --delay 0.1
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for index in range(self.server.chunks):
+            time.sleep(self.server.delay)
+            delta = {'reasoning_content': '想'} if index < self.server.chunks // 2 else {'content': '答'}
+            chunk = {
+                'id': 'chunk', 'object': 'chat.completion.chunk', 'created': 0, 'model': request['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode())
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # default listen backlog (5) stalls connection bursts
+
+
+def start_upstream(chunks, delay):
+    server = UpstreamServer(('127.0.0.1', 0), UpstreamHandler)
+    server.chunks, server.delay = chunks, delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_sessions(store, prefix, count):
+    session_ids = []
+    for index in range(count):
+        session_id = f'{prefix}-{index}'
+        store.save(session_id, {
+            'type': 'text', 'question': f'第 {index} 题：求加速度', 'subject': 'physics', 'lang': 'zh-CN',
+            'level_effective': 'standard', 'teaching_phase': 2, 'use_profile_effective': False,
+        })
+        session_ids.append(session_id)
+    return session_ids
+
+
+def summarize(name, wall, first_events, completed, health):
+    def ms(values, q):
+        if not values:
+            return float('nan')
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    print(f"{name:<22} streams={completed:<4} wall={wall:6.2f}s  "
+          f"first event p50={ms(first_events, 0.5):7.0f}ms p95={ms(first_events, 0.95):7.0f}ms  "
+          f"/health p50={ms(health, 0.5):6.0f}ms p95={ms(health, 0.95):6.0f}ms max={ms(health, 1.0):6.0f}ms "
+          f"(n={len(health)})")
+
+
+# ----------------------------------------------------------------------------- socket clients
+
+def sse_client(base_url, session_id, results):
+    parts = urlsplit(base_url)
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=600)
+    try:
+        conn.request('GET', f'/api/stream/{session_id}')
+        response = conn.getresponse()
+        first = None
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if line.startswith(b'data: '):
+                first = first or time.perf_counter() - started
+                if json.loads(line[6:])['type'] in ('done', 'error'):
+                    results.append(first)
+                    break
+    finally:
+        conn.close()
+
+
+def health_probe(base_url, stop, latencies):
+    parts = urlsplit(base_url)
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=600)
+        try:
+            conn.request('GET', '/health')
+            conn.getresponse().read()
+            latencies.append(time.perf_counter() - started)
+        finally:
+            conn.close()
+        stop.wait(0.1)
+
+
+def load_over_sockets(name, base_url, session_ids):
+    sse_client(base_url, session_ids.pop(), [])  # warm-up: client construction, imports
+    first_events, health = [], []
+    stop = threading.Event()
+    probe = threading.Thread(target=health_probe, args=(base_url, stop, health), daemon=True)
+    clients = [threading.Thread(target=sse_client, args=(base_url, sid, first_events), daemon=True)
+               for sid in session_ids]
+    started = time.perf_counter()
+    probe.start()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    probe.join()
+    summarize(name, wall, first_events, len(first_events), health)
+
+
+def run_waitress(app, threads, session_ids):
+    from waitress import create_server
+
+    port = free_port()
+    server = create_server(app, host='127.0.0.1', port=port, threads=threads, connection_limit=10000)
+    # waitress cannot be stopped cleanly from another thread; the daemon thread ends with the process
+    threading.Thread(target=server.run, daemon=True).start()
+    load_over_sockets(f'waitress threads={threads}', f'http://127.0.0.1:{port}', session_ids)
+
+
+def run_uvicorn(application, session_ids):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    try:
+        load_over_sockets('asgi (uvicorn)', f'http://127.0.0.1:{port}', session_ids)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+# ----------------------------------------------------------------------------- in-process ASGI
+
+async def asgi_request(application, path, on_first_body=None):
+    done = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and message.get('body') and on_first_body:
+            on_first_body()
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+        'root_path': '', 'query_string': b'', 'headers': [],
+        'server': ('127.0.0.1', 80), 'client': ('127.0.0.1', 5555),
+    }
+    try:
+        await application(scope, receive, send)
+    finally:
+        done.set()
+
+
+async def load_in_process(application, session_ids):
+    await asgi_request(application, f'/api/stream/{session_ids.pop()}')  # warm-up
+    first_events, health = [], []
+    stop = asyncio.Event()
+
+    async def stream(session_id):
+        started = time.perf_counter()
+        first = []
+        await asgi_request(application, f'/api/stream/{session_id}',
+                           lambda: first or first.append(time.perf_counter() - started))
+        first_events.extend(first)
+
+    async def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asgi_request(application, '/health')
+            health.append(time.perf_counter() - started)
+            await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    probe_task = asyncio.ensure_future(probe())
+    await asyncio.gather(*(stream(sid) for sid in session_ids))
+    wall = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    summarize('asgi (in-process)', wall, first_events, len(first_events), health)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=64, help='concurrent SSE clients')
+    parser.add_argument('--chunks', type=int, default=20, help='upstream chunks per stream')
+    parser.add_argument('--delay', type=float, default=0.1, help='seconds between upstream chunks')
+    parser.add_argument('--threads', type=int, default=8, help='waitress threads (THREADS)')
+    parser.add_argument('--ai-max-connections', type=int, default=None,
+                        help='override AI_MAX_CONNECTIONS (default: shipped defaults)')
+    parser.add_argument('--skip-waitress', action='store_true')
+    args = parser.parse_args()
+
+    upstream = start_upstream(args.chunks, args.delay)
+    os.environ.update({
+        'DEEPSEEK_API_KEY': 'bench', 'DEEPSEEK_BASE_URL': upstream, 'SESSION_STORE': 'memory',
+        'ANSWER_CACHE_ENABLED': 'false', 'SINGLE_FLIGHT_ENABLED': 'false',
+    })
+    if args.ai_max_connections:
+        os.environ['AI_MAX_CONNECTIONS'] = str(args.ai_max_connections)
+    import logging
+    logging.disable(logging.INFO)
+
+    # asgi 先于 app 导入，与 run_asgi.py 一样按 ASGI 路径的默认值创建连接池
+    from asgi import application
+    from app import app, get_session_store
+
+    store = get_session_store()
+    print(f"{args.streams} concurrent streams, {args.chunks} chunks x {args.delay}s "
+          f"(~{args.chunks * args.delay:.1f}s each), AI_MAX_CONNECTIONS={os.environ['AI_MAX_CONNECTIONS']}, "
+          f"MYSQL_POOL_SIZE={os.environ['MYSQL_POOL_SIZE']}\n")
+    if not args.skip_waitress:
+        run_waitress(app, args.threads, seed_sessions(store, 'waitress', args.streams + 1))
+    session_ids = seed_sessions(store, 'asgi', args.streams + 1)
+    if uvicorn is not None:
+        run_uvicorn(application, session_ids)
+    else:
+        asyncio.run(load_in_process(application, session_ids))
+        print("\nuvicorn not installed - ASGI side measured in-process (pip install 'uvicorn>=0.23' for sockets)")
+
+
+if __name__ == '__main__':
+    main()
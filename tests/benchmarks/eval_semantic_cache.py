@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Semantic answer-cache evaluation: precision / recall of the n-gram similarity
+match (semantic_cache.py) over a labelled set of question pairs, for a range
+of SEMANTIC_CACHE_THRESHOLD values, plus index lookup latency.
+
+A false positive means a student gets the cached answer to a *different*
+question, so pick the lowest threshold whose precision is acceptable on pairs
+sampled from real traffic.
+
+Pairs file: JSON lines {"a": "...", "b": "...", "same": true|false}. Without
+--pairs a small built-in set of paraphrases / OCR variants / near-misses is used.
+
+Run:
+    python tests/benchmarks/eval_semantic_cache.py --pairs labelled_pairs.jsonl
+    python tests/benchmarks/eval_semantic_cache.py --index-size 5000 --lookups 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from semantic_cache import (
+    SemanticQuestionIndex, cosine_similarity, question_numbers, question_symbols, question_vector,
+)
+
+BUILTIN_PAIRS = [
+    # 同一道题：标点/空格/错字/语序/措辞变化
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为2kg的物体,受到10N的水平拉力,求物体的加速度", True),
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为2kq的物休，受到10N的水平拉力，求物体的加速度。", True),
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "质量为2kg的物体受10N水平拉力作用，求它的加速度", True),
+    ("写出铁与稀盐酸反应的化学方程式", "写出铁和稀盐酸反应的化学方程式", True),
+    ("写出铁与稀盐酸反应的化学方程式", "请写出铁与稀盐酸反应的化学方程式。", True),
+    ("小球从20m高处自由下落，求落地时的速度（g取10m/s²）", "小球从 20 m 高处自由下落，求落地时的速度 (g 取 10 m/s²)", True),
+    ("小球从20m高处自由下落，求落地时的速度（g取10m/s²）", "一小球从20m高处由静止自由下落，求落地速度，g取10m/s²", True),
+    ("A 2 kg block is pulled by a 10 N force. Find its acceleration.", "A 2kg block is pulled with a force of 10 N. Find the acceleration.", True),
+    ("A 2 kg block is pulled by a 10 N force. Find its acceleration.", "a 2 kg block is pulled by a 10N force, find its acceleration", True),
+    ("配平化学方程式：Fe2O3 + CO → Fe + CO2", "配平化学方程式 Fe2O3+CO→Fe+CO2", True),
+    # 不同的题：一个关键词不同
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为2kg的物体，受到10N的竖直拉力，求物体的加速度。", False),
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为2kg的物体，受到10N的水平拉力，求物体的速度。", False),
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为2kg的物体，受到10N的水平拉力，求物体受到的摩擦力。", False),
+    ("写出铁与稀盐酸反应的化学方程式", "写出铁与稀硫酸反应的化学方程式", False),
+    ("写出铁与稀盐酸反应的化学方程式", "写出铜与浓硝酸反应的化学方程式", False),
+    ("小球从20m高处自由下落，求落地时的速度（g取10m/s²）", "小球从20m高处自由下落，求下落的时间（g取10m/s²）", False),
+    ("A 2 kg block is pulled by a 10 N force. Find its acceleration.", "A 2 kg block is pushed by a 10 N force. Find its velocity.", False),
+    # 不同的题：数字不同（由分区排除）
+    ("一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。", "一个质量为4kg的物体，受到10N的水平拉力，求物体的加速度。", False),
+    ("小球从20m高处自由下落，求落地时的速度（g取10m/s²）", "小球从45m高处自由下落，求落地时的速度（g取10m/s²）", False),
+    # 不同的题：物理量符号大小写不同（由分区排除）
+    ("质量为m的物块放在质量为M的木板上，求木板的加速度", "质量为M的物块放在质量为m的木板上，求木板的加速度", False),
+    ("小球以速度v撞击静止小球，求碰后速度", "小球以速度V撞击静止小球，求碰后速度", False),
+]
+
+THRESHOLDS = [0.70, 0.75, 0.80, 0.85, 0.88, 0.90, 0.92, 0.94, 0.96, 0.98]
+
+
+def load_pairs(path):
+    pairs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                pairs.append((item['a'], item['b'], bool(item['same'])))
+    return pairs
+
+
+def pair_similarity(a, b):
+    """与 SemanticQuestionIndex.find 一致：数字或符号序列不同的问题不会被比较（相似度记为 0）"""
+    if question_numbers(a) != question_numbers(b) or question_symbols(a) != question_symbols(b):
+        return 0.0
+    return cosine_similarity(question_vector(a), question_vector(b))
+
+
+def evaluate(pairs, thresholds):
+    scored = [(pair_similarity(a, b), same) for a, b, same in pairs]
+    rows = []
+    for threshold in thresholds:
+        tp = sum(1 for score, same in scored if score >= threshold and same)
+        fp = sum(1 for score, same in scored if score >= threshold and not same)
+        fn = sum(1 for score, same in scored if score < threshold and same)
+        precision = tp / (tp + fp) if tp + fp else 1.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        rows.append((threshold, tp, fp, fn, precision, recall))
+    return scored, rows
+
+
+def bench_lookup(index_size, lookups, seed=0):
+    """最坏情况：问题都不含数字，全部落在同一个分区"""
+    rng = random.Random(seed)
+    vocabulary = ['物体', '质量', '受到', '水平', '拉力', '加速度', '速度', '摩擦力', '斜面', '小球',
+                  '自由下落', '落地', '反应', '化学方程式', '稀盐酸', '铁', '求', '的', '时间', '位移']
+    index = SemanticQuestionIndex(threshold=0.9, max_entries=index_size)
+    questions = []
+    for i in range(index_size):
+        question = ''.join(rng.choice(vocabulary) for _ in range(rng.randint(8, 20)))
+        questions.append(question)
+        index.add('physics', question, str(i))
+
+    timings = []
+    for _ in range(lookups):
+        question = rng.choice(questions)
+        start = time.perf_counter()
+        index.find('physics', question)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1], index.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', help='labelled pairs (JSON lines); default: built-in sample')
+    parser.add_argument('--show-errors', type=float, metavar='THRESHOLD',
+                        help='list misclassified pairs at this threshold')
+    parser.add_argument('--index-size', type=int, default=5000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.pairs) if args.pairs else BUILTIN_PAIRS
+    positives = sum(1 for _, _, same in pairs if same)
+    print(f"{len(pairs)} pairs ({positives} same, {len(pairs) - positives} different)")
+    scored, rows = evaluate(pairs, THRESHOLDS)
+
+    print(f"{'threshold':>9} {'tp':>5} {'fp':>5} {'fn':>5} {'precision':>10} {'recall':>8}")
+    for threshold, tp, fp, fn, precision, recall in rows:
+        print(f"{threshold:>9.2f} {tp:>5} {fp:>5} {fn:>5} {precision:>10.3f} {recall:>8.3f}")
+
+    if args.show_errors is not None:
+        print(f"\nMisclassified at {args.show_errors:.2f}:")
+        for (score, same), (a, b, _) in zip(scored, pairs):
+            if (score >= args.show_errors) != same:
+                print(f"  {'FN' if same else 'FP'} {score:.3f}  {a}  |  {b}")
+
+    median_ms, p99_ms, stats = bench_lookup(args.index_size, args.lookups)
+    print(f"\nLookup over {stats['entries']} questions in {stats['partitions']} partitions: "
+          f"median {median_ms:.3f} ms, p99 {p99_ms:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
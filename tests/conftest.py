@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 让测试可以直接 import src/ 下的模块（与 app.py 的运行方式一致）
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, os.path.abspath(SRC_DIR))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures for unit tests."""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+CHAT_DELTAS = ({'reasoning_content': '思考'}, {'content': '答'}, {'content': '案'})
+
+
+class ChatStreamHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible streaming chat.completions endpoint."""
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(request)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for delta in CHAT_DELTAS:
+            time.sleep(self.server.delay)
+            chunk = {
+                'id': 'chunk', 'object': 'chat.completion.chunk', 'created': 0, 'model': request['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode())
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def chat_upstream():
+    """Streaming upstream; set `.delay` to slow down each chunk, inspect `.requests` afterwards."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ChatStreamHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.delay = 0.0
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
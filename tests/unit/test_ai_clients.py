@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the shared AI provider client registry."""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ai_clients import AIClientRegistry
+
+
+class ModelsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        body = json.dumps({'object': 'list', 'data': []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ModelsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_and_timeout_overrides_share_one_keep_alive_connection(base_url):
+    registry = AIClientRegistry(http2=False)
+    client = registry.client('deepseek', api_key='key', base_url=base_url, read_timeout=600)
+
+    client.models.list()
+    probe = client.with_options(timeout=5)
+    probe.models.list()
+    registry.client('deepseek', api_key='key', base_url=base_url, read_timeout=600).models.list()
+
+    assert probe.timeout == 5
+    assert client.timeout.read == 600 and client.timeout.connect == registry.connect_timeout
+    stats = registry.stats()['providers']['deepseek']
+    assert (stats['requests'], stats['connections_opened'], stats['rebuilds']) == (3, 1, 0)
+    assert stats['pool'] == {'connections': 1, 'active': 0, 'idle': 1, 'http2': 0, 'queued_requests': 0}
+
+
+def test_client_is_rebuilt_only_when_configuration_changes(base_url):
+    registry = AIClientRegistry(http2=False)
+    first = registry.client('doubao', api_key='a', base_url=base_url, read_timeout=1800)
+
+    assert registry.client('doubao', api_key='a', base_url=base_url, read_timeout=1800) is first
+    assert registry.client('deepseek', api_key='a', base_url=base_url) is not first
+    assert registry.client('doubao', api_key='b', base_url=base_url, read_timeout=1800) is not first
+    assert registry.stats()['providers']['doubao']['rebuilds'] == 1
+
+
+def test_async_clients_are_bound_to_the_event_loop(base_url):
+    registry = AIClientRegistry(http2=False)
+
+    async def use():
+        client = registry.async_client('deepseek', api_key='key', base_url=base_url)
+        assert registry.async_client('deepseek', api_key='key', base_url=base_url) is client
+        await client.models.list()
+        return client
+
+    # 第二个事件循环不能复用第一个事件循环中建立的连接
+    first = asyncio.run(use())
+    second = asyncio.run(use())
+
+    assert second is not first
+    stats = registry.stats()['providers']['deepseek_async']
+    assert (stats['requests'], stats['connections_opened'], stats['rebuilds']) == (1, 1, 1)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the exact-match answer cache."""
+
+import hashlib
+import io
+import json
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+import image_processing
+from answer_cache import AnswerCache, answer_cache_key, coalesce_events
+from llm_stream import EventStream
+from session_store import MemorySessionStore, response_key
+
+
+def _session(**overrides):
+    data = {
+        'type': 'text',
+        'question': '一个质量为 2kg 的物体，受力 F=10N，求加速度。',
+        'subject': 'physics',
+        'lang': 'zh-CN',
+        'level_effective': 'standard',
+        'teaching_phase': 2,
+        'use_profile_effective': False,
+        'learning_profile': {'weak_points': ['受力分析']},
+    }
+    data.update(overrides)
+    return data
+
+
+def test_key_normalizes_question_and_tracks_generation_inputs():
+    base = answer_cache_key(_session())
+    spaced = answer_cache_key(_session(question='  一个质量为\n2kg 的物体，受力　 F=10N，求加速度。 '))
+    assert spaced == base
+    assert answer_cache_key(_session(question='一个质量为 2kg 的物体，受力 f=10N，求加速度。')) != base
+
+    for change in [{'subject': 'chemistry'}, {'lang': 'en-US'}, {'level_effective': 'basic'},
+                   {'teaching_phase': 1}, {'type': 'text_deep'}, {'use_profile_effective': True}]:
+        assert answer_cache_key(_session(**change)) != base
+    assert answer_cache_key(_session(), prompt_version=-1) != base
+
+
+def test_image_queries_require_content_hashes():
+    assert answer_cache_key(_session(type='image_stream', image_filepaths=['a.png'])) is None
+    first = answer_cache_key(_session(type='image_stream', upload_hashes=['a' * 64, 'b' * 64]))
+    swapped = answer_cache_key(_session(type='image_stream', upload_hashes=['b' * 64, 'a' * 64]))
+    assert first is not None and first != swapped
+    # 预处理返回的 image_hashes 不参与 key
+    assert answer_cache_key(_session(type='image_stream', image_hashes=['a' * 64])) is None
+
+
+def _worksheet(answer):
+    img = Image.new('RGB', (800, 1000), (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    for number, y in enumerate(range(80, 900, 90), start=1):
+        draw.text((60, y), f'{number}. m = 2kg, F = 10N, a = ?', fill=(20, 20, 20), font=font)
+    draw.text((60, 920), answer, fill=(20, 20, 20), font=font)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_near_duplicate_images_get_distinct_keys(tmp_path, monkeypatch):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+    from image_dedup import PerceptualHashIndex
+
+    monkeypatch.setenv('IMAGE_WORKERS', '0')
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    index = PerceptualHashIndex(max_distance=20)
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=index)
+
+    keys = []
+    for name, answer in [('a.png', 'a = 5'), ('b.png', 'a = 6')]:
+        raw = _worksheet(answer)
+        (tmp_path / name).write_bytes(raw)
+        upload_hashes = [hashlib.sha256(raw).hexdigest()]
+        image_hashes = client.preprocess_images([str(tmp_path / name)], upload_hashes)
+        keys.append(answer_cache_key(_session(
+            type='image_stream', question='', image_hashes=image_hashes, upload_hashes=upload_hashes,
+        )))
+        # 感知哈希在后台编码完成后才登记到索引
+        image_processing.shutdown_image_executor()
+
+    # 两张图片的 dHash 相同，但内容不同，不能共用回答
+    assert index.stats()['near_hits'] == 1
+    assert None not in keys and keys[0] != keys[1]
+
+
+def test_coalesce_merges_adjacent_content_events_only():
+    events = [
+        {'type': 'stage', 'stage': 'solving', 'message': '...'},
+        {'type': 'thinking', 'content': 'a'},
+        {'type': 'thinking', 'content': 'b'},
+        {'type': 'answer', 'content': 'c'},
+        {'type': 'answer', 'content': 'd'},
+        {'type': 'thinking', 'content': 'e'},
+    ]
+    assert coalesce_events(events) == [
+        {'type': 'stage', 'stage': 'solving', 'message': '...'},
+        {'type': 'thinking', 'content': 'ab'},
+        {'type': 'answer', 'content': 'cd'},
+        {'type': 'thinking', 'content': 'e'},
+    ]
+
+
+def test_cache_expires_evicts_and_reports_hit_rate():
+    cache = AnswerCache(max_entries=2, ttl=0.05)
+    cache.set('empty', [{'type': 'answer', 'content': ''}], {'answer': ''})
+    cache.set('a', [{'type': 'answer', 'content': 'x'}], {'answer': 'x'})
+    cache.set('b', [{'type': 'answer', 'content': 'y'}], {'answer': 'y'})
+    cache.set('c', [{'type': 'answer', 'content': 'z'}], {'answer': 'z'})
+
+    assert cache.get('empty') is None
+    assert cache.get('a') is None
+    assert cache.get('c')['response'] == {'answer': 'z'}
+    time.sleep(0.1)
+    assert cache.get('c') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['stores']) == (1, 3, 3)
+    assert stats['hit_rate'] == 0.25
+
+
+def test_stream_replays_cached_answer_without_calling_producer(monkeypatch):
+    import app
+
+    store = MemorySessionStore(ttl=60)
+    cache = AnswerCache()
+    monkeypatch.setattr(app, 'get_session_store', lambda: store)
+    monkeypatch.setattr(app, 'get_answer_cache', lambda: cache)
+    calls = []
+
+    def producer(session_data):
+        calls.append(session_data)
+        yield {'type': 'thinking', 'content': '受力'}
+        yield {'type': 'thinking', 'content': '分析'}
+        yield {'type': 'answer', 'content': 'a = 5 m/s²'}
+        return {'thinking': '受力分析', 'answer': 'a = 5 m/s²'}
+
+    def frames(session_id):
+        chunks = EventStream(app.run_answer_stream(session_id, _session(), producer), app.ai_client)
+        return [json.loads(chunk.decode()[len('data: '):]) for chunk in chunks]
+
+    first = frames('s1')
+    second = frames('s2')
+
+    assert len(calls) == 1
+    assert first[-1] == {'type': 'done'}
+    assert second == [
+        {'type': 'thinking', 'content': '受力分析'},
+        {'type': 'answer', 'content': 'a = 5 m/s²'},
+        {'type': 'done', 'cached': True, 'similarity': 1.0},
+    ]
+    assert store.load(response_key('s2'))['answer'] == 'a = 5 m/s²'
+    assert store.load(response_key('s2'))['cached'] is True
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the ASGI bridge that runs event streams on the event loop."""
+
+import asyncio
+import json
+import os
+import time
+
+from flask import Flask, Response, jsonify, request
+
+from ai_clients import AIClientRegistry
+from asgi import ASGIBridge, configure_pool_defaults
+from llm_stream import ChatStream, EventStream, Sleep
+
+
+def _flask_app(producer):
+    flask_app = Flask(__name__)
+
+    @flask_app.after_request
+    def tag(response):
+        response.headers['X-Flask'] = 'yes'
+        return response
+
+    @flask_app.route('/echo', methods=['POST'])
+    def echo():
+        return jsonify({'body': request.json, 'cookie': request.cookies.get('sid'), 'query': request.args.get('q')})
+
+    @flask_app.route('/stream')
+    def stream():
+        return Response(EventStream(producer(), None), mimetype='text/event-stream', direct_passthrough=True)
+
+    return flask_app
+
+
+async def _call(bridge, method, path, body=b'', headers=(), query=b'', disconnect_after=None):
+    sent = []
+    disconnected = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+        frames = sum(1 for m in sent if m['type'] == 'http.response.body' and m['body'])
+        if disconnect_after is not None and frames >= disconnect_after:
+            disconnected.set()
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+        'root_path': '', 'query_string': query, 'headers': list(headers),
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5555),
+    }
+    await bridge(scope, receive, send)
+    disconnected.set()
+    start = sent[0]
+    content = b''.join(m.get('body', b'') for m in sent[1:])
+    return start['status'], dict(start['headers']), content, sent[-1]
+
+
+def _frames(content):
+    return [json.loads(frame[len('data: '):]) for frame in content.decode().split('\n\n') if frame]
+
+
+def test_flask_routes_run_unchanged_through_the_bridge():
+    bridge = ASGIBridge(_flask_app(lambda: iter(())).wsgi_app, resolve_client=None, threads=1)
+    body = json.dumps({'question': '加速度'}).encode()
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+               (b'cookie', b'sid=abc')]
+
+    status, response_headers, content, last = asyncio.run(
+        _call(bridge, 'POST', '/echo', body=body, headers=headers, query=b'q=1')
+    )
+
+    assert status == 200
+    assert response_headers[b'x-flask'] == b'yes'
+    assert json.loads(content) == {'body': {'question': '加速度'}, 'cookie': 'abc', 'query': '1'}
+    assert last == {'type': 'http.response.body', 'body': b'', 'more_body': False}
+    assert asyncio.run(_call(bridge, 'GET', '/missing'))[0] == 404
+
+
+def test_event_streams_share_the_event_loop(chat_upstream):
+    chat_upstream.delay = 0.05
+    registry = AIClientRegistry(http2=False)
+
+    def producer():
+        contents = yield ChatStream('fake', {'model': 'm', 'messages': []})
+        yield {'type': 'done', 'answer': contents['answer']}
+
+    # 一个线程：WSGI 线程只用于执行视图，流式回答不占用线程
+    bridge = ASGIBridge(
+        _flask_app(producer).wsgi_app, threads=1,
+        resolve_client=lambda provider: registry.async_client(provider, api_key='key', base_url=chat_upstream.base_url),
+    )
+    streams = 40
+    json_headers = [(b'content-type', b'application/json'), (b'content-length', b'2')]
+
+    async def main():
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(_call(bridge, 'GET', '/stream')) for _ in range(streams)]
+        await asyncio.sleep(0.05)
+        echo = await _call(bridge, 'POST', '/echo', body=b'{}', headers=json_headers)
+        echo_latency = time.perf_counter() - started
+        results = await asyncio.gather(*tasks)
+        return results, echo, echo_latency, time.perf_counter() - started
+
+    results, echo, echo_latency, elapsed = asyncio.run(main())
+
+    for status, headers, content, _ in results:
+        assert status == 200 and headers[b'content-type'].startswith(b'text/event-stream')
+        assert _frames(content) == [
+            {'type': 'thinking', 'content': '思考'},
+            {'type': 'answer', 'content': '答'},
+            {'type': 'answer', 'content': '案'},
+            {'type': 'done', 'answer': '答案'},
+        ]
+    assert echo[0] == 200
+    # 每个流约 0.15s；串行需要 6s
+    assert elapsed < 2.0
+    assert echo_latency < elapsed
+    assert len(chat_upstream.requests) == streams
+    assert bridge.stats()['event_streams'] == streams and bridge.stats()['active_event_streams'] == 0
+
+
+def test_client_disconnect_cancels_the_stream():
+    closed = []
+
+    def endless():
+        try:
+            while True:
+                yield {'type': 'thinking', 'content': '…'}
+                yield Sleep(0.01)
+        finally:
+            closed.append(True)
+
+    bridge = ASGIBridge(_flask_app(endless).wsgi_app, resolve_client=None, threads=1)
+    status, _, content, _ = asyncio.run(_call(bridge, 'GET', '/stream', disconnect_after=3))
+
+    assert status == 200
+    assert 3 <= len(_frames(content)) <= 4
+    assert closed == [True]
+    assert bridge.stats()['disconnects'] == 1
+
+
+async def _send_messages(bridge, messages, headers=()):
+    sent = []
+    pending = list(messages)
+
+    async def receive():
+        return pending.pop(0) if pending else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http', 'path': '/echo',
+        'root_path': '', 'query_string': b'', 'headers': list(headers),
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5555),
+    }
+    await bridge(scope, receive, send)
+    return sent
+
+
+def test_oversized_bodies_are_rejected_before_dispatch():
+    calls = []
+    flask_app = _flask_app(lambda: iter(()))
+    flask_app.before_request(lambda: calls.append(True) and None)
+    bridge = ASGIBridge(flask_app.wsgi_app, resolve_client=None, threads=1, max_body_size=10)
+    chunk = {'type': 'http.request', 'body': b'{"a": 1234}', 'more_body': True}
+
+    declared = asyncio.run(_send_messages(bridge, [chunk], headers=[(b'content-length', b'1000')]))
+    streamed = asyncio.run(_send_messages(bridge, [chunk, chunk]))
+
+    for sent in (declared, streamed):
+        assert sent[0]['status'] == 413
+        assert json.loads(sent[1]['body']) == {'error': 'Request too large (max 10 bytes)'}
+    assert calls == []
+    assert bridge.stats()['rejected_bodies'] == 2
+
+
+def test_disconnect_while_reading_body_is_not_dispatched():
+    calls = []
+    flask_app = _flask_app(lambda: iter(()))
+    flask_app.before_request(lambda: calls.append(True) and None)
+    bridge = ASGIBridge(flask_app.wsgi_app, resolve_client=None, threads=1)
+    partial = {'type': 'http.request', 'body': b'{"question": ', 'more_body': True}
+
+    sent = asyncio.run(_send_messages(bridge, [partial, {'type': 'http.disconnect'}],
+                                      headers=[(b'content-type', b'application/json')]))
+
+    assert sent == [] and calls == []
+    assert bridge.stats()['aborted_requests'] == 1
+
+
+def test_pool_defaults_follow_the_asgi_concurrency(monkeypatch):
+    for name in ('MYSQL_POOL_SIZE', 'AI_MAX_CONNECTIONS', 'AI_MAX_KEEPALIVE', 'ASGI_MAX_STREAMS'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('ASGI_WSGI_THREADS', '32')
+    monkeypatch.setattr('os.cpu_count', lambda: 1)
+
+    configure_pool_defaults()
+
+    # 32 个 WSGI 线程 + 5 个 to_thread 线程都能拿到数据库连接；AI 连接数不低于并发流上限
+    assert os.environ['MYSQL_POOL_SIZE'] == '37'
+    assert os.environ['AI_MAX_CONNECTIONS'] == '1000'
+    assert os.environ['AI_MAX_KEEPALIVE'] == '250'
+
+
+def test_pool_defaults_keep_explicit_settings(monkeypatch):
+    monkeypatch.delenv('AI_MAX_KEEPALIVE', raising=False)
+    monkeypatch.setenv('MYSQL_POOL_SIZE', '8')
+    monkeypatch.setenv('AI_MAX_CONNECTIONS', '64')
+
+    configure_pool_defaults()
+
+    assert os.environ['MYSQL_POOL_SIZE'] == '8' and os.environ['AI_MAX_CONNECTIONS'] == '64'
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the content-addressed upload blob store."""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+from blob_store import BlobStore, S3BlobBackend
+from retention import RetentionWorker
+from session_store import FileSessionStore
+
+
+class NotFound(Exception):
+    def __init__(self):
+        super().__init__('NoSuchKey')
+        self.response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class InMemoryS3:
+    """S3-compatible stand-in exposing the subset of the boto3 client API the backend uses."""
+
+    def __init__(self):
+        self.objects = {}
+        self.copies = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body.read()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective):
+        source = (CopySource['Bucket'], CopySource['Key'])
+        if source not in self.objects:
+            raise NotFound()
+        self.objects[(Bucket, Key)] = self.objects[source]
+        self.copies.append(Key)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def _stage(directory, name, data):
+    path = directory / name
+    path.write_bytes(data)
+    return str(path), hashlib.sha256(data).hexdigest()
+
+
+def test_identical_uploads_are_stored_once_in_sharded_layout(tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    first_path, digest = _stage(tmp_path, 'a.png', b'same image')
+    second_path, _ = _stage(tmp_path, 'b.png', b'same image')
+
+    stored = store.put_file(first_path, digest)
+    assert store.put_file(second_path, digest) == stored
+
+    assert stored == os.path.join(str(tmp_path / 'blobs'), digest[:2], digest[2:4], digest)
+    assert not os.path.exists(first_path) and not os.path.exists(second_path)
+    stats = store.stats()
+    assert (stats['blobs'], stats['dedup_hits'], stats['bytes_deduplicated']) == (1, 1, len(b'same image'))
+
+
+def test_garbage_collection_keeps_blobs_with_live_references(tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'), gc_grace=-1)
+    referenced = store.put_file(*_stage(tmp_path, 'a.png', b'referenced'))
+    orphan = store.put_file(*_stage(tmp_path, 'b.png', b'orphan'))
+    digest = os.path.basename(referenced)
+    store.add_refs('session-1', [digest], ttl=60)
+    store.add_refs('session-2', [digest], ttl=-1)
+
+    result = store.collect_garbage()
+
+    assert store.refcount(digest) == 1
+    assert os.path.exists(referenced)
+    assert not os.path.exists(orphan)
+    assert result == {'removed': 1, 'bytes': len(b'orphan'), 'scanned': 1}
+
+
+def test_remote_backend_serves_blobs_missing_from_local_tier(tmp_path):
+    s3 = InMemoryS3()
+    store = BlobStore(str(tmp_path / 'blobs'), remote=S3BlobBackend('uploads', client=s3), gc_grace=-1)
+    path = store.put_file(*_stage(tmp_path, 'a.png', b'remote copy'))
+    digest = os.path.basename(path)
+    assert list(s3.objects) == [('uploads', f'uploads/{digest[:2]}/{digest[2:4]}/{digest}')]
+
+    os.remove(path)  # e.g. another instance, or the local tier was rebuilt
+    with open(store.local_path(digest), 'rb') as f:
+        assert f.read() == b'remote copy'
+
+    RetentionWorker(FileSessionStore(str(tmp_path / 'sessions'), ttl=60), str(tmp_path), upload_ttl=60,
+                    batch_pause=0, blob_store=store).run_once()
+    assert not os.path.exists(path)
+    # 远程对象可能仍被其它实例引用，只由存储桶生命周期规则过期
+    assert list(s3.objects) == [('uploads', f'uploads/{digest[:2]}/{digest[2:4]}/{digest}')]
+
+
+def test_gc_on_one_instance_keeps_remote_objects_other_instances_reference(tmp_path):
+    s3 = InMemoryS3()
+    first = BlobStore(str(tmp_path / 'first'), remote=S3BlobBackend('uploads', client=s3), gc_grace=-1)
+    second = BlobStore(str(tmp_path / 'second'), remote=S3BlobBackend('uploads', client=s3), gc_grace=-1)
+    first_path = first.put_file(*_stage(tmp_path, 'a.png', b'shared'))
+    digest = os.path.basename(first_path)
+    second_path = second.put_file(*_stage(tmp_path, 'b.png', b'shared'))
+    second.add_refs('session-on-second', [digest], ttl=60)
+    assert s3.copies == [f'uploads/{digest[:2]}/{digest[2:4]}/{digest}']  # 再次上传只刷新修改时间
+
+    assert first.collect_garbage()['removed'] == 1
+    assert not os.path.exists(first_path)
+
+    # 第一个实例不再引用，但远程对象仍在，第二个实例的本地副本也不受影响
+    assert os.path.exists(second_path)
+    os.remove(second_path)
+    with open(second.local_path(digest), 'rb') as f:
+        assert f.read() == b'shared'
+
+
+def test_copies_fetched_from_remote_are_collected_locally(tmp_path):
+    s3 = InMemoryS3()
+    writer = BlobStore(str(tmp_path / 'writer'), remote=S3BlobBackend('uploads', client=s3))
+    digest = os.path.basename(writer.put_file(*_stage(tmp_path, 'a.png', b'fetched')))
+    reader = BlobStore(str(tmp_path / 'reader'), remote=S3BlobBackend('uploads', client=s3), gc_grace=-1)
+
+    path = reader.local_path(digest)
+
+    assert reader.stats()['blobs'] == 1
+    assert reader.collect_garbage() == {'removed': 1, 'bytes': len(b'fetched'), 'scanned': 1}
+    assert not os.path.exists(path) and len(s3.objects) == 1
+
+
+def test_invalid_keys_are_rejected(tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    with pytest.raises(ValueError):
+        store.local_path('../../etc/passwd')
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the MySQL connection pool (no database required)."""
+
+import threading
+import time
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.in_transaction = False
+        self.pings = 0
+        self.rollbacks = 0
+        self.ping_fails = False
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.ping_fails:
+            raise RuntimeError("gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **kwargs), created
+
+
+def test_close_returns_connection_for_reuse():
+    pool, created = make_pool(size=2, ping_interval=60)
+    conn = pool.acquire()
+    assert conn.is_connected()
+    conn.close()
+    assert not conn.is_connected()
+
+    again = pool.acquire()
+    assert again._raw is created[0]
+    assert len(created) == 1
+    assert pool.stats()['in_use'] == 1
+
+
+def test_release_rolls_back_open_transaction():
+    pool, created = make_pool(size=1)
+    conn = pool.acquire()
+    created[0].in_transaction = True
+    conn.close()
+    assert created[0].rollbacks == 1
+
+
+def test_broken_idle_connection_is_replaced():
+    pool, created = make_pool(size=1, ping_interval=0)
+    pool.acquire().close()
+    created[0].ping_fails = True
+
+    conn = pool.acquire()
+    assert conn._raw is created[1]
+    assert created[0].closed
+    assert pool.stats()['broken'] == 1
+
+
+def test_connection_past_max_lifetime_is_recycled():
+    pool, created = make_pool(size=1, max_lifetime=0.01, ping_interval=60)
+    pool.acquire().close()
+    time.sleep(0.02)
+    conn = pool.acquire()
+    assert conn._raw is created[1]
+    assert pool.stats()['recycled'] == 1
+
+
+def test_borrow_timeout_when_exhausted():
+    pool, _ = make_pool(size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool, created = make_pool(size=1, timeout=2, ping_interval=60)
+    conn = pool.acquire()
+    result = {}
+
+    def borrow():
+        result['conn'] = pool.acquire()
+
+    t = threading.Thread(target=borrow)
+    t.start()
+    time.sleep(0.05)
+    conn.close()
+    t.join(timeout=2)
+
+    assert result['conn']._raw is created[0]
+    assert pool.stats()['waits'] == 1
+
+
+def test_unit_of_work_shares_one_connection_and_commits_once(monkeypatch):
+    import database
+
+    pool, created = make_pool(size=2, ping_interval=60)
+    commits = []
+    monkeypatch.setattr(database, "_pool", pool)
+
+    with database.unit_of_work() as uow:
+        first = database.get_db_connection(uow)
+        first.commit()
+        first.close()
+        second = database.get_db_connection(uow)
+        second.commit()
+        created[0].commit = lambda: commits.append(1)
+        uow.on_commit(lambda: commits.append("callback"))
+
+    assert len(created) == 1
+    assert commits == [1, "callback"]
+    assert pool.stats()['in_use'] == 0
+
+
+def test_unit_of_work_rolls_back_on_error(monkeypatch):
+    import database
+
+    pool, created = make_pool(size=1, ping_interval=60)
+    monkeypatch.setattr(database, "_pool", pool)
+
+    with pytest.raises(ValueError):
+        with database.unit_of_work() as uow:
+            database.get_db_connection(uow).commit()
+            uow.on_commit(lambda: pytest.fail("must not run"))
+            raise ValueError("boom")
+
+    assert created[0].rollbacks == 1
+    assert pool.stats()['in_use'] == 0
+
+
+def test_unit_of_work_rolls_back_when_a_helper_swallows_a_statement_error(monkeypatch):
+    import database
+    from mysql.connector import Error
+
+    class FailingCursor:
+        def execute(self, sql, params=()):
+            if sql.startswith('INSERT INTO goals'):
+                raise Error('Deadlock found')
+
+    pool, created = make_pool(size=1, ping_interval=60)
+    monkeypatch.setattr(database, "_pool", pool)
+    commits = []
+
+    def helper(uow, sql):
+        # 与 database.py 中的函数相同：捕获 Error 并返回失败结果
+        connection = database.get_db_connection(uow)
+        try:
+            connection.cursor().execute(sql)
+            connection.commit()
+            return {'success': True}
+        except Error:
+            connection.rollback()
+            return {'success': False}
+
+    with database.unit_of_work() as uow:
+        database.get_db_connection(uow)
+        created[0].cursor = lambda **kwargs: FailingCursor()
+        created[0].commit = lambda: commits.append(1)
+        assert helper(uow, 'INSERT INTO diaries VALUES (1)')['success']
+        uow.on_commit(lambda: commits.append("callback"))
+        assert not helper(uow, 'INSERT INTO goals VALUES (1)')['success']
+        assert uow.failed
+
+    assert commits == []
+    assert created[0].rollbacks == 1
+    assert pool.stats()['in_use'] == 0
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for keyset (cursor) pagination of diaries (no database required)."""
+
+from datetime import datetime
+
+import pytest
+
+import database
+from database import decode_diary_cursor, encode_diary_cursor, get_user_diaries_by_cursor
+
+
+class FakeCursor:
+    """Applies the keyset query (user filter, (created_at, id) < cursor, DESC order, LIMIT) to `rows`."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = []
+        self._result = []
+
+    def execute(self, sql, params=()):
+        self.params.append(params)
+        if len(params) == 5:
+            user_id, created_at, _, diary_id, limit = params
+            rows = [r for r in self.rows if (r['created_at'], r['id']) < (created_at, diary_id)]
+        else:
+            user_id, limit = params
+            rows = list(self.rows)
+        rows = sorted((r for r in rows if r['user_id'] == user_id), key=lambda r: (r['created_at'], r['id']),
+                      reverse=True)
+        self._result = [{'id': r['id'], 'created_at': r['created_at']} for r in rows[:limit]]
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, **kwargs):
+        return self._cursor
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    token = encode_diary_cursor(created_at, 42)
+
+    assert '=' not in token and '|' not in token
+    assert decode_diary_cursor(token) == (created_at, 42)
+
+
+@pytest.mark.parametrize('token', ['not-base64!', 'bm8tc2VwYXJhdG9y', encode_diary_cursor(datetime(2024, 1, 1), 1)[:-3]])
+def test_malformed_cursor_raises_value_error(token):
+    with pytest.raises(ValueError):
+        decode_diary_cursor(token)
+
+
+def test_pages_break_timestamp_ties_by_id_and_end_without_cursor(monkeypatch):
+    same = datetime(2024, 5, 1, 12, 0, 0)
+    rows = [{'id': i, 'user_id': 7, 'created_at': same} for i in range(1, 6)]
+    rows += [{'id': 6, 'user_id': 7, 'created_at': datetime(2024, 4, 30)},
+             {'id': 7, 'user_id': 8, 'created_at': same}]
+    cursor = FakeCursor(rows)
+    monkeypatch.setattr(database, 'get_db_connection', lambda uow=None: FakeConnection(cursor))
+
+    pages, page_cursor = [], None
+    while True:
+        diaries, page_cursor = get_user_diaries_by_cursor(7, limit=2, page_cursor=page_cursor)
+        pages.append([d['id'] for d in diaries])
+        if page_cursor is None:
+            break
+
+    # 同一时间戳的日记按 id 倒序，跨页既不重复也不遗漏
+    assert pages == [[5, 4], [3, 2], [1, 6]]
+    # 每页多取一条判断是否还有下一页
+    assert [params[-1] for params in cursor.params] == [3, 3, 3]
+
+
+def test_exact_last_page_has_no_next_cursor(monkeypatch):
+    rows = [{'id': i, 'user_id': 7, 'created_at': datetime(2024, 5, i)} for i in range(1, 3)]
+    monkeypatch.setattr(database, 'get_db_connection', lambda uow=None: FakeConnection(FakeCursor(rows)))
+
+    diaries, next_cursor = get_user_diaries_by_cursor(7, limit=2)
+
+    assert [d['id'] for d in diaries] == [2, 1] and next_cursor is None
+
+
+def test_api_rejects_malformed_cursor_with_400():
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = 7
+
+    response = client.get('/api/diaries?cursor=not-a-cursor')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': '无效的分页游标'}
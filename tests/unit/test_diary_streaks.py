@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for incremental diary streak updates (no database required)."""
+
+from datetime import date, timedelta
+
+from database import _record_diary_activity
+
+
+class FakeCursor:
+    """Answers the streak queries from an in-memory `streak_row` and `diary_dates`."""
+
+    def __init__(self, streak_row, diary_dates):
+        self.streak_row = streak_row
+        self.diary_dates = diary_dates
+        self.statements = []
+        self._result = []
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.statements.append((sql, params))
+        if sql.startswith('SELECT 1 FROM diary_streaks'):
+            self._result = [self.streak_row] if self.streak_row else []
+        elif sql.startswith('SELECT DATE(created_at)'):
+            self._result = [(d, i) for i, d in enumerate(self.diary_dates, start=1)]
+        else:
+            self._result = []
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, **kwargs):
+        return self._cursor
+
+
+def test_first_write_without_streak_row_rebuilds_history():
+    today = date.today()
+    history = [today, today - timedelta(days=1), today - timedelta(days=2), today - timedelta(days=5)]
+    cursor = FakeCursor(streak_row=None, diary_dates=history)
+
+    _record_diary_activity(FakeConnection(cursor), cursor, user_id=7, diary_id=42)
+
+    upsert = [params for sql, params in cursor.statements if sql.startswith('INSERT INTO diary_streaks')]
+    assert upsert == [(7, 3, 3, today, 1)]
+    assert not any(sql.startswith('UPDATE diary_streaks') for sql, _ in cursor.statements)
+
+
+def test_existing_streak_row_is_updated_incrementally():
+    cursor = FakeCursor(streak_row=(1,), diary_dates=[])
+
+    _record_diary_activity(FakeConnection(cursor), cursor, user_id=7, diary_id=42)
+
+    kinds = [sql.split(' ')[0] for sql, _ in cursor.statements]
+    assert kinds == ['SELECT', 'UPDATE']
+    assert cursor.statements[-1][1] == (42, 7)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the content-addressed image encoding cache."""
+
+import io
+
+from PIL import Image
+
+from doubao_api import DoubaoClient
+from image_cache import ImageEncodingCache
+from image_dedup import PerceptualHashIndex
+
+
+def test_memory_tier_evicts_least_recently_used_by_size():
+    cache = ImageEncodingCache(memory_bytes=10)
+    cache.set('a', 'x' * 4)
+    cache.set('b', 'y' * 4)
+    cache.get('a')
+    cache.set('c', 'z' * 4)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x' * 4
+    assert cache.stats()['memory_evictions'] == 1
+
+
+def test_disk_tier_survives_restart_and_is_size_bounded(tmp_path):
+    cache = ImageEncodingCache(memory_bytes=1024, disk_dir=str(tmp_path), disk_bytes=10)
+    cache.set('a', 'x' * 6)
+    cache.set('b', 'y' * 6)
+    assert not (tmp_path / 'a.txt').exists()
+
+    restarted = ImageEncodingCache(memory_bytes=1024, disk_dir=str(tmp_path), disk_bytes=10)
+    assert restarted.get('b') == 'y' * 6
+    assert restarted.stats()['disk_hits'] == 1
+    assert restarted.get('b') == 'y' * 6
+    assert restarted.stats()['memory_hits'] == 1
+
+
+def test_encode_image_reuses_cached_result_for_identical_bytes(tmp_path, monkeypatch):
+    buffer = io.BytesIO()
+    Image.new('RGB', (2048, 1024), 'white').save(buffer, format='PNG')
+    first = tmp_path / 'first.png'
+    second = tmp_path / 'copy.png'
+    first.write_bytes(buffer.getvalue())
+    second.write_bytes(buffer.getvalue())
+
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    client = DoubaoClient(
+        image_cache=ImageEncodingCache(disk_dir=str(tmp_path / 'cache')), phash_index=PerceptualHashIndex()
+    )
+    data_url = client.encode_image(str(first))
+
+    assert data_url.startswith('data:image/jpeg;base64,')
+    assert client.encode_image(str(second)) == data_url
+    assert client.image_cache.stats()['memory_hits'] == 1
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for perceptual-hash near-duplicate detection."""
+
+import hashlib
+import io
+import random
+import threading
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+import image_processing
+from image_dedup import HASH_BITS, PerceptualHashIndex, perceptual_hash
+
+
+def _page(seed, width=1200, height=1600):
+    rng = random.Random(seed)
+    img = Image.new('RGB', (width, height), (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    y = 80
+    while y < height - 100:
+        words = ' '.join(rng.choice(['F=ma', '质量', '加速度', '求', 'x+y', '已知', 'v=at']) for _ in range(rng.randint(3, 12)))
+        draw.text((60 + rng.randint(0, 200), y), words, fill=(20, 20, 20), font=font)
+        y += rng.randint(60, 160)
+    return img
+
+
+def _jpeg(img, quality=90):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _flip_bits(phash, count):
+    value = int(phash, 16)
+    for bit in range(count):
+        value ^= 1 << (bit * 7)
+    return f'{value:0{HASH_BITS // 4}x}'
+
+
+def test_index_finds_hashes_within_distance_only():
+    index = PerceptualHashIndex(max_distance=10)
+    base = perceptual_hash(_page(1))
+    index.add(base, 'canonical')
+
+    assert index.find(_flip_bits(base, 10)) == ('canonical', 10)
+    assert index.find(_flip_bits(base, 11)) is None
+    assert index.find(base, 'canonical') == ('canonical', 0)
+    assert index.stats()['near_hits'] == 1
+
+
+def test_index_persists_and_evicts_oldest(tmp_path):
+    path = str(tmp_path / 'phash.db')
+    index = PerceptualHashIndex(path=path, max_distance=20, max_entries=2)
+    hashes = [perceptual_hash(_page(seed)) for seed in range(3)]
+    for seed, phash in enumerate(hashes):
+        index.add(phash, f'sha{seed}')
+    index.close()
+
+    reloaded = PerceptualHashIndex(path=path, max_distance=20, max_entries=2)
+    assert reloaded.stats()['entries'] == 2
+    assert reloaded.find(hashes[0]) is None
+    assert reloaded.find(hashes[2]) == ('sha2', 0)
+
+
+def test_near_duplicate_upload_keeps_its_own_hash(tmp_path, monkeypatch):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+
+    monkeypatch.setenv('IMAGE_WORKERS', '0')
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    index = PerceptualHashIndex(max_distance=20)
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=index)
+    page = _page(7)
+    original = _jpeg(page)
+    retaken = _jpeg(ImageEnhance.Brightness(page.resize((900, 1200))).enhance(1.1), quality=70)
+    other = _jpeg(_page(8))
+    paths = []
+    for name, raw in [('a.jpg', original), ('b.jpg', retaken), ('c.jpg', other)]:
+        (tmp_path / name).write_bytes(raw)
+        paths.append(str(tmp_path / name))
+    digests = [hashlib.sha256(raw).hexdigest() for raw in (original, retaken, other)]
+
+    hashing_threads = []
+
+    def recording_hash(img):
+        hashing_threads.append(threading.current_thread())
+        return perceptual_hash(img)
+
+    monkeypatch.setattr(image_processing, 'perceptual_hash', recording_hash)
+
+    first = client.preprocess_images(paths[:1], digests[:1])
+    # 等待后台编码（以及索引登记）完成
+    image_processing.shutdown_image_executor()
+    second = client.preprocess_images(paths[1:], digests[1:])
+    image_processing.shutdown_image_executor()
+
+    assert first == digests[:1]
+    # 感知哈希在后台编码中计算，上传请求的线程不解码图片
+    assert len(hashing_threads) == 3
+    assert threading.current_thread() not in hashing_threads
+    # 近似图片只计入统计，编码缓存仍按各自的内容哈希区分
+    assert second == digests[1:]
+    assert index.stats()['near_hits'] == 1
+    payloads = client.encode_images(paths, image_hashes=digests)
+    assert payloads[0]['url'] != payloads[1]['url']
+    assert payloads[0]['phash'] != payloads[1]['phash']
+    image_processing.shutdown_image_executor()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for parallel image preprocessing."""
+
+import base64
+import hashlib
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import image_processing
+
+
+def _png(width, height, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _size(data_url):
+    raw = base64.b64decode(data_url.split(',', 1)[1])
+    with Image.open(io.BytesIO(raw)) as img:
+        return img.format, img.size
+
+
+@pytest.fixture(params=['0', '2'], ids=['inline', 'pool'])
+def workers(request, monkeypatch):
+    monkeypatch.setenv('IMAGE_WORKERS', request.param)
+    yield
+    image_processing.shutdown_image_executor()
+
+
+def test_compress_many_preserves_order_and_reports_errors(workers):
+    raws = [_png(2048, 1024, 'red'), b'not an image', _png(300, 600, 'blue')]
+
+    results = image_processing.compress_many(raws, max_size=1024, quality=85)
+
+    assert _size(results[0]) == ('JPEG', (1024, 512))
+    assert isinstance(results[1], Exception)
+    assert _size(results[2]) == ('JPEG', (300, 600))
+
+
+def test_exif_orientation_is_applied():
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    Image.new('RGB', (400, 200), 'green').save(buffer, format='JPEG', exif=exif)
+
+    assert _size(image_processing.compress_to_data_url(buffer.getvalue())) == ('JPEG', (200, 400))
+
+
+def test_upload_preprocessing_is_used_by_encode_images(tmp_path, monkeypatch):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+    from image_dedup import PerceptualHashIndex
+
+    monkeypatch.setenv('IMAGE_WORKERS', '0')
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=PerceptualHashIndex())
+    raw = _png(2048, 2048, 'white')
+    path = tmp_path / 'upload.png'
+    path.write_bytes(raw)
+
+    hashes = client.preprocess_images([str(path)], [hashlib.sha256(raw).hexdigest()])
+    image_processing.wait_for_preprocessed(client._image_cache_key(hashes[0]), timeout=30)
+    path.unlink()  # the stream must not need to re-read the upload
+
+    [payload] = client.encode_images([str(path)], image_hashes=hashes)
+    assert _size(payload['url']) == ('JPEG', (768, 768))  # no text: downscaled, detail=low
+    assert payload['detail'] == 'low'
+    image_processing.shutdown_image_executor()
+
+
+def test_large_rotated_jpeg_uses_draft_decode_and_keeps_orientation():
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (4000, 2000), 'green').save(buffer, format='JPEG', exif=exif)
+
+    assert _size(image_processing.compress_to_data_url(buffer.getvalue())) == ('JPEG', (512, 1024))
+
+
+def _worksheet(width=3024, height=4032):
+    img = Image.new('RGB', (width, height), (245, 245, 240))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=60)
+    for y in range(100, height - 100, 110):
+        draw.text((100, y), '已知 F = ma, m = 2kg, a = 3m/s^2 求 F 的大小 x+y=12', fill=(20, 20, 20), font=font)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def test_adaptive_encoding_keeps_resolution_for_text_and_shrinks_photos():
+    options = image_processing.EncodingOptions(adaptive=True)
+
+    text = image_processing.encode_payload(_worksheet(), options)
+    photo = image_processing.encode_payload(_png(2048, 1536, 'skyblue'), options)
+
+    assert (text['detail'], max(text['width'], text['height'])) == ('low', 1024)
+    assert (photo['detail'], photo['width']) == ('low', 768)
+    assert photo['quality'] < options.quality
+
+
+def test_high_detail_for_text_is_opt_in():
+    options = image_processing.EncodingOptions(adaptive=True, high_detail=True)
+
+    text = image_processing.encode_payload(_worksheet(), options)
+    photo = image_processing.encode_payload(_png(2048, 1536, 'skyblue'), options)
+
+    assert (text['detail'], photo['detail']) == ('high', 'low')
+    assert options.cache_tag() != image_processing.EncodingOptions(adaptive=True).cache_tag()
+
+
+def test_adaptive_encoding_fits_multi_image_byte_budget():
+    options = image_processing.EncodingOptions(adaptive=True, image_count=9, byte_budget=60 * 1024)
+
+    payload = image_processing.encode_payload(_worksheet(), options)
+
+    assert payload['bytes'] <= options.byte_budget
+    assert max(payload['width'], payload['height']) >= image_processing.MIN_TEXT_SIZE
+    assert payload['detail'] == 'low'
+
+
+def test_chat_message_uses_payload_detail_and_records_bytes_sent(monkeypatch):
+    from doubao_api import DoubaoClient
+
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    before = image_processing.get_payload_stats()
+    payloads = [{'url': 'data:image/jpeg;base64,AAAA', 'detail': 'high', 'format': 'JPEG'}, 'data:image/png;base64,BB']
+
+    messages = DoubaoClient().create_chat_message_with_image('题目', payloads, 'physics')
+
+    assert [part['image_url']['detail'] for part in messages[1]['content'][:2]] == ['high', 'low']
+    after = image_processing.get_payload_stats()
+    assert after['images'] - before['images'] == 2
+    assert after['bytes_sent'] - before['bytes_sent'] == len(payloads[0]['url']) + len(payloads[1])
+
+
+def test_small_jpeg_data_url_is_passed_through_without_transcoding(monkeypatch):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+    from image_dedup import PerceptualHashIndex
+
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), 'skyblue').save(buffer, format='JPEG', quality=80)
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=PerceptualHashIndex())
+
+    [payload] = client.encode_images([data_url])
+
+    assert payload['passthrough'] is True
+    assert payload['url'] is data_url
+    assert client.image_cache.stats()['misses'] == 0
+
+
+@pytest.mark.parametrize('make_image', [
+    lambda: _png(2048, 1024, 'red'),  # not a JPEG
+    lambda: _worksheet(),  # JPEG larger than the size limit
+], ids=['png', 'large-jpeg'])
+def test_in_memory_images_that_need_work_are_encoded(monkeypatch, make_image):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+    from image_dedup import PerceptualHashIndex
+
+    monkeypatch.setenv('IMAGE_WORKERS', '0')
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=PerceptualHashIndex())
+
+    [from_bytes, from_buffer] = client.encode_images([make_image(), io.BytesIO(make_image())])
+
+    assert 'passthrough' not in from_bytes
+    assert from_buffer['url'] == from_bytes['url']
+    assert _size(from_bytes['url'])[0] == 'JPEG'
+
+
+def test_rotated_jpeg_is_not_passed_through():
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (400, 200), 'green').save(buffer, format='JPEG', exif=exif)
+
+    assert image_processing.passthrough_payload(buffer.getvalue()) is None
+
+
+def _png_header(width, height):
+    """A PNG whose header claims the given size; the pixel data is never read when probing."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(b'\x00')) + chunk(b'IEND', b'')
+
+
+@pytest.mark.parametrize('raw, message', [
+    (_png_header(60000, 60000), 'Image dimensions too large'),
+    (_png_header(12000, 12000), 'Image dimensions too large'),
+    (b'GIF89a' + b'\x00' * 4, 'Unrecognized or corrupt image'),
+    (b'not an image at all', 'Unrecognized or corrupt image'),
+])
+def test_probe_rejects_bombs_and_garbage_without_decoding(raw, message):
+    with pytest.raises(image_processing.ImageValidationError, match=message):
+        image_processing.probe_image(raw)
+
+
+def test_raw_fallback_is_bounded_and_counted(monkeypatch):
+    from doubao_api import DoubaoClient
+    from image_cache import ImageEncodingCache
+    from image_dedup import PerceptualHashIndex
+
+    monkeypatch.setenv('IMAGE_WORKERS', '0')
+    monkeypatch.delenv('DOUBAO_API_KEY', raising=False)
+    truncated = _worksheet()[:60000]  # valid header, pixel data cut off
+    client = DoubaoClient(image_cache=ImageEncodingCache(), phash_index=PerceptualHashIndex())
+    before = image_processing.get_payload_stats()
+
+    client.image_raw_fallback_max_bytes = 1024
+    with pytest.raises(image_processing.ImageValidationError, match='could not be processed'):
+        client.encode_images([truncated])
+    client.image_raw_fallback_max_bytes = 1024 * 1024
+    [payload] = client.encode_images([truncated])
+
+    assert payload['format'] == 'raw'
+    after = image_processing.get_payload_stats()
+    assert after['raw_fallbacks_rejected'] - before['raw_fallbacks_rejected'] == 1
+    assert after['raw_fallback_bytes'] - before['raw_fallback_bytes'] == len(truncated)
+    assert after['encode_failures'] - before['encode_failures'] == 2
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Unit tests checking that image producers resolve blob paths only inside Blocking instructions."""
+
+import pytest
+
+import app as app_module
+from llm_stream import Blocking
+
+
+class RecordingBlobStore:
+    def __init__(self):
+        self.calls = []
+
+    def local_path(self, digest):
+        self.calls.append(digest)
+        return f'/blobs/{digest}'
+
+
+@pytest.mark.parametrize('producer, query_type', [
+    (app_module.generate_image_stream_response, 'image'),
+    (app_module.generate_deep_think_response, 'image_deep'),
+])
+def test_producer_body_performs_no_blob_io(monkeypatch, producer, query_type):
+    blob_store = RecordingBlobStore()
+    built = []
+    monkeypatch.setattr(app_module, 'get_blob_store', lambda: blob_store)
+    monkeypatch.setattr(app_module.doubao_client, 'build_stream_messages', lambda **kwargs: built.append(kwargs) or [])
+    session_data = {'subject': 'physics', 'question': '题目', 'type': query_type,
+                    'upload_hashes': ['aa', 'bb'], 'image_hashes': ['p1', 'p2']}
+
+    generator = producer(session_data)
+    instruction = next(generator)
+    while isinstance(instruction, dict):
+        instruction = generator.send(None)
+
+    # 生成器运行到第一个阻塞指令时还没有访问存储（adrive 在事件循环上推进生成器）
+    assert isinstance(instruction, Blocking)
+    assert blob_store.calls == [] and built == []
+
+    instruction()
+
+    assert blob_store.calls == ['aa', 'bb']
+    assert built[0]['image_paths'] == ['/blobs/aa', '/blobs/bb']
+    assert built[0]['image_hashes'] == ['p1', 'p2']
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the sync and async producer drivers."""
+
+import asyncio
+
+from ai_clients import AIClientRegistry
+from llm_stream import Blocking, ChatStream, Coalesce, adrive, drive
+from single_flight import AsyncSingleFlight
+
+EXPECTED_EVENTS = [
+    {'type': 'thinking', 'content': '思考'},
+    {'type': 'answer', 'content': '答'},
+    {'type': 'answer', 'content': '案'},
+]
+
+
+def _drain(generator):
+    events = []
+    while True:
+        try:
+            events.append(next(generator))
+        except StopIteration as stop:
+            return events, stop.value
+
+
+def _answer(question):
+    prompt = yield Blocking(str.upper, question)
+    yield {'type': 'stage', 'stage': 'solving'}
+    contents = yield ChatStream('fake', {'model': 'm', 'messages': [{'role': 'user', 'content': prompt}]})
+    return contents
+
+
+async def _adrain(producer, resolve_client, flights=None):
+    events = []
+
+    async def emit(event):
+        events.append(event)
+
+    response = await adrive(producer, resolve_client, emit, flights)
+    return events, response
+
+
+def test_sync_and_async_drivers_run_the_same_producer(chat_upstream):
+    registry = AIClientRegistry(http2=False)
+
+    def client(provider):
+        return registry.client(provider, api_key='key', base_url=chat_upstream.base_url)
+
+    def async_client(provider):
+        return registry.async_client(provider, api_key='key', base_url=chat_upstream.base_url)
+
+    expected = ([{'type': 'stage', 'stage': 'solving'}] + EXPECTED_EVENTS, {'thinking': '思考', 'answer': '答案'})
+    assert _drain(drive(_answer('q'), client)) == expected
+    assert asyncio.run(_adrain(_answer('q'), async_client)) == expected
+    assert [request['messages'][0]['content'] for request in chat_upstream.requests] == ['Q', 'Q']
+    assert all(request['stream'] for request in chat_upstream.requests)
+    assert set(registry.stats()['providers']) == {'fake', 'fake_async'}
+
+
+def test_failures_are_thrown_back_into_the_producer():
+    def unconfigured(provider):
+        raise RuntimeError(f'{provider} is not configured')
+
+    def producer():
+        try:
+            yield ChatStream('deepseek', {'model': 'm', 'messages': []})
+        except RuntimeError as e:
+            yield {'type': 'error', 'message': str(e)}
+        return 'handled'
+
+    expected = ([{'type': 'error', 'message': 'deepseek is not configured'}], 'handled')
+    assert _drain(drive(producer(), unconfigured)) == expected
+    assert asyncio.run(_adrain(producer(), unconfigured)) == expected
+
+
+def test_async_coalesce_shares_one_upstream_stream(chat_upstream):
+    chat_upstream.delay = 0.05
+    registry = AIClientRegistry(http2=False)
+    completed = []
+
+    def async_client(provider):
+        return registry.async_client(provider, api_key='key', base_url=chat_upstream.base_url)
+
+    def request():
+        response = yield Coalesce('key', lambda: _answer('q'), lambda events, result: completed.append(result))
+        yield {'type': 'done'}
+        return response
+
+    async def main():
+        flights = AsyncSingleFlight(wait_timeout=5)
+        results = await asyncio.gather(*(_adrain(request(), async_client, flights) for _ in range(5)))
+        return results, flights.stats()
+
+    results, stats = asyncio.run(main())
+    expected = [{'type': 'stage', 'stage': 'solving'}] + EXPECTED_EVENTS + [{'type': 'done'}]
+    assert results == [(expected, {'thinking': '思考', 'answer': '答案'})] * 5
+    assert len(chat_upstream.requests) == 1
+    assert completed == [{'thinking': '思考', 'answer': '答案'}]
+    assert stats == {'flights': 1, 'coalesced': 4, 'late_joins': 0, 'errors': 0, 'in_flight': 0}
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for classified login lookups (no database required)."""
+
+import re
+
+import pytest
+
+import database
+from database import classify_account, hash_password, login_user
+
+USERS = [
+    # 姓名恰好是另一个用户的邮箱/手机号时，账号会同时匹配多行
+    {'id': 1, 'name': 'bob@example.com', 'email': 'first@example.com', 'phone': '13800000001'},
+    {'id': 2, 'name': 'alice', 'email': 'bob@example.com', 'phone': '13800000002'},
+    {'id': 3, 'name': '13800000004', 'email': 'third@example.com', 'phone': '13800000003'},
+    {'id': 4, 'name': 'carol', 'email': 'carol@example.com', 'phone': '13800000004'},
+    {'id': 5, 'name': 'alice', 'email': 'alice@example.com', 'phone': '13800000005'},
+]
+
+
+class FakeCursor:
+    """Evaluates the UNION ALL probe query over USERS, honouring each ORDER BY ... LIMIT clause."""
+
+    def __init__(self, users):
+        self.users = users
+        self.queries = []
+        self._row = None
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.queries.append(sql)
+        parts = re.findall(r'\((SELECT .+? FROM users WHERE (\w+) = %s( ORDER BY id)? LIMIT 1)\)', sql)
+        assert parts and len(parts) == len(params)
+        rows = []
+        for (_, column, ordered), value in zip(parts, params):
+            # 没有 ORDER BY 时按存储顺序（倒序插入，模拟不按主键返回）
+            matches = [user for user in reversed(self.users) if user[column] == value]
+            if ordered:
+                matches.sort(key=lambda user: user['id'])
+            rows.extend(matches[:1])
+        outer = sql.rsplit(')', 1)[1]
+        assert outer.strip() == 'ORDER BY id LIMIT 1'
+        rows.sort(key=lambda user: user['id'])
+        self._row = dict(rows[0], password_hash=hash_password('pw')) if rows else None
+
+    def fetchone(self):
+        return self._row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self, **kwargs):
+        return self._cursor
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _legacy_or_lookup(account):
+    """原查询 WHERE name = %s OR email = %s OR phone = %s：按主键顺序的第一行"""
+    matches = [user for user in USERS if account in (user['name'], user['email'], user['phone'])]
+    return min(matches, key=lambda user: user['id'])['id'] if matches else None
+
+
+@pytest.mark.parametrize('account, kind', [
+    ('student@example.com', 'email'),
+    ('13800138000', 'phone'),
+    ('+86 138-0013-8000', 'phone'),
+    ('alice', 'name'),
+    ('张三', 'name'),
+    ('1234', 'name'),  # 太短，不是手机号
+    ('', 'name'),
+])
+def test_classify_account(account, kind):
+    assert classify_account(account) == kind
+
+
+@pytest.mark.parametrize('account', [
+    'bob@example.com', 'alice', '13800000004', '13800000003', 'carol', 'first@example.com', 'nobody',
+])
+def test_probe_lookup_matches_the_legacy_or_query(monkeypatch, account):
+    cursor = FakeCursor(USERS)
+    monkeypatch.setattr(database, 'get_db_connection', lambda uow=None: FakeConnection(cursor))
+
+    result = login_user(account, 'pw')
+
+    expected = _legacy_or_lookup(account)
+    assert (result['user']['id'] if result['success'] else None) == expected
+    if result['success']:
+        assert 'password_hash' not in result['user']
+    probed = re.findall(r'WHERE (\w+) = %s', cursor.queries[0])
+    assert probed == list(database._LOGIN_PROBES[classify_account(account)])
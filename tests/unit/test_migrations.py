@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the schema migration runner (no database required)."""
+
+import types
+
+import pytest
+from mysql.connector import Error
+
+import migrations
+from migrations import Migration, SchemaOutdatedError, apply_migrations, discover_migrations, ensure_schema_current
+
+
+class FakeDatabase:
+    """Holds the state of schema_migrations and the named lock across connections."""
+
+    def __init__(self, lock_result=1):
+        self.lock_result = lock_result
+        self.version_table = False
+        self.versions = {}
+        self.commits = 0
+        self.statements = []
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._row = None
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        self.db.statements.append(sql)
+        self._row = None
+        if sql.startswith('SELECT GET_LOCK'):
+            self._row = (self.db.lock_result,)
+        elif sql.startswith('SELECT RELEASE_LOCK'):
+            self._row = (1,)
+        elif sql.startswith('CREATE TABLE IF NOT EXISTS schema_migrations'):
+            self.db.version_table = True
+        elif sql.startswith('SELECT MAX(version) FROM schema_migrations'):
+            if not self.db.version_table:
+                raise Error(msg="Table 'schema_migrations' doesn't exist", errno=1146)
+            self._row = (max(self.db.versions) if self.db.versions else None,)
+        elif sql.startswith('INSERT INTO schema_migrations'):
+            version, name = params
+            assert version not in self.db.versions
+            self.db.versions[version] = name
+
+    def fetchone(self):
+        return self._row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _migration(version, log, fail=False):
+    def upgrade(cursor):
+        if fail:
+            raise Error(msg='boom')
+        log.append(version)
+    return Migration(version, f'{version:04d}_test', types.SimpleNamespace(DESCRIPTION='test', upgrade=upgrade))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(migrations, 'get_db_connection', lambda: FakeConnection(db))
+    return db
+
+
+def _use(monkeypatch, items):
+    monkeypatch.setattr(migrations, 'discover_migrations', lambda: items)
+
+
+def test_discovered_migrations_are_ordered_by_version():
+    versions = [m.version for m in discover_migrations()]
+
+    assert versions == sorted(versions) and len(versions) == len(set(versions))
+    assert versions[0] == 1
+
+
+def test_applies_pending_migrations_in_order_and_records_versions(db, monkeypatch):
+    log = []
+    _use(monkeypatch, [_migration(1, log), _migration(2, log), _migration(3, log)])
+
+    assert apply_migrations() == [1, 2, 3]
+    assert log == [1, 2, 3]
+    assert db.versions == {1: '0001_test', 2: '0002_test', 3: '0003_test'}
+    # 每个迁移单独提交
+    assert db.commits == 3
+
+
+def test_rerun_is_idempotent(db, monkeypatch):
+    log = []
+    _use(monkeypatch, [_migration(1, log), _migration(2, log)])
+    apply_migrations()
+
+    assert apply_migrations() == []
+    assert log == [1, 2]
+
+
+def test_target_stops_early_and_later_run_continues(db, monkeypatch):
+    log = []
+    _use(monkeypatch, [_migration(1, log), _migration(2, log), _migration(3, log)])
+
+    assert apply_migrations(target=2) == [1, 2]
+    assert apply_migrations() == [3]
+
+
+def test_lock_not_acquired_applies_nothing(db, monkeypatch):
+    log = []
+    db.lock_result = 0
+    _use(monkeypatch, [_migration(1, log)])
+
+    with pytest.raises(RuntimeError, match='lock'):
+        apply_migrations()
+    assert log == [] and db.versions == {}
+    assert not any(sql.startswith('SELECT RELEASE_LOCK') for sql in db.statements)
+
+
+def test_lock_released_when_a_migration_fails(db, monkeypatch):
+    log = []
+    _use(monkeypatch, [_migration(1, log), _migration(2, log, fail=True), _migration(3, log)])
+
+    with pytest.raises(Error):
+        apply_migrations()
+    # 失败前已提交的迁移保留，失败的迁移不记录版本
+    assert db.versions == {1: '0001_test'}
+    assert db.statements[0].startswith('SELECT GET_LOCK')
+    assert db.statements[-1].startswith('SELECT RELEASE_LOCK')
+
+
+def test_ensure_schema_current_refuses_outdated_schema(db, monkeypatch):
+    log = []
+    _use(monkeypatch, [_migration(1, log), _migration(2, log)])
+    apply_migrations(target=1)
+
+    with pytest.raises(SchemaOutdatedError):
+        ensure_schema_current()
+
+    ensure_schema_current(auto_migrate=True)
+    assert sorted(db.versions) == [1, 2]
+    ensure_schema_current()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for personalization cache behaviour inside a unit of work (no database required)."""
+
+import re
+
+import database
+from database import get_user_personalization, unit_of_work, update_user_personalization
+
+
+class FakeCursor:
+    """Serves `UPDATE users SET ...` and `SELECT ... FROM users` against one in-memory row."""
+
+    def __init__(self, row, on_select=None):
+        self.row = row
+        self.on_select = on_select
+        self._result = None
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        if sql.startswith('UPDATE users SET'):
+            columns = re.findall(r'(\w+) = %s', sql.split(' WHERE ')[0])
+            self.row.update(zip(columns, params))
+            self._result = None
+        elif sql.startswith('SELECT') and 'FROM users' in sql:
+            self._result = dict(self.row)
+            if self.on_select is not None:
+                self.on_select()
+
+    def fetchone(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, row):
+        self.row = row
+        self.commits = 0
+        self.on_select = None
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.row, self.on_select)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, row):
+        self.connection = FakeConnection(row)
+
+    def acquire(self):
+        return self.connection
+
+
+def _row():
+    return {
+        'physics_score': None, 'chemistry_score': None, 'personalization_enabled': 1,
+        'default_explain_level': 'standard', 'learning_profile_json': None, 'learning_profile_updated_at': None,
+    }
+
+
+def test_read_after_write_in_unit_of_work_bypasses_cache(monkeypatch):
+    row = _row()
+    pool = FakePool(row)
+    monkeypatch.setattr(database, 'get_pool', lambda: pool)
+    database._personalization_cache.invalidate(7)
+
+    with unit_of_work() as uow:
+        assert update_user_personalization(7, default_explain_level='basic', uow=uow)['success']
+        # 并发请求在提交前用旧值回填了缓存
+        database._personalization_cache.set(7, dict(row, default_explain_level='standard'))
+
+        result = get_user_personalization(7, uow=uow)
+
+    assert result['data']['default_explain_level'] == 'basic'
+    assert pool.connection.commits == 1
+    # 提交后缓存被失效，工作单元外的读取也看到新值
+    assert get_user_personalization(7)['data']['default_explain_level'] == 'basic'
+
+
+def test_reader_does_not_recache_rows_read_before_a_concurrent_write(monkeypatch):
+    row = _row()
+    pool = FakePool(row)
+    monkeypatch.setattr(database, 'get_pool', lambda: pool)
+    database._personalization_cache.invalidate(8)
+
+    def concurrent_write():
+        # 读者已读到旧行，写入方此时提交并失效缓存
+        pool.connection.on_select = None
+        assert update_user_personalization(8, default_explain_level='basic')['success']
+
+    pool.connection.on_select = concurrent_write
+    assert get_user_personalization(8)['data']['default_explain_level'] == 'standard'
+
+    assert database._personalization_cache.get(8) is None
+    assert get_user_personalization(8)['data']['default_explain_level'] == 'basic'
+
+
+def test_cached_learning_profile_is_not_shared_between_callers(monkeypatch):
+    row = dict(_row(), learning_profile_json='{"weak_topics": ["受力分析"]}')
+    monkeypatch.setattr(database, 'get_pool', lambda: FakePool(row))
+    database._personalization_cache.invalidate(9)
+
+    first = get_user_personalization(9)['data']
+    first['learning_profile']['weak_topics'].append('caller mutation')
+    second = get_user_personalization(9)['data']
+
+    assert second['learning_profile'] == {'weak_topics': ['受力分析']}
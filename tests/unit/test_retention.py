@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the background retention worker."""
+
+import os
+import time
+
+from retention import RetentionWorker, retain_uploads
+from session_store import FileSessionStore
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_sweep_removes_expired_sessions_and_stale_uploads(tmp_path):
+    store = FileSessionStore(str(tmp_path / 'sessions'), ttl=60)
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+
+    store.save('expired', {'x': 1}, ttl=-1)
+    store.save('live', {'x': 2})
+    (uploads / '20240101_120000_000001_1_stale.png').write_bytes(b'x' * 10)
+    (uploads / '20240101_120000_000002_1_fresh.png').write_bytes(b'y' * 10)
+    _age(uploads / '20240101_120000_000001_1_stale.png', 120)
+
+    worker = RetentionWorker(store, str(uploads), upload_ttl=60, batch_size=1, batch_pause=0)
+    worker.run_once()
+
+    assert store.load('expired') is None
+    assert store.load('live') == {'x': 2}
+    assert not (uploads / '20240101_120000_000001_1_stale.png').exists()
+    assert (uploads / '20240101_120000_000002_1_fresh.png').exists()
+
+    stats = worker.stats()
+    assert stats['runs'] == 1
+    assert stats['sessions_removed'] == 1
+    assert stats['uploads_removed'] == 1
+    assert stats['upload_bytes_reclaimed'] == 10
+    assert stats['session_bytes_reclaimed'] > 0
+
+
+def test_sweep_only_removes_app_generated_uploads(tmp_path):
+    store = FileSessionStore(str(tmp_path / 'sessions'), ttl=60)
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    generated = ['20240101_120000_000001_1_a.png', '20240101_120000_000001_2_b.jpg.part', 'temp_20240101_120000_000001.png']
+    foreign = ['.gitkeep', 'README.txt', 'operator-backup.png']
+    for name in generated + foreign:
+        (uploads / name).write_bytes(b'x')
+        _age(uploads / name, 120)
+
+    RetentionWorker(store, str(uploads), upload_ttl=60, batch_pause=0).run_once()
+
+    assert sorted(os.listdir(uploads)) == sorted(foreign)
+
+
+def test_upload_ttl_never_shorter_than_session_ttl(tmp_path):
+    store = FileSessionStore(str(tmp_path / 'sessions'), ttl=3600)
+    worker = RetentionWorker(store, str(tmp_path), upload_ttl=60)
+    assert worker.upload_ttl == 3600
+
+
+def test_retain_uploads_keeps_referenced_images(tmp_path):
+    store = FileSessionStore(str(tmp_path / 'sessions'), ttl=60)
+    uploads = tmp_path / 'uploads'
+    uploads.mkdir()
+    image = uploads / '20240101_120000_000003_1_shared.png'
+    image.write_bytes(b'z')
+    _age(image, 120)
+
+    retain_uploads([str(image)])
+    RetentionWorker(store, str(uploads), upload_ttl=60, batch_pause=0).run_once()
+
+    assert image.exists()
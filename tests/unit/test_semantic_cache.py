@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the semantic near-duplicate question index."""
+
+from answer_cache import AnswerCache
+from semantic_cache import SemanticQuestionIndex, question_numbers, question_symbols
+
+QUESTION = '一个质量为2kg的物体，受到10N的水平拉力，求物体的加速度。'
+
+
+def _session(question, **overrides):
+    data = {'type': 'text', 'question': question, 'subject': 'physics', 'lang': 'zh-CN',
+            'level_effective': 'standard', 'teaching_phase': 2}
+    data.update(overrides)
+    return data
+
+
+def test_numbers_are_normalized_and_ordered():
+    assert question_numbers('m=2.0kg, F=10N, t=0.50s') == ('2', '10', '.5')
+    assert question_numbers('F=10N, m=2kg') != question_numbers('m=2kg, F=10N')
+
+
+def test_symbol_case_is_part_of_the_partition():
+    assert question_symbols('质量为 m 的物块放在质量为 M 的木板上，10N') == ('m', 'M', 'N')
+
+    index = SemanticQuestionIndex(threshold=0.75)
+    lower = '质量为m的小球以速度v撞上静止的小球，求碰后速度'
+    index.add('physics', lower, 'key-1')
+
+    assert index.find('physics', '质量为m的小球以速度v撞上静止的小球，求碰后的速度')[0] == 'key-1'
+    assert index.find('physics', '质量为M的小球以速度V撞上静止的小球，求碰后速度') is None
+    # 单词不区分大小写
+    index.add('physics', 'Find the Acceleration of the block', 'key-2')
+    assert index.find('physics', 'find the acceleration of the block') == ('key-2', 1.0)
+
+
+def test_index_matches_variants_within_scope_and_numbers_only():
+    index = SemanticQuestionIndex(threshold=0.75)
+    index.add('physics', QUESTION, 'key-1')
+
+    typo = '一个质量为2kq的物休，受到10N的水平拉力，求物体的加速度?'
+    match = index.find('physics', typo)
+    assert match[0] == 'key-1' and 0.75 <= match[1] < 1
+    assert index.find('physics', QUESTION.replace('10N', '20N')) is None
+    assert index.find('chemistry', typo) is None
+    assert index.find('physics', '写出铁与稀盐酸反应的化学方程式') is None
+
+    index.discard('key-1')
+    assert index.find('physics', QUESTION) is None
+    assert index.stats()['entries'] == 0
+
+
+def test_index_evicts_oldest_entries():
+    index = SemanticQuestionIndex(threshold=0.99, max_entries=1)
+    index.add('s', QUESTION, 'old')
+    index.add('s', '写出铁与稀盐酸反应的化学方程式', 'new')
+
+    assert index.find('s', QUESTION) is None
+    assert index.find('s', '写出铁与稀盐酸反应的化学方程式') == ('new', 1.0)
+    assert index.stats()['evictions'] == 1
+
+
+def test_answer_cache_serves_semantic_hits_for_text_questions_only():
+    cache = AnswerCache(semantic_index=SemanticQuestionIndex(threshold=0.75))
+    events = [{'type': 'answer', 'content': 'a = 5 m/s²'}]
+    original = _session(QUESTION)
+    key, entry, _ = cache.lookup(original)
+    assert entry is None
+    cache.store(original, key, events, {'answer': 'a = 5 m/s²'})
+
+    variant = _session('一个质量为2kg的物休，受到10N的水平拉力，求物体的加速度')
+    variant_key, entry, similarity = cache.lookup(variant)
+    assert variant_key != key
+    assert entry['events'] == events and similarity < 1
+    assert cache.lookup(_session(variant['question'], level_effective='basic'))[1] is None
+
+    image = _session(QUESTION, type='image_stream', upload_hashes=['a' * 64])
+    image_key, _, _ = cache.lookup(image)
+    cache.store(image, image_key, events, {'answer': 'x'})
+    assert cache.lookup(_session(variant['question'], type='image_stream', upload_hashes=['b' * 64]))[1] is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['semantic_hits'], stats['misses']) == (0, 1, 4)
+    assert stats['semantic_index']['entries'] == 1
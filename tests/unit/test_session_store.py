@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the pluggable session store backends."""
+
+import json
+import os
+import socketserver
+import threading
+import time
+
+import pytest
+
+from session_codec import JsonCodec, OrjsonCodec, decode, orjson
+from session_store import (
+    FileSessionStore,
+    MemorySessionStore,
+    RedisSessionStore,
+    SQLiteSessionStore,
+    response_key,
+)
+
+
+class _FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough RESP for RedisSessionStore (GET/SET EX/DEL)."""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            if name == b'GET':
+                item = data.get(args[1])
+                if item and item[1] is not None and item[1] <= time.monotonic():
+                    data.pop(args[1], None)
+                    item = None
+                reply = self._bulk(item[0] if item else None)
+            elif name == b'SET':
+                expires_at = None
+                if len(args) >= 5 and args[3].upper() == b'EX':
+                    expires_at = time.monotonic() + int(args[4])
+                data[args[1]] = (args[2], expires_at)
+                reply = b'+OK\r\n'
+            elif name == b'DEL':
+                reply = b':%d\r\n' % (1 if data.pop(args[1], None) else 0)
+            else:
+                reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _FakeRedisHandler)
+    server.daemon_threads = True
+    server.data = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['file', 'sqlite', 'memory', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'file':
+        yield FileSessionStore(str(tmp_path / 'sessions'))
+    elif request.param == 'sqlite':
+        store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+        yield store
+        store.close()
+    elif request.param == 'memory':
+        yield MemorySessionStore(max_entries=16)
+    else:
+        server = request.getfixturevalue('fake_redis')
+        host, port = server.server_address
+        store = RedisSessionStore(f'redis://{host}:{port}/0')
+        yield store
+        store.close()
+
+
+def test_save_load_delete_round_trip(store):
+    data = {'question': '牛顿第二定律', 'images': ['a.png'], 'deep_think': True}
+    store.save('20240101120000000000', data)
+    store.save(response_key('20240101120000000000'), {'answer': 'F=ma'})
+
+    assert store.load('20240101120000000000') == data
+    assert store.load('20240101120000000000_response') == {'answer': 'F=ma'}
+    assert store.load('missing') is None
+
+    store.delete('20240101120000000000')
+    assert store.load('20240101120000000000') is None
+
+
+def test_invalid_keys_are_rejected(store):
+    assert store.load('../etc/passwd') is None
+    with pytest.raises(ValueError):
+        store.save('../escape', {'x': 1})
+
+
+def test_loaded_data_is_a_copy(store):
+    store.save('abc', {'items': [1]})
+    loaded = store.load('abc')
+    loaded['items'].append(2)
+    assert store.load('abc') == {'items': [1]}
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    store.save('short', {'x': 1}, ttl=0.01)
+    store.save('long', {'x': 2})
+    time.sleep(0.02)
+
+    assert store.load('short') is None
+    assert store.purge_expired()['removed'] == 1
+    assert store.load('long') == {'x': 2}
+
+
+def test_file_store_reads_legacy_files(tmp_path):
+    directory = tmp_path / 'sessions'
+    store = FileSessionStore(str(directory))
+    with open(directory / 'legacy.json', 'w', encoding='utf-8') as f:
+        json.dump({'question': 'old'}, f)
+
+    assert store.load('legacy') == {'question': 'old'}
+
+    old = time.time() - store.ttl - 10
+    os.utime(directory / 'legacy.json', (old, old))
+    assert store.purge_expired()['removed'] == 1
+    assert not (directory / 'legacy.json').exists()
+
+
+@pytest.mark.parametrize('codec', [JsonCodec(), OrjsonCodec()] if orjson else [JsonCodec()])
+def test_codecs_write_compact_json_readable_by_any_codec(tmp_path, codec):
+    store = FileSessionStore(str(tmp_path), codec=codec)
+    store.save('abc', {'answer': '加速度 a = F/m'})
+
+    raw = (tmp_path / 'abc.json').read_bytes()
+    assert b'\n' not in raw and b': ' not in raw
+    assert decode(raw)['data'] == {'answer': '加速度 a = F/m'}
+    assert FileSessionStore(str(tmp_path), codec=JsonCodec()).load('abc') == {'answer': '加速度 a = F/m'}
+
+
+def test_file_store_writes_atomically(tmp_path):
+    store = FileSessionStore(str(tmp_path))
+    store.save('abc', {'x': 1})
+    store.save('abc', {'x': 2})
+
+    assert sorted(os.listdir(tmp_path)) == ['abc.json']
+    assert store.load('abc') == {'x': 2}
+
+
+def test_decode_accepts_legacy_pretty_printed_json():
+    payload = json.dumps({'question': '旧数据'}, ensure_ascii=False, indent=2).encode('utf-8')
+    assert decode(b'\n' + payload) == {'question': '旧数据'}
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for coalescing concurrent identical generations."""
+
+import threading
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _drain(generator):
+    events = []
+    while True:
+        try:
+            events.append(next(generator))
+        except StopIteration as stop:
+            return events, stop.value
+
+
+def test_late_joiner_replays_prefix_and_shares_one_generation():
+    flights = SingleFlight(wait_timeout=5)
+    release = threading.Event()
+    calls, completed = [], []
+
+    def producer():
+        calls.append(1)
+        yield {'type': 'thinking', 'content': 'a'}
+        release.wait(5)
+        yield {'type': 'answer', 'content': 'b'}
+        return {'answer': 'b'}
+
+    leader = flights.subscribe('key', producer, lambda events, response: completed.append((events, response)))
+    assert next(leader) == {'type': 'thinking', 'content': 'a'}
+
+    late = flights.subscribe('key', producer)
+    assert next(late) == {'type': 'thinking', 'content': 'a'}
+    release.set()
+
+    assert _drain(leader) == ([{'type': 'answer', 'content': 'b'}], {'answer': 'b'})
+    assert _drain(late) == ([{'type': 'answer', 'content': 'b'}], {'answer': 'b'})
+    assert len(calls) == 1
+    assert completed == [([{'type': 'thinking', 'content': 'a'}, {'type': 'answer', 'content': 'b'}], {'answer': 'b'})]
+    assert flights.stats() == {'flights': 1, 'coalesced': 1, 'late_joins': 1, 'errors': 0, 'in_flight': 0}
+
+
+def test_upstream_error_reaches_every_subscriber_and_clears_the_flight():
+    flights = SingleFlight(wait_timeout=5)
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        yield {'type': 'thinking', 'content': 'a'}
+        raise RuntimeError('upstream failed')
+
+    subscribers = [flights.subscribe('key', failing) for _ in range(3)]
+    release.set()
+    for subscriber in subscribers:
+        with pytest.raises(RuntimeError, match='upstream failed'):
+            _drain(subscriber)
+
+    def succeeding():
+        yield {'type': 'answer', 'content': 'ok'}
+        return {'answer': 'ok'}
+
+    assert _drain(flights.subscribe('key', succeeding)) == ([{'type': 'answer', 'content': 'ok'}], {'answer': 'ok'})
+    assert flights.stats()['flights'] == 2
+    assert flights.stats()['errors'] == 1
+
+
+def test_stalled_upstream_times_out_waiting_subscribers():
+    flights = SingleFlight(wait_timeout=0.05)
+    release = threading.Event()
+
+    def stalled():
+        release.wait(5)
+        yield {'type': 'answer', 'content': 'late'}
+
+    with pytest.raises(TimeoutError):
+        _drain(flights.subscribe('key', stalled))
+    release.set()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the in-process TTL/LRU cache."""
+
+import time
+
+from ttl_cache import TTLCache
+
+
+def test_get_set_and_hit_rate():
+    cache = TTLCache(max_entries=4, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(max_entries=4, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_removes_entry():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_set_is_skipped_after_invalidation_during_read():
+    cache = TTLCache(max_entries=4, ttl=60)
+    generation = cache.generation()
+    cache.invalidate("a")  # 读取期间写入方提交并失效
+
+    assert cache.set("a", "stale", generation=generation) is False
+    assert cache.get("a") is None
+    assert cache.set("a", "fresh", generation=cache.generation()) is True
+    assert cache.get("a") == "fresh"
+    assert cache.stats()['stale_sets'] == 1
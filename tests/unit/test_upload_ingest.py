@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for streaming multipart upload ingestion."""
+
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+from upload_ingest import UploadRejected, ingest_multipart
+
+
+def _allowed(filename):
+    return filename.rsplit('.', 1)[-1].lower() in {'png', 'jpg'}
+
+
+def _body(images, **fields):
+    values = MultiDict(fields)
+    for name, data in images:
+        values.add('image', FileStorage(io.BytesIO(data), filename=name))
+    boundary, body = encode_multipart(values)
+    return boundary, io.BytesIO(body)
+
+
+def _ingest(tmp_path, images, chunk_size=7, **limits):
+    boundary, stream = _body(images, question='求加速度', subject='physics')
+    return ingest_multipart(
+        stream, boundary, str(tmp_path), 'ts', allowed_file=_allowed, chunk_size=chunk_size, **limits
+    )
+
+
+def test_files_are_written_hashed_and_fields_parsed(tmp_path):
+    first, second = b'\x89PNG' + b'a' * 100, b'\xff\xd8' + b'b' * 50
+
+    fields, files = _ingest(tmp_path, [('one.png', first), ('two.jpg', second)])
+
+    assert fields == {'question': '求加速度', 'subject': 'physics'}
+    assert [f.filename for f in files] == ['ts_1_one.png', 'ts_2_two.jpg']
+    assert [f.size for f in files] == [len(first), len(second)]
+    assert files[0].sha256 == hashlib.sha256(first).hexdigest()
+    assert (tmp_path / 'ts_2_two.jpg').read_bytes() == second
+    assert sorted(os.listdir(tmp_path)) == ['ts_1_one.png', 'ts_2_two.jpg']
+
+
+@pytest.mark.parametrize('images, limits, message', [
+    ([('ok.png', b'a'), ('big.png', b'b' * 200)], {'max_file_size': 100}, 'File too large'),
+    ([('ok.png', b'a'), ('evil.exe', b'b')], {}, 'File type not allowed'),
+    ([('a.png', b'a'), ('b.png', b'b'), ('c.png', b'c')], {'max_files': 2}, 'Too many images'),
+    ([('a.png', b'a' * 500)], {'max_total_size': 300}, 'Request too large'),
+])
+def test_rejected_uploads_leave_no_files_behind(tmp_path, images, limits, message):
+    with pytest.raises(UploadRejected) as exc_info:
+        _ingest(tmp_path, images, **limits)
+
+    assert exc_info.value.message.startswith(message)
+    assert os.listdir(tmp_path) == []
+
+
+def test_validation_failure_stops_ingestion_and_cleans_up(tmp_path):
+    def reject_second(path):
+        if path.endswith('_2_two.png'):
+            raise UploadRejected('Unrecognized or corrupt image')
+
+    with pytest.raises(UploadRejected, match='corrupt'):
+        _ingest(tmp_path, [('one.png', b'a'), ('two.png', b'b'), ('three.png', b'c')], validate_file=reject_second)
+
+    assert os.listdir(tmp_path) == []